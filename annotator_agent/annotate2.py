@@ -1,93 +1,312 @@
 import os
-import json
-from typing import List, Dict, Optional
+import sys
+import orjson
+import asyncio
+import hashlib
+import sqlite3
+from collections import deque
+from typing import List, Dict, Optional, Iterable, Iterator, AsyncIterator
 
+import ijson
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_core.pydantic_v1 import BaseModel, Field
+from pydantic import BaseModel, Field
+
+# llm_client.py and event_schema.py live in the repository root, one level above this script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import llm_client
+from event_schema import EVENT_SCHEMA_REFERENCE
 
 # --- Configuration ---
 load_dotenv()
-# A powerful model like gpt-4o is essential for preserving complex nested JSON structures accurately.
-llm = ChatOpenAI(temperature=0, model_name="gpt-4o")
+# The model only writes short descriptions against a structured-output schema, so a smaller,
+# faster model is the default. The larger model is only used to retry a batch whose output fails validation.
+ANNOTATOR_MODEL = os.getenv("ANNOTATOR_MODEL", "gpt-4o-mini")
+ANNOTATOR_ESCALATION_MODEL = os.getenv("ANNOTATOR_ESCALATION_MODEL", "gpt-4o")
+llm = llm_client.get_llm(ANNOTATOR_MODEL)
+escalation_llm = llm_client.get_llm(ANNOTATOR_ESCALATION_MODEL)
 
-# --- Pydantic Models to define the EXACT output structure ---
+# Number of events sent to the LLM in a single structured-output call.
+BATCH_SIZE = 15
+# Maximum number of batches in flight at once, to stay within the OpenAI rate limits.
+MAX_CONCURRENT_REQUESTS = 4
+# Maximum number of batches read ahead of the output file before reading the input pauses.
+MAX_PENDING_BATCHES = MAX_CONCURRENT_REQUESTS * 2
 
-# First, define the nested 'target' object
-class Target(BaseModel):
-    """Represents the target element of a browser event."""
-    selector: str
-    xpath: str
+# SQLite file that memoizes descriptions across runs, keyed by a hash of each event and its predecessor.
+MEMO_FILENAME = "enrichment_memo.sqlite3"
+
+# --- Pydantic Models to define the EXACT output structure ---
 
-# Now, define the full structure of the final, enriched event object.
-# It includes ALL original fields plus the new one.
-class EnrichedEvent(BaseModel):
-    """A model representing a single, complete event object after enrichment."""
+# The LLM only returns the new field, keyed by the event id; every original field is already
+# known client-side and is merged back in after the call instead of being echoed by the model.
+class DescribedEvent(BaseModel):
+    """The generated description for a single event."""
     id: str
-    target: Target
-    timestamp: int
-    type: str
-    url: str
-    value: Optional[str]
     element_description: str = Field(description="The rich, contextual description of the user's action and intent.")
 
-# Finally, a wrapper model for the list of events, which is what the LLM will return.
-class EnrichedEventList(BaseModel):
-    """A Pydantic model representing the list of all enriched events."""
-    events: List[EnrichedEvent]
+# A wrapper model for the list of descriptions, which is what the LLM will return.
+class DescribedEventList(BaseModel):
+    """A Pydantic model representing the descriptions for a batch of events."""
+    items: List[DescribedEvent]
+
+# --- Prompt ---
+# The system prompt is a module-level constant so every request sends the exact same prefix;
+# only the event JSON in the human message varies between calls.
+SYSTEM_PROMPT = """
+You are an expert user journey analyst. Your task is to read a JSON list of sequential browser events and write an `element_description` for each one.
+
+**CRITICAL INSTRUCTIONS:**
+
+1.  **Return Only Descriptions:** For each input event, return one item containing the event's `id`, copied unchanged, and its `element_description`. Do not repeat any other fields.
+    -   **Grouped Input:** To save space, consecutive events that share the same `target` and `url` are sent as one group: `{"shared": {"target": ..., "url": ...}, "events": [{"id", "timestamp", "type", "value"}, ...]}`. Every event in a group's `events` list happened on the group's shared `target` and `url`.
+
+2.  **Write `element_description`:** This field must contain a rich, human-readable description of the user's action and intent.
+
+3.  **Use Context for Descriptions:** You must analyze the entire sequence of events to write the description. The meaning of an action is defined by what came before it.
+    -   **BAD (No Context):** A click on `div.result-item` is described as "A container element."
+    -   **GOOD (With Context):** If the previous event was typing 'Oppenheimer', a click on `div.result-item` should be described as "The primary search result link for 'Oppenheimer'."
+
+4.  **Final Output Structure:** Your final output must be a single JSON object with one key, "items", which holds exactly one `{id, element_description}` item per input event, in the original order.
+""" + EVENT_SCHEMA_REFERENCE + "\n\n---EVENTS BELOW---\n"
 
 # Bind the Pydantic model to the LLM to force it to return the exact structure we need.
-structured_llm = llm.with_structured_output(EnrichedEventList)
+# Strict JSON-schema decoding constrains generation to the schema, so the items always parse.
+structured_llm = llm.with_structured_output(DescribedEventList, method="json_schema", strict=True)
+escalation_structured_llm = escalation_llm.with_structured_output(DescribedEventList, method="json_schema", strict=True)
 
 
-def enrich_events_in_batch(events: List[Dict]) -> Optional[List[EnrichedEvent]]:
+def group_shared_fields(events: List[Dict]) -> List[Dict]:
     """
-    Uses a structured-output LLM to transform a list of raw events into a list of enriched events.
-    The LLM is responsible for preserving all original data.
+    Groups consecutive events that share the same `target` and `url`, so the shared block is
+    sent to the LLM once per run instead of once per event.
 
     Args:
-        events: The complete list of raw event dictionaries from the Chrome extension.
+        events: A batch of raw event dictionaries.
 
     Returns:
-        A list of EnrichedEvent objects, or None if an error occurs.
+        A list of `{"shared": {...}, "events": [...]}` groups, in the original event order.
     """
-    system_prompt = """
-    You are an expert user journey analyst. Your task is to transform a JSON list of sequential browser events. For each event object in the input list, you must return a new JSON object that is a copy of the original but with one new key added: `element_description`.
-
-    **CRITICAL INSTRUCTIONS:**
+    groups = []
+    for event in events:
+        shared = {"target": event.get("target"), "url": event.get("url")}
+        delta = {k: v for k, v in event.items() if k not in shared}
+        if groups and groups[-1]["shared"] == shared:
+            groups[-1]["events"].append(delta)
+        else:
+            groups.append({"shared": shared, "events": [delta]})
+    return groups
 
-    1.  **Preserve ALL Original Data:** You MUST copy every key and value from the original event object (`id`, `target`, `timestamp`, `type`, `url`, `value`, etc.) into the new object without any modification.
 
-    2.  **Add `element_description`:** This new field must contain a rich, human-readable description of the user's action and intent.
+async def enrich_events_in_batch(events: List[Dict]) -> Optional[List[Dict]]:
+    """
+    Uses a structured-output LLM to generate an `element_description` for each event in a batch,
+    then merges the descriptions into copies of the original event dictionaries by id.
 
-    3.  **Use Context for Descriptions:** You must analyze the entire sequence of events to write the description. The meaning of an action is defined by what came before it.
-        -   **BAD (No Context):** A click on `div.result-item` is described as "A container element."
-        -   **GOOD (With Context):** If the previous event was typing 'Oppenheimer', a click on `div.result-item` should be described as "The primary search result link for 'Oppenheimer'."
+    Args:
+        events: A batch of raw event dictionaries from the Chrome extension.
 
-    4.  **Final Output Structure:** Your final output must be a single JSON object with one key, "events", which holds the complete list of your newly created, enriched event objects.
-    """
-    
-    human_prompt = f"""
-    Please transform the following sequence of browser events, adding an `element_description` to each one while preserving all original data:
-    {json.dumps(events, indent=2)}
+    Returns:
+        A list of enriched event dictionaries in the original order, or None if an error occurs.
     """
-
+    # The static prompt is the system message; only the event JSON is sent in the human message.
     messages = [
-        SystemMessage(content=system_prompt),
-        HumanMessage(content=human_prompt),
+        SystemMessage(content=SYSTEM_PROMPT),
+        HumanMessage(content=orjson.dumps(group_shared_fields(events), option=orjson.OPT_INDENT_2).decode()),
     ]
 
+    async def transform(runnable) -> List[Dict]:
+        response = await runnable.ainvoke(messages)
+        descriptions = {item.id: item.element_description for item in response.items}
+        # Sanity-check that the LLM described every input event
+        missing = [event.get("id") for event in events if event.get("id") not in descriptions]
+        if missing:
+            raise ValueError(f"No description returned for event(s): {missing}")
+        return [{**event, "element_description": descriptions[event["id"]]} for event in events]
+
     try:
-        print("Sending the entire journey to the LLM for transformation...")
-        response = structured_llm.invoke(messages)
-        print("Transformation complete.")
-        return response.events
+        print(f"Sending a batch of {len(events)} events to the LLM for transformation...")
+        try:
+            enriched_events = await transform(structured_llm)
+        except ValueError as e:
+            # Pydantic's ValidationError and LangChain's OutputParserException are both ValueErrors
+            print(f"Output failed validation ({e}). Retrying the batch with {ANNOTATOR_ESCALATION_MODEL}...")
+            enriched_events = await transform(escalation_structured_llm)
+        print("Batch transformation complete.")
+        return enriched_events
     except Exception as e:
         print(f"An error occurred during the LLM call: {e}")
         return None
 
 
+# --- Persistent Memoization ---
+# Descriptions depend on context, so each key combines the event's own content hash with the
+# content hash of the event before it. Identical clicks that follow different actions do not collide.
+_memo_connection: Optional[sqlite3.Connection] = None
+
+def _get_memo_connection() -> sqlite3.Connection:
+    """Opens the memo database on first use and reuses the connection afterwards."""
+    global _memo_connection
+    if _memo_connection is None:
+        _memo_connection = sqlite3.connect(MEMO_FILENAME)
+        _memo_connection.execute("PRAGMA journal_mode=WAL")
+        _memo_connection.execute("CREATE TABLE IF NOT EXISTS descriptions (key TEXT PRIMARY KEY, description TEXT NOT NULL)")
+    return _memo_connection
+
+def _event_content_hash(event: Dict) -> str:
+    """Hashes the fields of an event that determine its description."""
+    target = event.get("target") or {}
+    canonical = orjson.dumps(
+        [event.get("type"), target.get("selector"), target.get("xpath"), event.get("value")]
+    )
+    return hashlib.blake2b(canonical).hexdigest()
+
+def _memo_key(content_hash: str, prev_content_hash: str) -> str:
+    return hashlib.blake2b(f"{prev_content_hash}:{content_hash}".encode()).hexdigest()
+
+def get_memoized_descriptions(keys: List[str]) -> Dict[str, str]:
+    """Returns the memoized descriptions for whichever of the given keys are present."""
+    placeholders = ",".join("?" * len(keys))
+    rows = _get_memo_connection().execute(
+        f"SELECT key, description FROM descriptions WHERE key IN ({placeholders})", keys
+    )
+    return dict(rows.fetchall())
+
+def memoize_descriptions(entries: Dict[str, str]):
+    """Stores newly generated descriptions in the memo database."""
+    connection = _get_memo_connection()
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO descriptions (key, description) VALUES (?, ?)", entries.items())
+
+
+def iter_batches(events: Iterable[Dict], batch_size: int = BATCH_SIZE) -> Iterator[List[Dict]]:
+    """Groups an iterable of events (e.g. a streaming ijson parser) into lists of batch_size."""
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def iter_enriched_batches(events: Iterable[Dict]) -> AsyncIterator[List[Dict]]:
+    """
+    Splits the journey into batches of BATCH_SIZE and enriches them concurrently,
+    with at most MAX_CONCURRENT_REQUESTS LLM calls in flight at once. Each batch is
+    dispatched as soon as it has been read, so a streaming parser overlaps reading
+    the input with the LLM calls. Events with a memoized description from a previous
+    run are not sent to the LLM.
+
+    Enriched batches are yielded in their original order as soon as they are ready, and
+    reading pauses while MAX_PENDING_BATCHES are unfinished, so memory stays bounded by
+    the batches in flight rather than the length of the journey.
+
+    Args:
+        events: An iterable of raw event dictionaries from the Chrome extension.
+
+    Raises:
+        RuntimeError: If any batch fails to enrich.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def enrich_batch(batch: List[Dict], keys: List[str]) -> Optional[List[Dict]]:
+        memoized = get_memoized_descriptions(keys)
+        misses = [event for event, key in zip(batch, keys) if key not in memoized]
+        enriched_misses = []
+        if misses:
+            async with semaphore:
+                enriched_misses = await enrich_events_in_batch(misses)
+            if enriched_misses is None:
+                return None
+            memoize_descriptions({
+                key: enriched["element_description"]
+                for key, enriched in zip((k for k in keys if k not in memoized), enriched_misses)
+            })
+
+        # Stitch the memoized and freshly generated events back together in the original order
+        fresh = iter(enriched_misses)
+        return [
+            {**event, "element_description": memoized[key]} if key in memoized else next(fresh)
+            for event, key in zip(batch, keys)
+        ]
+
+    async def finished(task: asyncio.Task) -> List[Dict]:
+        result = await task
+        if not result:
+            raise RuntimeError("Failed to generate enriched data from the LLM.")
+        return result
+
+    pending: deque = deque()
+    try:
+        prev_content_hash = ""
+        for batch in iter_batches(events):
+            keys = []
+            for event in batch:
+                content_hash = _event_content_hash(event)
+                keys.append(_memo_key(content_hash, prev_content_hash))
+                prev_content_hash = content_hash
+            pending.append(asyncio.create_task(enrich_batch(batch, keys)))
+            # Yield to the event loop so the batch's request starts before the next one is read
+            await asyncio.sleep(0)
+            # Hand back every finished batch at the head of the queue; wait on it once too many are pending
+            while pending and (pending[0].done() or len(pending) >= MAX_PENDING_BATCHES):
+                yield await finished(pending.popleft())
+        while pending:
+            yield await finished(pending.popleft())
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def enrich_events(events: Iterable[Dict]) -> Optional[List[Dict]]:
+    """
+    Enriches the whole journey in memory.
+
+    Returns:
+        The enriched events in their original order, or None if any batch fails.
+    """
+    enriched_events = []
+    try:
+        async for batch in iter_enriched_batches(events):
+            enriched_events.extend(batch)
+    except Exception as e:
+        print(f"An error occurred while enriching events: {e}")
+        return None
+    return enriched_events
+
+
+async def write_enriched_events(events: Iterable[Dict], output_filename: str) -> int:
+    """
+    Streams the enriched events into a JSON array file as each batch is ready.
+    The array is written to a '.partial' file that replaces output_filename only once every
+    batch has succeeded, so a failed run never leaves a truncated output behind.
+
+    Returns:
+        The number of events written.
+    """
+    partial_filename = output_filename + ".partial"
+    count = 0
+    try:
+        with open(partial_filename, 'wb') as f:
+            f.write(b'[')
+            async for batch in iter_enriched_batches(events):
+                for event in batch:
+                    f.write(b',\n' if count else b'\n')
+                    f.write(orjson.dumps(event))
+                    count += 1
+            f.write(b'\n]' if count else b']')
+        if not count:
+            raise RuntimeError("Failed to generate enriched data from the LLM.")
+        os.replace(partial_filename, output_filename)
+    except BaseException:
+        if os.path.exists(partial_filename):
+            os.remove(partial_filename)
+        raise
+    return count
+
+
 if __name__ == "__main__":
     INPUT_FILENAME = "azure_action.json"
     OUTPUT_FILENAME = "azure_action_enriched.json"
@@ -95,29 +314,18 @@ if __name__ == "__main__":
     print(f"Attempting to read raw events from '{INPUT_FILENAME}'...")
 
     try:
-        with open(INPUT_FILENAME, 'r') as f:
-            raw_events_data = json.load(f)
-
-        # 1. Generate the complete list of enriched objects in a single, robust call.
-        #    No manual merging is needed.
-        enriched_events_list = enrich_events_in_batch(raw_events_data)
-
-        if not enriched_events_list:
-            raise Exception("Failed to generate enriched data from the LLM.")
-
-        # 2. Convert the list of Pydantic models back to a list of dictionaries for saving.
-        output_data = [event.dict() for event in enriched_events_list]
-        
-        # 3. Save the final, enriched file.
-        with open(OUTPUT_FILENAME, 'w') as f:
-            json.dump(output_data, f, indent=2)
-            
-        print(f"\n✅ Success! Enriched file saved to '{OUTPUT_FILENAME}'.")
+        # Stream-parse the input, enrich it with concurrent batched calls and write each batch to
+        # the output as soon as it is ready. The descriptions are merged back onto the original events by id.
+        with open(INPUT_FILENAME, 'rb') as f:
+            raw_events = ijson.items(f, 'item', use_float=True)
+            event_count = asyncio.run(write_enriched_events(raw_events, OUTPUT_FILENAME))
+
+        print(f"\n✅ Success! {event_count} enriched events saved to '{OUTPUT_FILENAME}'.")
         print("Each object now contains all original data plus the new 'element_description' field.")
 
     except FileNotFoundError:
         print(f"\n❌ ERROR: Input file not found: '{INPUT_FILENAME}'")
-    except json.JSONDecodeError:
+    except ijson.JSONError:
         print(f"\n❌ ERROR: Could not decode JSON from '{INPUT_FILENAME}'.")
     except Exception as e:
         print(f"\n❌ An unexpected error occurred: {e}")
\ No newline at end of file
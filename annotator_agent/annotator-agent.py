@@ -1,21 +1,120 @@
 import os
-import json
-from typing import List, Dict
+import sys
+import orjson
+import asyncio
+import hashlib
+import shelve
+from typing import List, Dict, Optional, Iterable, Iterator
 
+import ijson
+
+import numpy as np
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from langchain_openai import OpenAIEmbeddings
 from langchain_core.messages import SystemMessage, HumanMessage
+from pydantic import BaseModel, Field
+
+# llm_client.py and event_schema.py live in the repository root, one level above this script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import llm_client
+from event_schema import EVENT_SCHEMA_REFERENCE
 
 # --- Configuration ---
 # Load environment variables from .env file (for OPENAI_API_KEY)
 load_dotenv()
 
 # Initialize the Chat LLM. Using a powerful model like gpt-4o is recommended for this kind of nuanced analysis.
-llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
+llm = llm_client.get_llm("gpt-4o-mini")
+
+# Number of events sent to the LLM in a single structured-output call.
+BATCH_SIZE = 15
+# Maximum number of batches in flight at once, to stay within the OpenAI rate limits.
+MAX_CONCURRENT_REQUESTS = 4
+
+# --- Prompts ---
+# The system prompts are module-level constants so every request sends the exact same prefix;
+# only the event JSON in the human message varies between calls.
+SINGLE_EVENT_SYSTEM_PROMPT = """
+You are an expert web automation analyst. Your task is to analyze a JSON object representing a single browser event and write a concise, human-readable description for it.
+
+Focus on what the user is trying to achieve with the action.
+- If the type is 'click', describe what is being clicked on. Infer the element's purpose from its selector (e.g., 'button#suggestion-search-button' is a search button).
+- If the type is 'type' or 'change', describe what text is being entered and where.
+- Be clear and use simple language.
+- Your response MUST be only the description sentence itself, with no extra text or labels.
+
+Example Input:
+{ "type": "click", "target": { "selector": "button#suggestion-search-button" } }
+
+Example Output:
+Clicks the search button to find results for the entered text.
+""" + EVENT_SCHEMA_REFERENCE + "\n\n---EVENT BELOW---\n"
+
+BATCH_SYSTEM_PROMPT = """
+You are an expert web automation analyst. Your task is to analyze a JSON list of sequential browser events and write a concise, human-readable description for each one.
+
+Focus on what the user is trying to achieve with each action.
+- If the type is 'click', describe what is being clicked on. Infer the element's purpose from its selector (e.g., 'button#suggestion-search-button' is a search button).
+- If the type is 'type' or 'change', describe what text is being entered and where.
+- Use the surrounding events for context; the meaning of an action is often defined by what came before it.
+- Be clear and use simple language.
+- Return exactly one item per input event, with `id` copied unchanged from the event and `action_description` holding only the description sentence.
+""" + EVENT_SCHEMA_REFERENCE + "\n\n---EVENTS BELOW---\n"
+
+# --- Pydantic Models to define the batched output structure ---
+class ActionDescription(BaseModel):
+    """The generated description for a single event, keyed by the event's id."""
+    id: str
+    action_description: str = Field(description="A concise, human-readable description of the user's action.")
+
+class ActionDescriptionList(BaseModel):
+    """A Pydantic model representing the descriptions for a batch of events."""
+    items: List[ActionDescription]
 
-def get_action_description(event_object: Dict) -> str:
+# Bind the Pydantic model to the LLM so one call returns a description for every event in the batch.
+structured_llm = llm.with_structured_output(ActionDescriptionList)
+
+# --- Response Cache ---
+# Tier 1: exact-match lookups on a canonical hash of the event, persisted across runs with shelve.
+# Tier 2: semantic lookups against embeddings of previously described events, kept in memory.
+CACHE_FILENAME = "action_description_cache"
+SEMANTIC_CACHE_THRESHOLD = 0.95
+
+embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+_semantic_vectors: List[np.ndarray] = []
+_semantic_descriptions: List[str] = []
+
+def _event_cache_text(event_object: Dict) -> str:
+    """Builds a canonical string from the fields that determine an event's description."""
+    return orjson.dumps({k: event_object.get(k) for k in ('type', 'target', 'value')}, option=orjson.OPT_SORT_KEYS).decode()
+
+def _event_cache_key(event_object: Dict) -> str:
+    return hashlib.blake2b(_event_cache_text(event_object).encode()).hexdigest()
+
+def get_cached_description(event_object: Dict) -> Optional[str]:
+    """Returns the exact-match cached description for an event, or None on a miss."""
+    with shelve.open(CACHE_FILENAME) as cache:
+        return cache.get(_event_cache_key(event_object))
+
+def cache_description(event_object: Dict, description: str):
+    """Stores a generated description in the exact-match cache."""
+    with shelve.open(CACHE_FILENAME) as cache:
+        cache[_event_cache_key(event_object)] = description
+
+def _find_semantic_match(vector: np.ndarray) -> Optional[str]:
+    """Returns the description of the most similar cached event if it clears the threshold."""
+    if not _semantic_vectors:
+        return None
+    similarities = np.stack(_semantic_vectors) @ vector
+    best = int(np.argmax(similarities))
+    if similarities[best] >= SEMANTIC_CACHE_THRESHOLD:
+        return _semantic_descriptions[best]
+    return None
+
+async def get_action_description(event_object: Dict) -> str:
     """
     Uses an LLM to generate a human-readable description for a single browser event object.
+    Results are served from the exact-match cache first, then the semantic cache, before calling the LLM.
 
     Args:
         event_object: A dictionary representing a single event from the Chrome extension.
@@ -23,66 +122,123 @@ def get_action_description(event_object: Dict) -> str:
     Returns:
         A string containing the generated action description.
     """
-    # The system prompt sets the context and goal for the LLM.
-    system_prompt = """
-    You are an expert web automation analyst. Your task is to analyze a JSON object representing a single browser event and write a concise, human-readable description for it.
+    cached = get_cached_description(event_object)
+    if cached is not None:
+        return cached
 
-    Focus on what the user is trying to achieve with the action.
-    - If the type is 'click', describe what is being clicked on. Infer the element's purpose from its selector (e.g., 'button#suggestion-search-button' is a search button).
-    - If the type is 'type' or 'change', describe what text is being entered and where.
-    - Be clear and use simple language.
-    - Your response MUST be only the description sentence itself, with no extra text or labels.
+    vector = None
+    try:
+        vector = np.asarray(await embeddings.aembed_query(_event_cache_text(event_object)))
+        vector = vector / np.linalg.norm(vector)
+        match = _find_semantic_match(vector)
+        if match is not None:
+            cache_description(event_object, match)
+            return match
+    except Exception as e:
+        print(f"Semantic cache lookup failed, falling back to the LLM: {e}")
 
-    Example Input:
-    { "type": "click", "target": { "selector": "button#suggestion-search-button" } }
+    # The static prompt is the system message; only the event JSON is sent in the human message.
+    messages = [
+        SystemMessage(content=SINGLE_EVENT_SYSTEM_PROMPT),
+        HumanMessage(content=orjson.dumps(event_object, option=orjson.OPT_INDENT_2).decode()),
+    ]
 
-    Example Output:
-    Clicks the search button to find results for the entered text.
-    """
+    try:
+        response = await llm.ainvoke(messages)
+        description = response.content.strip()
+    except Exception as e:
+        print(f"An error occurred while calling the LLM: {e}")
+        return "Could not determine action description."
 
-    # We format the specific event object as a string for the human message.
-    human_prompt = f"""
-    Please generate the action description for the following event:
-    {json.dumps(event_object, indent=2)}
+    cache_description(event_object, description)
+    if vector is not None:
+        _semantic_vectors.append(vector)
+        _semantic_descriptions.append(description)
+    return description
+
+
+async def describe_events_in_batch(events: List[Dict]) -> Dict[str, str]:
     """
+    Uses a structured-output LLM to generate action descriptions for a batch of events in a single call.
 
+    Args:
+        events: A list of event dictionaries from the Chrome extension.
+
+    Returns:
+        A dictionary mapping each event 'id' to its generated description. Empty if the call fails.
+    """
     messages = [
-        SystemMessage(content=system_prompt),
-        HumanMessage(content=human_prompt),
+        SystemMessage(content=BATCH_SYSTEM_PROMPT),
+        HumanMessage(content=orjson.dumps(events, option=orjson.OPT_INDENT_2).decode()),
     ]
 
     try:
-        response = llm.invoke(messages)
-        return response.content.strip()
+        response = await structured_llm.ainvoke(messages)
+        return {item.id: item.action_description.strip() for item in response.items}
     except Exception as e:
-        print(f"An error occurred while calling the LLM: {e}")
-        return "Could not determine action description."
+        print(f"An error occurred while calling the LLM for a batch: {e}")
+        return {}
+
+
+def iter_batches(events: Iterable[Dict], batch_size: int = BATCH_SIZE) -> Iterator[List[Dict]]:
+    """Groups an iterable of events (e.g. a streaming ijson parser) into lists of batch_size."""
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
-def annotate_events(events: List[Dict]) -> List[Dict]:
+async def annotate_events(events: Iterable[Dict]) -> List[Dict]:
     """
-    Takes a list of raw browser events and adds an 'action_description' to each one.
+    Takes raw browser events and adds an 'action_description' to each one.
+    Events are described in batches of BATCH_SIZE, with up to MAX_CONCURRENT_REQUESTS batches
+    in flight at once; any event missing from a batch response falls back to an individual
+    `get_action_description` call. Each batch is dispatched as soon as it has been read, so a
+    streaming parser overlaps reading the input with the LLM calls.
 
     Args:
-        events: A list of event dictionaries.
+        events: An iterable of event dictionaries.
 
     Returns:
-        The same list of events, with each dictionary now containing an 'action_description' key.
+        The list of events, with each dictionary now containing an 'action_description' key.
     """
+    print("Starting annotation...")
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def annotate_batch(start: int, batch: List[Dict]):
+        async with semaphore:
+            print(f"  - Annotating events {start + 1}-{start + len(batch)}...")
+
+            # Only send events that are not already in the exact-match cache
+            cached = [get_cached_description(event) for event in batch]
+            misses = [event for event, hit in zip(batch, cached) if hit is None]
+            descriptions = await describe_events_in_batch(misses) if misses else {}
+
+            # Merge the descriptions back onto the original event objects by id
+            for event, description in zip(batch, cached):
+                if description is None:
+                    description = descriptions.get(event.get('id'))
+                    if description is not None:
+                        cache_description(event, description)
+                    else:
+                        print(f"    - Retrying event individually (ID: {event.get('id', 'N/A')})...")
+                        description = await get_action_description(event)
+                event['action_description'] = description
+
     annotated_events = []
-    print(f"Starting annotation for {len(events)} events...")
-
-    for i, event in enumerate(events):
-        print(f"  - Annotating event {i + 1}/{len(events)} (ID: {event.get('id', 'N/A')})...")
-        
-        # Generate the description for the current event
-        description = get_action_description(event)
-        
-        # Add the new key to the event object
-        event['action_description'] = description
-        annotated_events.append(event)
-        
-    print("Annotation complete.")
+    tasks = []
+    for batch in iter_batches(events):
+        tasks.append(asyncio.create_task(annotate_batch(len(annotated_events), batch)))
+        annotated_events.extend(batch)
+        # Yield to the event loop so the batch's request starts before the next one is read
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+    print(f"Annotation complete for {len(annotated_events)} events.")
     return annotated_events
 
 
@@ -96,15 +252,16 @@ if __name__ == "__main__":
     print(f"Attempting to read raw events from '{INPUT_FILENAME}'...")
 
     try:
-        with open(INPUT_FILENAME, 'r') as f:
-            raw_events_data = json.load(f)
+        # Stream-parse the input so batches are sent to the LLM while the rest of the file is read
+        with open(INPUT_FILENAME, 'rb') as f:
+            raw_events = ijson.items(f, 'item', use_float=True)
 
-        # Run the annotation process
-        annotated_data = annotate_events(raw_events_data)
+            # Run the annotation process
+            annotated_data = asyncio.run(annotate_events(raw_events))
 
         # Save the newly enriched JSON to a new file
-        with open(OUTPUT_FILENAME, 'w') as f:
-            json.dump(annotated_data, f, indent=2)
+        with open(OUTPUT_FILENAME, 'wb') as f:
+            f.write(orjson.dumps(annotated_data, option=orjson.OPT_INDENT_2))
             
         print(f"\n✅ Success! Annotated events have been saved to '{OUTPUT_FILENAME}'.")
         print("You can now use this file as the 'context_filename' for your browser agent.")
@@ -112,5 +269,5 @@ if __name__ == "__main__":
     except FileNotFoundError:
         print(f"\n❌ ERROR: Input file not found.")
         print(f"Please make sure a file named '{INPUT_FILENAME}' exists in the same directory as this script.")
-    except json.JSONDecodeError:
+    except ijson.JSONError:
         print(f"\n❌ ERROR: Could not decode JSON from '{INPUT_FILENAME}'. Please ensure it is a valid JSON file.")
\ No newline at end of file
@@ -0,0 +1,245 @@
+import json
+import time
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+# --- Browser-side element waits over the Chrome DevTools Protocol ---
+# WebDriverWait polls the driver over HTTP every 500ms. These waits send a single Runtime.evaluate
+# whose promise resolves inside the page (via a MutationObserver) as soon as the element is ready.
+
+# JavaScript that finds the first element matching each locator strategy, given the locator value `v`
+_FIND_ELEMENT_JS = {
+    By.CSS_SELECTOR: "document.querySelector(v)",
+    By.ID: "document.getElementById(v)",
+    By.NAME: "document.getElementsByName(v)[0]",
+    By.CLASS_NAME: "document.getElementsByClassName(v)[0]",
+    By.TAG_NAME: "document.getElementsByTagName(v)[0]",
+    By.XPATH: "document.evaluate(v, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue",
+}
+
+# condition -> (JavaScript test on the found element `el`, WebDriverWait condition used by the fallback)
+# The clickable fallback only waits for presence; the rest of the check is _CLICKABLE_JS on that element.
+_CONDITIONS = {
+    "present": ("!!el", EC.presence_of_element_located),
+    "visible": ("!!el && el.getClientRects().length > 0", EC.visibility_of_element_located),
+    "clickable": ("!!el && el.getClientRects().length > 0 && !el.disabled", EC.presence_of_element_located),
+}
+_CLICKABLE_JS = "const el = arguments[0]; return !el.disabled && el.getClientRects().length > 0;"
+
+_WAIT_JS = """
+new Promise((resolve, reject) => {{
+    const v = {value};
+    const ready = () => {{ const el = {find}; return {test}; }};
+    if (ready()) {{ resolve(true); return; }}
+    const timer = setTimeout(() => {{ observer.disconnect(); reject(new Error("timeout")); }}, {timeout_ms});
+    const observer = new MutationObserver(() => {{
+        if (ready()) {{ clearTimeout(timer); observer.disconnect(); resolve(true); }}
+    }});
+    observer.observe(document, {{ subtree: true, childList: true, attributes: true }});
+}})
+"""
+
+def cdp_wait_for(driver, locator: tuple, timeout_ms: int = 10000, condition: str = "clickable"):
+    """
+    Waits inside the browser until the element at `locator` meets `condition`, then returns it.
+    Falls back to a regular WebDriverWait for locator strategies the script cannot evaluate, or
+    when the DevTools call itself fails (e.g. the page navigated while waiting).
+
+    Raises:
+        TimeoutException: If the element does not meet the condition within timeout_ms.
+    """
+    by, value = locator
+    test, expected_condition = _CONDITIONS[condition]
+    find = _FIND_ELEMENT_JS.get(by)
+    # Taken before the DevTools attempt, so a fallback after a late CDP failure only gets the time left
+    deadline = time.monotonic() + timeout_ms / 1000
+    # Plain Remote sessions (e.g. the shared chromedriver) have no DevTools command endpoint
+    if find is not None and hasattr(driver, "execute_cdp_cmd"):
+        expression = _WAIT_JS.format(value=json.dumps(value), find=find, test=test, timeout_ms=timeout_ms)
+        try:
+            result = driver.execute_cdp_cmd(
+                "Runtime.evaluate", {"expression": expression, "awaitPromise": True, "returnByValue": True}
+            )
+        except WebDriverException:
+            result = None
+        if result is not None:
+            if "exceptionDetails" in result:
+                raise TimeoutException(f"Element {by}={value} was not {condition} within {timeout_ms}ms")
+            return driver.find_element(by, value)
+
+    element = WebDriverWait(driver, max(deadline - time.monotonic(), 0)).until(expected_condition(locator))
+    if condition == "clickable":
+        # One script call per poll on the element already found, instead of element_to_be_clickable
+        # re-finding it and querying its displayed and enabled state separately on every tick
+        WebDriverWait(driver, max(deadline - time.monotonic(), 0)).until(
+            lambda d: d.execute_script(_CLICKABLE_JS, element)
+        )
+    return element
+
+
+# Resolves once no resource has finished loading for idle_ms, or after timeout_ms at the latest
+_NETWORK_IDLE_JS = """
+new Promise(resolve => {{
+    let idle;
+    const done = () => {{ observer.disconnect(); clearTimeout(idle); clearTimeout(cap); resolve(true); }};
+    const observer = new PerformanceObserver(() => {{ clearTimeout(idle); idle = setTimeout(done, {idle_ms}); }});
+    observer.observe({{ entryTypes: ["resource"] }});
+    idle = setTimeout(done, {idle_ms});
+    const cap = setTimeout(done, {timeout_ms});
+}})
+"""
+
+# Resolves once the DOM has not changed for quiet_ms, or after timeout_ms at the latest
+_DOM_QUIET_JS = """
+new Promise(resolve => {{
+    let quiet;
+    const done = () => {{ observer.disconnect(); clearTimeout(quiet); clearTimeout(cap); resolve(true); }};
+    const observer = new MutationObserver(() => {{ clearTimeout(quiet); quiet = setTimeout(done, {quiet_ms}); }});
+    observer.observe(document, {{ subtree: true, childList: true, attributes: true, characterData: true }});
+    quiet = setTimeout(done, {quiet_ms});
+    const cap = setTimeout(done, {timeout_ms});
+}})
+"""
+
+def _await_in_page(driver, expression: str, timeout_ms: int):
+    """Blocks until the promise `expression` settles inside the page."""
+    try:
+        if hasattr(driver, "execute_cdp_cmd"):
+            driver.execute_cdp_cmd("Runtime.evaluate", {"expression": expression, "awaitPromise": True})
+        else:
+            # Without DevTools, wait on the same promise through WebDriver's async script support
+            driver.set_script_timeout(timeout_ms / 1000 + 1)
+            driver.execute_async_script(f"({expression}).then(arguments[arguments.length - 1]);")
+    except WebDriverException:
+        pass  # The action navigated away mid-wait; the next step's element wait covers the new page
+
+def wait_for_network_idle(driver, idle_ms: int = 300, timeout_ms: int = 2000):
+    """
+    Waits inside the browser until the page's network activity settles after an action.
+    A page that was already quiet costs only idle_ms; a busy one never costs more than timeout_ms.
+    """
+    _await_in_page(driver, _NETWORK_IDLE_JS.format(idle_ms=idle_ms, timeout_ms=timeout_ms), timeout_ms)
+
+def wait_for_dom_quiet(driver, quiet_ms: int = 300, timeout_ms: int = 2000):
+    """
+    Waits inside the browser until the page stops changing after an action (no DOM mutation for quiet_ms).
+    A page that was already settled costs only quiet_ms; a busy one never costs more than timeout_ms.
+    """
+    _await_in_page(driver, _DOM_QUIET_JS.format(quiet_ms=quiet_ms, timeout_ms=timeout_ms), timeout_ms)
+
+
+# Resolves once the document has fully loaded, or rejects after timeout_ms
+_PAGE_LOAD_JS = """
+new Promise((resolve, reject) => {{
+    if (document.readyState === "complete") {{ resolve(true); return; }}
+    const timer = setTimeout(() => reject(new Error("timeout")), {timeout_ms});
+    window.addEventListener("load", () => {{ clearTimeout(timer); resolve(true); }}, {{ once: true }});
+}})
+"""
+
+def cdp_wait_for_load(driver, timeout_ms: int = 30000):
+    """
+    Waits inside the browser for the page's load event instead of polling document.readyState.
+    Falls back to polling when DevTools is unavailable or the page navigated while waiting.
+
+    Raises:
+        TimeoutException: If the page does not finish loading within timeout_ms.
+    """
+    deadline = time.monotonic() + timeout_ms / 1000
+    if hasattr(driver, "execute_cdp_cmd"):
+        expression = _PAGE_LOAD_JS.format(timeout_ms=timeout_ms)
+        try:
+            result = driver.execute_cdp_cmd("Runtime.evaluate", {"expression": expression, "awaitPromise": True})
+        except WebDriverException:
+            result = None
+        if result is not None:
+            if "exceptionDetails" in result:
+                raise TimeoutException(f"Page did not finish loading within {timeout_ms}ms")
+            return
+    WebDriverWait(driver, max(deadline - time.monotonic(), 0), poll_frequency=0.1).until(
+        lambda d: d.execute_script("return document.readyState") == "complete"
+    )
+
+
+# --- Batched in-page reads ---
+# Reads the visible text of several elements in one execute_script call, given [by, value] pairs.
+_READ_TEXTS_JS = """
+const find = {%s};
+return arguments[0].map(([by, v]) => {
+    const el = find[by] ? find[by](v) : null;
+    return el && el.getClientRects().length > 0 ? el.innerText : null;
+});
+""" % ", ".join(f"{json.dumps(by)}: v => {find}" for by, find in _FIND_ELEMENT_JS.items())
+
+def read_texts(driver, locators: list) -> list:
+    """
+    Returns the visible text of each (by, value) locator in a single round-trip, without waiting.
+    Entries are None for elements that are missing, hidden or use an unsupported strategy.
+    """
+    return driver.execute_script(_READ_TEXTS_JS, [list(locator) for locator in locators])
+
+# Compares an element's visible text against a query inside the page, returning only the verdict and an
+# excerpt of the text instead of the whole innerText
+_MATCH_TEXT_JS = """
+const find = {%s};
+const [by, v, query, limit] = arguments;
+const el = find[by] ? find[by](v) : null;
+if (!el || el.getClientRects().length === 0) return null;
+const text = el.innerText;
+return [text.toLowerCase().includes(query.toLowerCase()), text.slice(0, limit)];
+""" % ", ".join(f"{json.dumps(by)}: v => {find}" for by, find in _FIND_ELEMENT_JS.items())
+
+def match_text(driver, locator: tuple, text: str, excerpt_length: int = 200):
+    """
+    Checks, without waiting, whether the visible element at `locator` contains `text` (case-insensitive).
+    Returns (matched, the first excerpt_length characters of the element's text), or None when the
+    element is missing, hidden or uses an unsupported strategy.
+    """
+    by, value = locator
+    return driver.execute_script(_MATCH_TEXT_JS, by, value, text, excerpt_length)
+
+
+# --- Key presses over CDP ---
+# Selenium Keys name -> (DOM key, DOM code, Windows virtual key code, text the key types)
+_CDP_KEYS = {
+    "ENTER": ("Enter", "Enter", 13, "\r"),
+    "RETURN": ("Enter", "Enter", 13, "\r"),
+    "TAB": ("Tab", "Tab", 9, None),
+    "ESCAPE": ("Escape", "Escape", 27, None),
+    "BACKSPACE": ("Backspace", "Backspace", 8, None),
+    "DELETE": ("Delete", "Delete", 46, None),
+    "SPACE": (" ", "Space", 32, " "),
+    "ARROW_UP": ("ArrowUp", "ArrowUp", 38, None),
+    "ARROW_DOWN": ("ArrowDown", "ArrowDown", 40, None),
+    "ARROW_LEFT": ("ArrowLeft", "ArrowLeft", 37, None),
+    "ARROW_RIGHT": ("ArrowRight", "ArrowRight", 39, None),
+    "UP": ("ArrowUp", "ArrowUp", 38, None),
+    "DOWN": ("ArrowDown", "ArrowDown", 40, None),
+    "LEFT": ("ArrowLeft", "ArrowLeft", 37, None),
+    "RIGHT": ("ArrowRight", "ArrowRight", 39, None),
+    "HOME": ("Home", "Home", 36, None),
+    "END": ("End", "End", 35, None),
+    "PAGE_UP": ("PageUp", "PageUp", 33, None),
+    "PAGE_DOWN": ("PageDown", "PageDown", 34, None),
+}
+
+def dispatch_key(driver, key_name: str) -> bool:
+    """
+    Presses a special key on the focused element with CDP Input.dispatchKeyEvent, without
+    locating an element first. Returns False when the key or driver is not supported, so the
+    caller can fall back to send_keys.
+    """
+    spec = _CDP_KEYS.get(key_name.upper())
+    if spec is None or not hasattr(driver, "execute_cdp_cmd"):
+        return False
+    key, code, virtual_key_code, text = spec
+    event = {"key": key, "code": code, "windowsVirtualKeyCode": virtual_key_code}
+    key_down = {**event, "type": "keyDown"}
+    if text:
+        key_down["text"] = text
+    driver.execute_cdp_cmd("Input.dispatchKeyEvent", key_down)
+    driver.execute_cdp_cmd("Input.dispatchKeyEvent", {**event, "type": "keyUp"})
+    return True
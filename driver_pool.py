@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+import threading
+import contextlib
+import subprocess
+import urllib.parse
+import urllib.request
+
+import undetected_chromedriver as uc
+from selenium import webdriver
+from selenium.webdriver.remote.remote_connection import RemoteConnection
+from selenium.common.exceptions import WebDriverException
+
+# --- Shared browser pool ---
+# Warmed Chrome instances are reused across requests instead of paying the cold start every time.
+POOL_SIZE = 4
+
+# Opt-in: drive every pooled browser through one long-lived chromedriver over keep-alive HTTP,
+# instead of undetected_chromedriver spawning (and patching) a chromedriver per browser.
+USE_SHARED_CHROMEDRIVER = os.getenv("USE_SHARED_CHROMEDRIVER", "").lower() in ("1", "true")
+CHROMEDRIVER_PORT = int(os.getenv("CHROMEDRIVER_PORT", "9515"))
+CHROMEDRIVER_URL = f"http://127.0.0.1:{CHROMEDRIVER_PORT}"
+CHROMEDRIVER_START_TIMEOUT = 10
+
+_chromedriver_process = None
+_chromedriver_lock = threading.Lock()
+
+def _ensure_shared_chromedriver():
+    """Starts the shared chromedriver on first use and blocks until it answers /status."""
+    global _chromedriver_process
+    with _chromedriver_lock:
+        if _chromedriver_process is not None:
+            return
+        _chromedriver_process = subprocess.Popen(
+            ["chromedriver", f"--port={CHROMEDRIVER_PORT}"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + CHROMEDRIVER_START_TIMEOUT
+        while True:
+            try:
+                urllib.request.urlopen(f"{CHROMEDRIVER_URL}/status", timeout=1)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"chromedriver did not start on port {CHROMEDRIVER_PORT}")
+                time.sleep(0.1)
+
+def stop_shared_chromedriver():
+    global _chromedriver_process
+    if _chromedriver_process is not None:
+        _chromedriver_process.terminate()
+        _chromedriver_process = None
+
+# Pooled browsers skip everything a scripted run does not need: a visible window, the GPU,
+# extensions and image downloads. Requests that need a real rendering ask for `render=True`.
+PERFORMANCE_CHROME_ARGUMENTS = [
+    "--headless=new",
+    "--disable-gpu",
+    "--blink-settings=imagesEnabled=false",
+    "--disable-extensions",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+]
+
+def _build_chrome_options(options, render: bool = False):
+    if not render:
+        for argument in PERFORMANCE_CHROME_ARGUMENTS:
+            options.add_argument(argument)
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    return options
+
+# Selenium's urllib3 pool keeps a single connection per host, so concurrent commands on one driver
+# (parallel read-only tools) would queue behind each other and open throwaway connections
+COMMAND_CONNECTION_POOL_SIZE = 16
+
+def widen_connection_pool(driver, maxsize: int = COMMAND_CONNECTION_POOL_SIZE):
+    """Lets up to `maxsize` WebDriver commands on `driver` share kept-alive connections concurrently."""
+    pool_manager = getattr(driver.command_executor, "_conn", None)
+    if pool_manager is None or not hasattr(pool_manager, "connection_pool_kw"):
+        return driver
+    pool_manager.connection_pool_kw["maxsize"] = maxsize
+    pool_manager.connection_pool_kw["block"] = False
+    # The pool opened for the new-session request was sized before; the next command opens a wider one
+    pool_manager.clear()
+    return driver
+
+def launch_chrome(render: bool = False):
+    if USE_SHARED_CHROMEDRIVER:
+        _ensure_shared_chromedriver()
+        return widen_connection_pool(webdriver.Remote(
+            command_executor=RemoteConnection(CHROMEDRIVER_URL, keep_alive=True),
+            options=_build_chrome_options(webdriver.ChromeOptions(), render),
+        ))
+    return widen_connection_pool(uc.Chrome(options=_build_chrome_options(uc.ChromeOptions(), render)))
+
+def _visited_origins(driver) -> set:
+    """The web origins of every page in the tab's navigation history since the last reset."""
+    history = driver.execute_cdp_cmd("Page.getNavigationHistory", {})
+    origins = set()
+    for entry in history.get("entries", []):
+        parts = urllib.parse.urlsplit(entry.get("url", ""))
+        if parts.scheme in ("http", "https"):
+            origins.add(f"{parts.scheme}://{parts.netloc}")
+    return origins
+
+def reset_driver(driver):
+    """Clears cookies and web storage so the next request starts from a blank page."""
+    if hasattr(driver, "execute_cdp_cmd"):
+        # delete_all_cookies and window.localStorage only reach the origin currently loaded; DevTools
+        # clears the cookies of every site, and the storage of every origin the previous request visited
+        origins = _visited_origins(driver)
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origin in origins:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        driver.get("about:blank")
+        driver.execute_cdp_cmd("Page.resetNavigationHistory", {})
+        return
+    driver.delete_all_cookies()
+    try:
+        driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+    except WebDriverException:
+        pass  # The current page (e.g. about:blank) has no storage to clear
+    driver.get("about:blank")
+
+class DriverPool:
+    """A fixed-size pool of browsers; each request checks one out for its whole run."""
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def start(self):
+        """Launches the pooled browsers; call from the FastAPI startup event."""
+        drivers = await asyncio.gather(*(asyncio.to_thread(launch_chrome) for _ in range(self.size)))
+        for driver in drivers:
+            self._queue.put_nowait(driver)
+        print(f"✅ Driver pool ready with {self.size} browsers.")
+
+    async def close(self):
+        """Quits every idle pooled browser; call from the FastAPI shutdown event."""
+        while not self._queue.empty():
+            await asyncio.to_thread(self._queue.get_nowait().quit)
+        stop_shared_chromedriver()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, render: bool = False):
+        """
+        Checks a browser out of the pool, waiting while all of them are busy, and returns it afterwards.
+        With render=True, a dedicated fully rendering browser is launched instead and quit afterwards.
+        """
+        if render:
+            driver = await asyncio.to_thread(launch_chrome, render=True)
+            try:
+                yield driver
+            finally:
+                await asyncio.to_thread(driver.quit)
+            return
+
+        driver = await self._queue.get()
+        try:
+            yield driver
+        finally:
+            await self._release(driver)
+
+    async def _release(self, driver):
+        # A browser that fails to reset (e.g. it was quit by a plan step) is replaced with a fresh one
+        try:
+            await asyncio.to_thread(reset_driver, driver)
+        except Exception as e:
+            print(f"Failed to reset pooled driver, replacing it: {e}")
+            try:
+                await asyncio.to_thread(driver.quit)
+            except Exception:
+                pass
+            driver = await asyncio.to_thread(launch_chrome)
+        await self._queue.put(driver)
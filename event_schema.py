@@ -0,0 +1,21 @@
+# --- Recorded event format ---
+# Stable documentation of the events the Chrome extension records, shared by the annotator scripts.
+# It is part of every system prompt, so the static prefix of each request stays byte-identical and
+# OpenAI's automatic prompt caching can reuse it.
+EVENT_SCHEMA_REFERENCE = """
+**Event Schema Reference:**
+Each event recorded by the Chrome extension is a JSON object with the following fields:
+- `id`: A unique identifier for the event, e.g. "evt-1756444288776-d5sqe". Use it unchanged whenever you refer back to an event.
+- `target`: The element the user interacted with.
+    - `target.selector`: A CSS selector for the element, built from ids, tag names and `:nth-of-type` positions. Ids (`#...`) and classes (`.`) are the strongest hints about the element's purpose.
+    - `target.xpath`: An XPath for the same element. Segments such as `BUTTON[1]`, `A[1]` or `INPUT[1]` reveal the kind of element.
+- `timestamp`: The time of the event in milliseconds since the Unix epoch. Events are listed in the order they happened.
+- `type`: The kind of interaction:
+    - `click`: The user clicked the element.
+    - `type`: The user typed text into the element; the text is in `value`.
+    - `change`: The value of a form control changed, e.g. a dropdown selection or a committed text field; the new value is in `value`.
+- `url`: The address of the page on which the event happened. A change in `url` between events means a new page was loaded.
+- `value`: The text entered or selected for `type` and `change` events, otherwise null.
+
+When a selector ends in a decorative element such as `svg`, `path` or `span`, describe the nearest meaningful ancestor (the link or button that contains it) instead.
+"""
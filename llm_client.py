@@ -0,0 +1,28 @@
+import functools
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+# --- Shared OpenAI HTTP client ---
+# Every ChatOpenAI created through get_llm() sends its async requests over this one client, so
+# modules running in the same process share a single HTTP/2 connection pool instead of opening their own.
+_shared_http = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=60,
+)
+
+@functools.lru_cache(maxsize=None)
+def get_llm(model: str = "gpt-4o-mini") -> ChatOpenAI:
+    """Returns the shared, deterministic ChatOpenAI instance for a model name."""
+    return ChatOpenAI(
+        temperature=0,
+        model_name=model,
+        http_async_client=_shared_http,
+        max_retries=2,
+        request_timeout=60,
+    )
+
+async def aclose():
+    """Closes the shared HTTP client; call once when the application shuts down."""
+    await _shared_http.aclose()
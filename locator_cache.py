@@ -0,0 +1,55 @@
+import weakref
+
+from selenium.common.exceptions import (
+    StaleElementReferenceException,
+    ElementClickInterceptedException,
+    ElementNotInteractableException,
+)
+
+from cdp_waits import cdp_wait_for
+
+# --- Per-driver cache of located elements ---
+# Repeat interactions with the same element on the same page (common in form-fill flows) reuse the
+# WebElement found the first time instead of waiting for and finding it again.
+
+class LocatorCache:
+    """
+    Resolved WebElements keyed by (current_url, condition, by, value). Nothing clears it on navigation by
+    itself: callers that navigate call clear(), and the URL in the key only guards pages seen so far.
+    """
+    def __init__(self):
+        self._elements = {}
+
+    def locate(self, driver, locator: tuple, condition: str = "clickable"):
+        """Returns the cached element for the locator on the current page, waiting for it on a miss."""
+        # An element found as merely visible must not be handed out as clickable
+        key = (driver.current_url, condition, *locator)
+        element = self._elements.get(key)
+        if element is None:
+            element = cdp_wait_for(driver, locator, condition=condition)
+            self._elements[key] = element
+        return element
+
+    def act(self, driver, locator: tuple, action, condition: str = "clickable"):
+        """
+        Runs action(element) on the located element. If the cached one has gone stale, or is covered or not
+        interactable right now, it waits for the condition again and retries once on the element it finds.
+        """
+        try:
+            return action(self.locate(driver, locator, condition))
+        except (StaleElementReferenceException, ElementClickInterceptedException, ElementNotInteractableException):
+            self._elements.pop((driver.current_url, condition, *locator), None)
+            return action(self.locate(driver, locator, condition))
+
+    def clear(self):
+        self._elements.clear()
+
+
+_caches = weakref.WeakKeyDictionary()
+
+def cache_for(driver) -> LocatorCache:
+    """Returns the locator cache belonging to a driver, creating it on first use."""
+    cache = _caches.get(driver)
+    if cache is None:
+        cache = _caches[driver] = LocatorCache()
+    return cache
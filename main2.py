@@ -1,14 +1,18 @@
 import os
 import uuid
 import asyncio
+from pathlib import Path
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from typing import List, Optional
 from dotenv import load_dotenv
 
+from driver_pool import DriverPool
+from selenium_lookups import get_selenium_by, get_selenium_key
+
 # LangChain Imports
 from langchain.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+import llm_client
 # --- MODIFIED LINE 1: Import PydanticOutputParser ---
 from langchain.output_parsers import PydanticOutputParser
 
@@ -16,7 +20,6 @@ from langchain.output_parsers import PydanticOutputParser
 import undetected_chromedriver as uc
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
@@ -50,15 +53,21 @@ class Step(BaseModel):
     """A single step in the automation plan."""
     tool: str = Field(description="The name of the tool to use for this step.")
     parameters: StepParameters
+    # Resolved once by `compile_test_plan` before any browser work starts
+    _locator: Optional[tuple] = PrivateAttr(default=None)
+    _key: Optional[str] = PrivateAttr(default=None)
 
 class TestPlan(BaseModel):
     """The complete automation plan, consisting of a list of steps."""
     steps: List[Step] = Field(description="The list of automation steps to execute.")
 
-llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
+# Shared client from llm_client.py: one HTTP/2 connection pool with pinned retries and timeout
+llm = llm_client.get_llm("gpt-4o-mini")
 
 # --- 3 MODIFIED LINE 2: Initialize the PydanticOutputParser ---
 parser = PydanticOutputParser(pydantic_object=TestPlan)
+# Serialize the TestPlan JSON schema once; it is baked into the template text below.
+FORMAT_INSTRUCTIONS = parser.get_format_instructions()
 
 # Define the detailed prompt template
 prompt_template = """
@@ -86,63 +95,119 @@ Example for verifying a page title:
 User Query: "{query}"
 """
 
+# Inline the precomputed instructions (braces escaped for the template) so the prompt has a single
+# `{query}` variable and no partial variables to resolve on each invocation.
 prompt = ChatPromptTemplate.from_template(
-template=prompt_template,
-partial_variables={"format_instructions": parser.get_format_instructions()},
+template=prompt_template.replace(
+    "{format_instructions}", FORMAT_INSTRUCTIONS.replace("{", "{{").replace("}", "}}")
+),
 )
 
 chain = prompt | llm | parser
-driver = None
+
+# --- Explicit wait settings (replace the old fixed one-second pause after every step) ---
+PAGE_LOAD_TIMEOUT = 10
+# Keys that usually submit a form and start a page transition, and how long to wait for one to begin.
+TRANSITION_KEYS = {"ENTER", "RETURN"}
+TRANSITION_START_TIMEOUT = 1
 
 
+def compile_test_plan(test_plan: TestPlan):
+    """
+    Validates every step of the plan in one pass and pre-resolves its Selenium locator and key.
+    Raises an HTTP 400 for the first invalid step, so a bad plan fails before a browser is touched.
+    """
+    known_tools = {"start_browser", "navigate", "close_session", *ELEMENT_HANDLERS}
+    for number, step in enumerate(test_plan.steps, start=1):
+        parameters = step.parameters
+        try:
+            if step.tool not in known_tools:
+                raise ValueError(f"Unknown tool: {step.tool}")
+            if parameters.by:
+                step._locator = (get_selenium_by(parameters.by), parameters.value)
+            if parameters.key:
+                step._key = get_selenium_key(parameters.key)
+            if step.tool == "press_key" and step._key is None:
+                raise ValueError("press_key requires a 'key' parameter")
+            if step.tool in ELEMENT_HANDLERS and step.tool != "press_key" and step._locator is None:
+                raise ValueError(f"{step.tool} requires 'by' and 'value' parameters")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid step {number}: {e}")
+
+
+class WebDriverManager:
+    """Holds the browser driver for a single /automate request, so concurrent requests never share one."""
+    def __init__(self, driver=None):
+        self.driver = driver
+        # Pooled drivers are reset and returned to the pool instead of being quit
+        self.pooled = driver is not None
+
+
+driver_pool = DriverPool()
+
+@app.on_event("startup")
+async def start_driver_pool():
+    await driver_pool.start()
+
+@app.on_event("shutdown")
+async def stop_driver_pool():
+    await driver_pool.close()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_client.aclose()
+
 @app.post("/automate")
 async def automate(request: AutomationRequest):
     """
     Receives a natural language query, generates automation steps,
     and executes them in a browser.
     """
-    global driver
     if not request.query:
         raise HTTPException(status_code=400, detail="Query is required")
     test_run_id = str(uuid.uuid4())
     screenshot_dir = os.path.join("screenshots", test_run_id)
     os.makedirs(screenshot_dir, exist_ok=True)
-
     try:
-        # Invoke the LangChain to get the structured test plan
-        test_plan = await chain.ainvoke({"query": request.query})
-        print("Generated Steps:", test_plan.steps)
-
-        # Execute the generated steps
-        await execute_test_steps(test_plan.steps, screenshot_dir)
+        # Each request checks out its own driver; callers wait here while all pooled browsers are busy.
+        # It is reset and returned to the pool even if an error occurs.
+        async with driver_pool.acquire() as driver:
+            driver_manager = WebDriverManager(driver)
+            # Invoke the LangChain to get the structured test plan
+            test_plan = await chain.ainvoke({"query": request.query})
+            print("Generated Steps:", test_plan.steps)
+            compile_test_plan(test_plan)
+
+            # Execute the generated steps
+            await execute_test_steps(test_plan.steps, screenshot_dir, driver_manager)
 
         return {
             "message": "Automation completed successfully!",
             "screenshot_dir": screenshot_dir,
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Automation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Automation failed: {str(e)}")
-    finally:
-        # Ensure the browser is closed even if an error occurs
-        if driver:
-            driver.quit()
-            driver = None
 
-async def execute_test_steps(steps: List[Step], screenshot_dir: str):
+async def execute_test_steps(steps: List[Step], screenshot_dir: str, driver_manager: WebDriverManager):
     """Iterates through and executes each step in the test plan."""
-    global driver
     step_counter = 1
+    # Screenshot files are written in the background; they are awaited once the plan has finished.
+    screenshot_writes = []
     for step in steps:
         try:
-            await execute_step(step)
+            await execute_step(step, driver_manager)
             # Take a screenshot after each step if the browser is open
-            if driver and step.tool != "close_session":
-                await take_screenshot(screenshot_dir, step_counter)
+            if driver_manager.driver and step.tool != "close_session":
+                screenshot_writes.append(await take_screenshot(driver_manager, screenshot_dir, step_counter))
             step_counter += 1
         except Exception as e:
             print(f"Failed to execute step: {step.model_dump_json()}", e)
+            await asyncio.gather(*screenshot_writes, return_exceptions=True)
             raise e
+    await asyncio.gather(*screenshot_writes)
     
 # async def execute_step(step: Step):
 #     """Executes a single automation step with explicit waits for robustness."""
@@ -230,21 +295,28 @@ async def execute_test_steps(steps: List[Step], screenshot_dir: str):
 #     # A small delay to allow the page to react to the action
 #     await asyncio.sleep(1)
 
-async def execute_step(step: Step):
-    """Executes a single automation step with explicit waits and handles CSS selector logic."""
-    global driver
+async def execute_step(step: Step, driver_manager: WebDriverManager):
+    """
+    Executes a single automation step with explicit waits and handles CSS selector logic.
+    Every blocking Selenium call runs in a worker thread so the event loop stays free for other requests.
+    """
+    driver = driver_manager.driver
     tool = step.tool
     parameters = step.parameters
     
     wait = WebDriverWait(driver, 10) if driver else None
 
-    if tool == "start_browser":
+    if tool == "start_browser" and driver_manager.pooled:
+        # The request already holds a warmed browser from the pool
+        pass
+
+    elif tool == "start_browser":
         browser = parameters.browser or "chrome"
         if browser.lower() == "chrome":
             options = uc.ChromeOptions()
-            driver = uc.Chrome(options=options)
+            driver_manager.driver = await asyncio.to_thread(uc.Chrome, options=options)
         elif browser.lower() == "firefox":
-            driver = webdriver.Firefox()
+            driver_manager.driver = await asyncio.to_thread(webdriver.Firefox)
         else:
             raise ValueError(f"Unsupported browser: {browser}")
     
@@ -252,87 +324,86 @@ async def execute_step(step: Step):
         raise Exception("Browser is not started. The first step must be 'start_browser'.")
 
     elif tool == "navigate":
-        driver.get(parameters.url)
-
-    # --- THE FIX IS APPLIED IN THE FOLLOWING BLOCKS ---
+        await asyncio.to_thread(driver.get, parameters.url)
+        await asyncio.to_thread(_wait_for_page_ready, driver)
 
-    elif tool == "click_element":
+    elif tool in ELEMENT_HANDLERS:
+        condition, action, timeout_message = ELEMENT_HANDLERS[tool]
         try:
-            by_strategy = parameters.by.lower()
-            if by_strategy == 'css':
-                by_strategy = 'css_selector' # Translate 'css' to the correct name
-            
-            locator = (getattr(By, by_strategy.upper()), parameters.value)
-            element = wait.until(EC.element_to_be_clickable(locator))
-            element.click()
+            if step._locator is None:
+                # Without a locator (press_key only), the key is pressed on the page body
+                element = await asyncio.to_thread(driver.find_element, By.TAG_NAME, 'body')
+            else:
+                element = await asyncio.to_thread(wait.until, condition(step._locator))
         except TimeoutException:
-            raise Exception(f"Failed to find or click element in time: {parameters.by}={parameters.value}")
+            raise Exception(f"{timeout_message}: {parameters.by}={parameters.value}")
+        await asyncio.to_thread(action, driver, element, step)
 
-    elif tool == "send_keys":
-        try:
-            by_strategy = parameters.by.lower()
-            if by_strategy == 'css':
-                by_strategy = 'css_selector'
-            
-            locator = (getattr(By, by_strategy.upper()), parameters.value)
-            element = wait.until(EC.element_to_be_clickable(locator))
-            element.send_keys(parameters.text)
-        except TimeoutException:
-            raise Exception(f"Failed to find element to send keys to in time: {parameters.by}={parameters.value}")
-
-    elif tool == "press_key":
-        key_to_press = getattr(Keys, parameters.key.upper())
-        element = None
-        if parameters.by and parameters.value:
-            try:
-                by_strategy = parameters.by.lower()
-                if by_strategy == 'css':
-                    by_strategy = 'css_selector'
-                
-                locator = (getattr(By, by_strategy.upper()), parameters.value)
-                element = wait.until(EC.element_to_be_clickable(locator))
-            except TimeoutException:
-                raise Exception(f"Failed to find element to press key on in time: {parameters.by}={parameters.value}")
-        else:
-            element = driver.find_element(By.TAG_NAME, 'body')
-        
-        element.send_keys(key_to_press)
+    elif tool == "close_session":
+        # Pooled browsers are reset and returned by the request handler rather than quit here
+        if driver and not driver_manager.pooled:
+            await asyncio.to_thread(driver.quit)
+            driver_manager.driver = None
+    else:
+        print(f"Unknown tool: {tool}")
 
-    elif tool == "verify_text":
-        try:
-            by_strategy = parameters.by.lower()
-            if by_strategy == 'css':
-                by_strategy = 'css_selector'
+    # No fixed delay here: the next step's explicit wait (e.g. element_to_be_clickable) covers UI updates.
 
-            locator = (getattr(By, by_strategy.upper()), parameters.value)
-            element = wait.until(EC.visibility_of_element_located(locator))
-            actual_text = element.text
-            expected_text = parameters.text
 
-            if expected_text.lower() not in actual_text.lower():
-                raise AssertionError(f"Text verification failed! Expected '{expected_text}', but found '{actual_text}'.")
-            
-            print(f"✅ Verification successful: Found text '{actual_text}'.")
+def _wait_for_page_ready(driver):
+    """Blocks until the current document reports readyState 'complete'."""
+    WebDriverWait(driver, PAGE_LOAD_TIMEOUT).until(
+        lambda d: d.execute_script("return document.readyState") == "complete"
+    )
 
-        except TimeoutException:
-            raise Exception(f"Failed to find element for text verification in time: {parameters.by}={parameters.value}")
-        except AssertionError as e:
-            raise e
 
-    elif tool == "close_session":
-        if driver:
-            driver.quit()
-            driver = None
-    else:
-        print(f"Unknown tool: {tool}")
+# --- Element step handlers ---
+# Each handler runs in a worker thread once the element has been located, using the step's pre-resolved fields.
+
+def _click(driver, element, step: Step):
+    element.click()
+
+def _send_keys(driver, element, step: Step):
+    element.send_keys(step.parameters.text)
 
-    await asyncio.sleep(1)
+def _press_key(driver, element, step: Step):
+    key_to_press = step._key
+    expects_transition = step.parameters.key.upper() in TRANSITION_KEYS
+    if expects_transition:
+        page = driver.find_element(By.TAG_NAME, 'html')
+
+    element.send_keys(key_to_press)
+
+    if expects_transition:
+        # Wait briefly for the old page to go stale, then for the new one to finish loading
+        try:
+            WebDriverWait(driver, TRANSITION_START_TIMEOUT).until(EC.staleness_of(page))
+        except TimeoutException:
+            pass  # The key press did not navigate away from the page
+        _wait_for_page_ready(driver)
+
+def _verify_text(driver, element, step: Step):
+    actual_text = element.text
+    expected_text = step.parameters.text
+    if expected_text.lower() not in actual_text.lower():
+        raise AssertionError(f"Text verification failed! Expected '{expected_text}', but found '{actual_text}'.")
+    print(f"✅ Verification successful: Found text '{actual_text}'.")
+
+# tool -> (wait condition for the element, handler, message used when the element is not found in time)
+ELEMENT_HANDLERS = {
+    "click_element": (EC.element_to_be_clickable, _click, "Failed to find or click element in time"),
+    "send_keys": (EC.element_to_be_clickable, _send_keys, "Failed to find element to send keys to in time"),
+    "press_key": (EC.element_to_be_clickable, _press_key, "Failed to find element to press key on in time"),
+    "verify_text": (EC.visibility_of_element_located, _verify_text, "Failed to find element for text verification in time"),
+}
 
   
-async def take_screenshot(screenshot_dir: str, step_number: int):
-    """Captures a screenshot of the current browser state."""
-    global driver
-    if driver:
-        screenshot_path = os.path.join(screenshot_dir, f"step_{step_number}.png")
-        driver.save_screenshot(screenshot_path)
-        print(f"Screenshot saved to {screenshot_path}")
\ No newline at end of file
+async def take_screenshot(driver_manager: WebDriverManager, screenshot_dir: str, step_number: int) -> asyncio.Task:
+    """
+    Captures a screenshot of the current browser state.
+    Only the capture happens on the critical path; the PNG is written to disk by the returned background task.
+    """
+    screenshot_path = Path(screenshot_dir) / f"step_{step_number}.png"
+    png = await asyncio.to_thread(driver_manager.driver.get_screenshot_as_png)
+    print(f"Saving screenshot to {screenshot_path}")
+    return asyncio.create_task(asyncio.to_thread(screenshot_path.write_bytes, png))
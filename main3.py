@@ -1,13 +1,21 @@
 # filename: main_agentic.py
 import os
 import uuid
+import asyncio
 import operator
+import contextvars
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional, Annotated, TypedDict
 
 from dotenv import load_dotenv
 
+from driver_pool import DriverPool, launch_chrome
+from selenium_lookups import get_selenium_by, get_selenium_key
+from locator_cache import cache_for
+from cdp_waits import dispatch_key
+from tool_scheduler import ToolScheduler, tool_turns, stream_turn, claim_turn
+
 # LangChain Imports
 from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
 from langchain_openai import ChatOpenAI
@@ -18,12 +26,8 @@ from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolExecutor
 
 # Selenium Imports
-import undetected_chromedriver as uc
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
 load_dotenv()
 
@@ -35,14 +39,37 @@ app = FastAPI(
 
 class AutomationRequest(BaseModel):
     query: str
+    # Use a fully rendering browser (images, GPU, visible window) for visual checks
+    render: bool = False
 
 # --- 2. State Management (No Globals) ---
 class WebDriverManager:
-    """A dedicated class to hold the driver, eliminating global variables."""
+    """
+    A dedicated class to hold the driver, eliminating global variables.
+    The driver is stored in a ContextVar, so every request (and the worker threads its tools run in)
+    sees the browser it checked out of the pool rather than one shared by all requests.
+    """
     def __init__(self):
-        self.driver = None
+        self._driver = contextvars.ContextVar("driver", default=None)
+
+    @property
+    def driver(self):
+        return self._driver.get()
+
+    @driver.setter
+    def driver(self, driver):
+        self._driver.set(driver)
 
 driver_manager = WebDriverManager()
+driver_pool = DriverPool()
+
+@app.on_event("startup")
+async def start_driver_pool():
+    await driver_pool.start()
+
+@app.on_event("shutdown")
+async def stop_driver_pool():
+    await driver_pool.close()
 
 # --- 3. Modular, Independent Tools ---
 @tool
@@ -52,8 +79,7 @@ def start_browser(browser: str = "chrome") -> str:
     if driver_manager.driver:
         return "Browser is already running."
     if browser.lower() == "chrome":
-        options = uc.ChromeOptions()
-        driver_manager.driver = uc.Chrome(options=options)
+        driver_manager.driver = launch_chrome()
         return f"Chrome browser started successfully."
     else:
         return "Unsupported browser. Please choose 'chrome'."
@@ -63,6 +89,8 @@ def navigate_to_url(url: str) -> str:
     """Navigates the browser to a specified URL."""
     if not driver_manager.driver:
         return "Error: Browser not started. Call start_browser first."
+    # Elements located on the previous page are no longer valid
+    cache_for(driver_manager.driver).clear()
     driver_manager.driver.get(url)
     return f"Successfully navigated to {url}."
 
@@ -71,15 +99,10 @@ def click_element(by: str, value: str) -> str:
     """Clicks on an element found by a locator (e.g., 'xpath', 'css', 'id')."""
     if not driver_manager.driver:
         return "Error: Browser not started."
-    # Translate 'css' to 'css_selector'
-    by_strategy = by.lower()
-    if by_strategy == 'css':
-        by_strategy = 'css_selector'
     try:
-        wait = WebDriverWait(driver_manager.driver, 10)
-        locator = (getattr(By, by_strategy.upper()), value)
-        element = wait.until(EC.element_to_be_clickable(locator))
-        element.click()
+        locator = (get_selenium_by(by), value)
+        driver = driver_manager.driver
+        cache_for(driver).act(driver, locator, lambda element: element.click())
         return f"Successfully clicked element with {by}='{value}'."
     except Exception as e:
         return f"Error clicking element with {by}='{value}': {e}"
@@ -89,14 +112,10 @@ def send_keys_to_element(by: str, value: str, text: str) -> str:
     """Sends text to an element found by a locator."""
     if not driver_manager.driver:
         return "Error: Browser not started."
-    by_strategy = by.lower()
-    if by_strategy == 'css':
-        by_strategy = 'css_selector'
     try:
-        wait = WebDriverWait(driver_manager.driver, 10)
-        locator = (getattr(By, by_strategy.upper()), value)
-        element = wait.until(EC.element_to_be_clickable(locator))
-        element.send_keys(text)
+        locator = (get_selenium_by(by), value)
+        driver = driver_manager.driver
+        cache_for(driver).act(driver, locator, lambda element: element.send_keys(text))
         return f"Successfully sent '{text}' to element with {by}='{value}'."
     except Exception as e:
         return f"Error sending keys to element: {e}"
@@ -107,18 +126,14 @@ def press_key_on_element(key: str, by: Optional[str] = None, value: Optional[str
     if not driver_manager.driver:
         return "Error: Browser not started."
     try:
-        key_to_press = getattr(Keys, key.upper())
-        element = None
+        key_to_press = get_selenium_key(key)
+        driver = driver_manager.driver
         if by and value:
-            by_strategy = by.lower()
-            if by_strategy == 'css':
-                by_strategy = 'css_selector'
-            wait = WebDriverWait(driver_manager.driver, 10)
-            locator = (getattr(By, by_strategy.upper()), value)
-            element = wait.until(EC.element_to_be_clickable(locator))
-        else:
-            element = driver_manager.driver.find_element(By.TAG_NAME, 'body')
-        element.send_keys(key_to_press)
+            locator = (get_selenium_by(by), value)
+            cache_for(driver).act(driver, locator, lambda element: element.send_keys(key_to_press))
+        elif not dispatch_key(driver, key):
+            # No DevTools support for this key or driver: fall back to typing it into the page body
+            driver.find_element(By.TAG_NAME, 'body').send_keys(key_to_press)
         return f"Successfully pressed key '{key}'."
     except Exception as e:
         return f"Error pressing key: {e}"
@@ -128,14 +143,10 @@ def verify_text_on_element(by: str, value: str, text: str) -> str:
     """Verifies that an element contains the expected text."""
     if not driver_manager.driver:
         return "Error: Browser not started."
-    by_strategy = by.lower()
-    if by_strategy == 'css':
-        by_strategy = 'css_selector'
     try:
-        wait = WebDriverWait(driver_manager.driver, 10)
-        locator = (getattr(By, by_strategy.upper()), value)
-        element = wait.until(EC.visibility_of_element_located(locator))
-        actual_text = element.text
+        locator = (get_selenium_by(by), value)
+        driver = driver_manager.driver
+        actual_text = cache_for(driver).act(driver, locator, lambda element: element.text, condition="visible")
         if text.lower() in actual_text.lower():
             return f"✅ Verification successful: Found text '{text}' in element."
         else:
@@ -147,8 +158,7 @@ def verify_text_on_element(by: str, value: str, text: str) -> str:
 def close_browser() -> str:
     """Closes the browser session. Call this when the task is complete."""
     if driver_manager.driver:
-        driver_manager.driver.quit()
-        driver_manager.driver = None
+        # The pooled browser is reset and returned to the pool when the request finishes, not quit here
         return "Browser closed successfully."
     return "Browser was not running."
 
@@ -165,43 +175,67 @@ tool_executor = ToolExecutor(tools)
 llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
 model_with_tools = llm.bind_tools(tools)
 
-def agent_node(state: AgentState):
-    response = model_with_tools.invoke(state["messages"])
+# Tools that change the browser session or page state must run one at a time, in the order the agent
+# issued them. The remaining (read-only) tools only wait for the state-changing calls issued before them.
+SEQUENTIAL_TOOLS = {
+    "start_browser", "navigate_to_url", "click_element", "send_keys_to_element",
+    "press_key_on_element", "close_browser",
+}
+# Create a simple map of tool names to their callable functions
+tool_map = {t.name: t for t in tools}
+
+def _run_tool(call) -> str:
+    """Runs a single tool call and returns its output as a string."""
+    tool_name = call['name']
+
+    # Look up the correct tool function from our map
+    tool_to_call = tool_map.get(tool_name)
+    if not tool_to_call:
+        # Handle the rare case where the AI calls a tool that doesn't exist
+        error_message = f"Error: Tool '{tool_name}' not found."
+        print(error_message)
+        return error_message
+
+    # Call the tool's underlying function directly with the arguments
+    output = tool_to_call.invoke(call['args'])
+    print(f"---TOOL: Output of {tool_name}: {output}---")
+    return str(output)
+
+
+def _new_scheduler() -> ToolScheduler:
+    # Sequential tools wait for every earlier call of the turn; the read-only ones (verifies) run concurrently
+    return ToolScheduler(lambda call: asyncio.to_thread(_run_tool, call), lambda name: name not in SEQUENTIAL_TOOLS)
+
+async def agent_node(state: AgentState):
+    """
+    Streams the model's response and starts each tool call as soon as it is complete,
+    so tool execution overlaps with the model still generating the rest of the turn.
+    """
+    response = await stream_turn(model_with_tools, state["messages"], _new_scheduler())
     return {"messages": [response]}
 
-def tool_node(state: AgentState):
-    """The tool node executes the tool chosen by the agent."""
+async def tool_node(state: AgentState):
+    """The tool node collects the results of the tools started by the agent."""
     print("---TOOL: Executing action---")
-    
-    # Create a simple map of tool names to their callable functions
-    tool_map = {t.name: t for t in tools}
 
     # The last message should be the AI's tool call
     tool_calls = state["messages"][-1].tool_calls
-    tool_messages = []
-
-    for call in tool_calls:
-        # Get the tool name and its arguments from the agent's call
-        tool_name = call['name']
-        tool_args = call['args']
-
-        # Look up the correct tool function from our map
-        tool_to_call = tool_map.get(tool_name)
-
-        if tool_to_call:
-            # Call the tool's underlying function directly with the arguments
-            output = tool_to_call.invoke(tool_args)
-            
-            print(f"---TOOL: Output of {tool_name}: {output}---")
-            
-            # Create the ToolMessage to send back to the agent
-            tool_messages.append(ToolMessage(content=str(output), tool_call_id=call["id"]))
-        else:
-            # Handle the rare case where the AI calls a tool that doesn't exist
-            error_message = f"Error: Tool '{tool_name}' not found."
-            print(error_message)
-            tool_messages.append(ToolMessage(content=error_message, tool_call_id=call["id"]))
+    scheduler = claim_turn(tool_calls)
+    if scheduler is None:
+        scheduler = _new_scheduler()
+        for call in tool_calls:
+            scheduler.dispatch(call)
+    # Results come back in call order
+    outputs = await scheduler.results(return_exceptions=True)
 
+    # Create the ToolMessages to send back to the agent
+    tool_messages = [
+        ToolMessage(
+            content=f"Error running tool '{call['name']}': {output}" if isinstance(output, BaseException) else output,
+            tool_call_id=call["id"],
+        )
+        for call, output in zip(tool_calls, outputs)
+    ]
     return {"messages": tool_messages}
 
 
@@ -225,13 +259,16 @@ async def automate(request: AutomationRequest):
         raise HTTPException(status_code=400, detail="Query is required")
     initial_messages = [HumanMessage(content=request.query)]
     try:
-        # The graph manages its own state and execution flow
-        await app_graph.ainvoke({"messages": initial_messages})
+        # The browser is checked out for this request only and reset back into the pool afterwards
+        async with driver_pool.acquire(render=request.render) as driver:
+            driver_manager.driver = driver
+            # The graph manages its own state and execution flow; stream it to log each node as it finishes
+            # Tool calls still running when the graph stops are finished before the browser is returned
+            async with tool_turns():
+                async for update in app_graph.astream({"messages": initial_messages}):
+                    print(f"---GRAPH: {', '.join(update)} finished---")
         return {"message": "Automation task processed successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
     finally:
-        # Final safety net to ensure browser is always closed
-        if driver_manager.driver:
-            driver_manager.driver.quit()
-            driver_manager.driver = None
\ No newline at end of file
+        driver_manager.driver = None
\ No newline at end of file
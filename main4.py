@@ -1,28 +1,31 @@
-import os
 import uuid
 import asyncio
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel, Field
 from typing import List, Optional, TypedDict
 
 from dotenv import load_dotenv
 
+from driver_pool import DriverPool, launch_chrome
+from selenium_lookups import get_selenium_by, get_selenium_key
+from locator_cache import cache_for
+from cdp_waits import wait_for_network_idle, read_texts, dispatch_key
+
 # LangChain Imports
 from langchain.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain.output_parsers import PydanticOutputParser
+import llm_client
 
 # LangGraph Imports
 from langgraph.graph import StateGraph, END
 
 # Selenium Imports
-import undetected_chromedriver as uc
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, AssertionError
+from selenium.common.exceptions import TimeoutException, AssertionError, WebDriverException
 
 
 # Load environment variables from a .env file
@@ -39,6 +42,7 @@ app = FastAPI(
 class AutomationRequest(BaseModel):
     """The request model for the /automate endpoint."""
     query: str
+    render: bool = Field(False, description="Use a fully rendering browser (images, GPU, visible window) for visual checks.")
 
 class StepParameters(BaseModel):
     """Defines the possible parameters for any given automation step."""
@@ -58,6 +62,20 @@ class TestPlan(BaseModel):
     """The complete automation plan, consisting of a list of steps."""
     steps: List[Step] = Field(description="The list of automation steps to execute.")
 
+driver_pool = DriverPool()
+
+# Each run saves its screenshots in a subdirectory of this root, created once at import
+SCREENSHOT_ROOT = Path("screenshots")
+SCREENSHOT_ROOT.mkdir(exist_ok=True)
+
+@app.on_event("startup")
+async def start_driver_pool():
+    await driver_pool.start()
+
+@app.on_event("shutdown")
+async def stop_driver_pool():
+    await driver_pool.close()
+
 # --- 3. LangGraph State Definition ---
 # This is the "memory" of our graph. It holds all the data that moves between nodes.
 class GraphState(TypedDict):
@@ -65,7 +83,8 @@ class GraphState(TypedDict):
     test_plan: Optional[TestPlan]
     driver: Optional[webdriver.Chrome]  # Store the driver in the state
     step_index: int
-    screenshot_dir: str
+    screenshot_dir: Path
+    screenshot_writes: List[asyncio.Task]  # Background screenshot file writes, awaited once the graph ends
     result_message: Optional[str]
 
 
@@ -74,125 +93,264 @@ class GraphState(TypedDict):
 # It takes the driver as an argument instead of relying on a global variable.
 async def execute_single_step(step: Step, driver: webdriver.Chrome) -> webdriver.Chrome:
     """Executes a single automation step and returns the driver."""
-    tool = step.tool
-    parameters = step.parameters
-    wait = WebDriverWait(driver, 10)
-
-    if tool == "start_browser":
-        if not driver:  # Only start if one isn't already running
-            browser = parameters.browser or "chrome"
-            if browser.lower() == "chrome":
-                options = uc.ChromeOptions()
-                driver = uc.Chrome(options=options)
-            else:
-                raise ValueError(f"Unsupported browser: {browser}")
-    elif not driver:
+    handler = STEP_HANDLERS.get(step.tool)
+    if not handler:
+        raise ValueError(f"Unknown tool: {step.tool}")
+    if not driver and step.tool != "start_browser":
         raise Exception("Browser is not started. The first step must be 'start_browser'.")
-    elif tool == "navigate":
-        driver.get(parameters.url)
-    elif tool == "click_element":
-        locator = (getattr(By, parameters.by.upper()), parameters.value)
-        element = wait.until(EC.element_to_be_clickable(locator))
-        element.click()
-    elif tool == "send_keys":
-        locator = (getattr(By, parameters.by.upper()), parameters.value)
-        element = wait.until(EC.element_to_be_clickable(locator))
-        element.send_keys(parameters.text)
-    elif tool == "press_key":
-        key_to_press = getattr(Keys, parameters.key.upper())
-        element = None
-        if parameters.by and parameters.value:
-            locator = (getattr(By, parameters.by.upper()), parameters.value)
-            element = wait.until(EC.element_to_be_clickable(locator))
+    # Selenium calls block, so the handler and the settle wait run in a worker thread, keeping the
+    # event loop free for other requests
+    driver = await asyncio.to_thread(handler, driver, step.parameters)
+    # Instead of a fixed delay, let the page's network activity settle after steps that change it
+    if step.tool in SETTLE_AFTER_TOOLS:
+        await asyncio.to_thread(wait_for_network_idle, driver)
+    return driver
+
+# Steps that can trigger requests or page updates; reads, start_browser and close_session skip the settle wait
+SETTLE_AFTER_TOOLS = {"navigate", "click_element", "send_keys", "press_key"}
+
+# --- Step handlers ---
+# Each handler performs one tool (in a worker thread) and returns the driver to use for the following steps.
+
+def _do_start(driver: webdriver.Chrome, parameters: StepParameters) -> webdriver.Chrome:
+    if not driver:  # Only start if one isn't already running
+        browser = parameters.browser or "chrome"
+        if browser.lower() == "chrome":
+            driver = launch_chrome()
         else:
-            element = driver.find_element(By.TAG_NAME, 'body')
-        element.send_keys(key_to_press)
-    elif tool == "verify_text":
-        locator = (getattr(By, parameters.by.upper()), parameters.value)
-        element = wait.until(EC.visibility_of_element_located(locator))
-        actual_text = element.text
-        expected_text = parameters.text
-        if expected_text.lower() not in actual_text.lower():
-            raise AssertionError(f"Text verification failed! Expected '{expected_text}', but found '{actual_text}'.")
-        print(f"✅ Verification successful: Found text '{actual_text}'.")
-    elif tool == "close_session":
-        if driver:
-            driver.quit()
-            driver = None
-    else:
-        raise ValueError(f"Unknown tool: {tool}")
-
-    await asyncio.sleep(1) # Small delay for UI to update
+            raise ValueError(f"Unsupported browser: {browser}")
+    return driver
+
+def _do_navigate(driver: webdriver.Chrome, parameters: StepParameters) -> webdriver.Chrome:
+    # Elements located on the previous page are no longer valid
+    cache_for(driver).clear()
+    driver.get(parameters.url)
+    return driver
+
+def _do_click(driver: webdriver.Chrome, parameters: StepParameters) -> webdriver.Chrome:
+    locator = (get_selenium_by(parameters.by), parameters.value)
+    cache_for(driver).act(driver, locator, lambda element: element.click())
+    return driver
+
+def _do_send_keys(driver: webdriver.Chrome, parameters: StepParameters) -> webdriver.Chrome:
+    locator = (get_selenium_by(parameters.by), parameters.value)
+    cache_for(driver).act(driver, locator, lambda element: element.send_keys(parameters.text))
     return driver
 
-async def take_screenshot(driver: webdriver.Chrome, screenshot_dir: str, step_number: int):
-    """Captures a screenshot."""
-    if driver:
-        screenshot_path = os.path.join(screenshot_dir, f"step_{step_number}.png")
-        driver.save_screenshot(screenshot_path)
-        print(f"Screenshot saved to {screenshot_path}")
+def _do_press_key(driver: webdriver.Chrome, parameters: StepParameters) -> webdriver.Chrome:
+    key_to_press = get_selenium_key(parameters.key)
+    if parameters.by and parameters.value:
+        locator = (get_selenium_by(parameters.by), parameters.value)
+        cache_for(driver).act(driver, locator, lambda element: element.send_keys(key_to_press))
+    elif not dispatch_key(driver, parameters.key):
+        # No DevTools support for this key or driver: fall back to typing it into the page body
+        driver.find_element(By.TAG_NAME, 'body').send_keys(key_to_press)
+    return driver
+
+def _do_verify(driver: webdriver.Chrome, parameters: StepParameters) -> webdriver.Chrome:
+    verify_text(parameters, driver)
+    return driver
+
+def _do_close(driver: webdriver.Chrome, parameters: StepParameters) -> webdriver.Chrome:
+    # The pooled driver is reset and returned to the pool when the request ends, never quit by a step
+    return driver
+
+STEP_HANDLERS = {
+    "start_browser": _do_start,
+    "navigate": _do_navigate,
+    "click_element": _do_click,
+    "send_keys": _do_send_keys,
+    "press_key": _do_press_key,
+    "verify_text": _do_verify,
+    "close_session": _do_close,
+}
+
+def verify_text(parameters: StepParameters, driver: webdriver.Chrome, actual_text: Optional[str] = None):
+    """
+    Checks that the step's element contains the expected text. Read-only, so safe to run concurrently.
+    When actual_text has already been read (see verify_texts), the element is not looked up again.
+    """
+    if actual_text is None:
+        locator = (get_selenium_by(parameters.by), parameters.value)
+        actual_text = cache_for(driver).act(driver, locator, lambda element: element.text, condition="visible")
+    expected_text = parameters.text
+    if expected_text.lower() not in actual_text.lower():
+        raise AssertionError(f"Text verification failed! Expected '{expected_text}', but found '{actual_text}'.")
+    print(f"✅ Verification successful: Found text '{actual_text}'.")
+
+class GroupStepError(Exception):
+    """Raised by verify_texts when one step of a group fails; offset is that step's position in the group."""
+    def __init__(self, offset: int, error: Exception):
+        super().__init__(str(error))
+        self.offset = offset
+
+def verify_texts(group: List[Step], driver: webdriver.Chrome):
+    """
+    Verifies a group of verify_text steps, reading every element's text in a single script call.
+    Elements that are not visible yet fall back to the regular, waiting verify_text.
+    """
+    locators = [(get_selenium_by(s.parameters.by), s.parameters.value) for s in group]
+    try:
+        texts = read_texts(driver, locators)
+    except WebDriverException:
+        texts = [None] * len(group)  # e.g. an invalid selector; let each step report its own error
+    for offset, (step, actual_text) in enumerate(zip(group, texts)):
+        try:
+            verify_text(step.parameters, driver, actual_text)
+        except Exception as e:
+            raise GroupStepError(offset, e) from e
+
+# Steps that do not change the page, so consecutive ones can run at the same time
+PARALLEL_SAFE_TOOLS = {"verify_text"}
+
+def next_step_group(steps: List[Step], start: int) -> List[Step]:
+    """
+    Returns the steps to execute next: a run of consecutive read-only steps against distinct
+    locators, or otherwise just the single step at `start`.
+    """
+    group = [steps[start]]
+    if group[0].tool not in PARALLEL_SAFE_TOOLS:
+        return group
+    seen = {(group[0].parameters.by, group[0].parameters.value)}
+    for step in steps[start + 1:]:
+        locator = (step.parameters.by, step.parameters.value)
+        if step.tool not in PARALLEL_SAFE_TOOLS or locator in seen:
+            break
+        seen.add(locator)
+        group.append(step)
+    return group
+
+async def take_screenshot(driver: webdriver.Chrome, screenshot_dir: Path, step_number: int) -> asyncio.Task:
+    """
+    Captures a screenshot.
+    The capture must finish before the next step changes the page, so only it is awaited;
+    the PNG is written to disk by the returned background task.
+    """
+    screenshot_path = screenshot_dir / f"step_{step_number}.png"
+    png = await asyncio.to_thread(driver.get_screenshot_as_png)
+    print(f"Saving screenshot to {screenshot_path}")
+    return asyncio.create_task(asyncio.to_thread(screenshot_path.write_bytes, png))
 
 # --- 5. LangGraph Nodes ---
 
+# The planner chain is built once at import; each request only invokes it.
+# The plan is returned through OpenAI function calling against the TestPlan schema, so the prompt
+# carries no format instructions and the response needs no JSON extraction.
+# TestPlan is a Pydantic v2 model (cached_plan relies on model_validate_json/model_dump_json), which
+# with_structured_output only accepts from langchain-core 0.2.23 on; requirements.txt pins a newer 0.2 release.
+llm = llm_client.get_llm("gpt-4o-mini")
+structured_llm = llm.with_structured_output(TestPlan)
+prompt_template = """
+You are an AI assistant that generates a series of browser automation test steps.
+Assume a browser session is already open; never emit start_browser or close_session.
+The available tools are: navigate, click_element, send_keys, press_key, and verify_text.
+`verify_text` is used to check if an element contains the expected text. It requires `by`, `value`, and `text`.
+User Query: "{query}"
+"""
+prompt = ChatPromptTemplate.from_template(template=prompt_template)
+chain = prompt | structured_llm
+
+# Steps made redundant by the driver pool; they are dropped from generated plans
+SESSION_TOOLS = {"start_browser", "close_session"}
+
+# --- Plan cache ---
+# Repeated queries (e.g. regression runs) reuse the stored plan instead of calling the planner again.
+PLAN_CACHE_FILENAME = "plan_cache.sqlite3"
+_plan_cache_connection: Optional[sqlite3.Connection] = None
+# The connection is shared by the worker threads the cache reads and writes run in
+_plan_cache_lock = threading.Lock()
+
+def _get_plan_cache_connection() -> sqlite3.Connection:
+    """Opens the plan cache on first use and reuses the connection afterwards. Call with _plan_cache_lock held."""
+    global _plan_cache_connection
+    if _plan_cache_connection is None:
+        _plan_cache_connection = sqlite3.connect(PLAN_CACHE_FILENAME, check_same_thread=False)
+        _plan_cache_connection.execute("PRAGMA journal_mode=WAL")
+        _plan_cache_connection.execute("CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, plan_json TEXT NOT NULL)")
+    return _plan_cache_connection
+
+def _plan_cache_key(query: str) -> str:
+    # Only surrounding whitespace is ignored; case can matter (typed text, expected text, URLs)
+    return hashlib.sha256(query.strip().encode()).hexdigest()
+
+def _load_plan_json(key: str) -> Optional[str]:
+    with _plan_cache_lock:
+        row = _get_plan_cache_connection().execute("SELECT plan_json FROM plans WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _store_plan_json(key: str, plan_json: str):
+    with _plan_cache_lock:
+        connection = _get_plan_cache_connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO plans (key, plan_json) VALUES (?, ?)", (key, plan_json))
+
+async def cached_plan(query: str) -> TestPlan:
+    """Returns the plan for a query from the cache, generating and storing it on a miss."""
+    key = _plan_cache_key(query)
+    # sqlite3 blocks, so cache reads and writes run in a worker thread and the event loop stays free
+    plan_json = await asyncio.to_thread(_load_plan_json, key)
+    if plan_json:
+        print("---PLAN CACHE HIT---")
+        return TestPlan.model_validate_json(plan_json)
+
+    test_plan = await chain.ainvoke({"query": query})
+    # The request already holds a pooled browser, so session steps have nothing to do
+    test_plan.steps = [step for step in test_plan.steps if step.tool not in SESSION_TOOLS]
+    await asyncio.to_thread(_store_plan_json, key, test_plan.model_dump_json())
+    return test_plan
+
 # Node 1: The Planner
 async def planner_node(state: GraphState) -> dict:
     """Generates the test plan based on the user query."""
     print("---PLANNING---")
-    query = state["query"]
-    
-    llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
-    parser = PydanticOutputParser(pydantic_object=TestPlan)
-    prompt_template = """
-    You are an AI assistant that generates a series of browser automation test steps in JSON format.
-    Your output should be only the JSON object, with no other text or formatting.
-    The available tools are: start_browser, navigate, click_element, send_keys, press_key, verify_text, and close_session.
-    `verify_text` is used to check if an element contains the expected text. It requires `by`, `value`, and `text`.
-    {format_instructions}
-    User Query: "{query}"
-    """
-    prompt = ChatPromptTemplate.from_template(
-        template=prompt_template,
-        partial_variables={"format_instructions": parser.get_format_instructions()},
-    )
-    chain = prompt | llm | parser
-    
-    test_plan = await chain.ainvoke({"query": query})
+    test_plan = await cached_plan(state["query"])
     print("Generated Plan:", test_plan)
     
     return {"test_plan": test_plan}
 
 # Node 2: The Executor
 async def executor_node(state: GraphState) -> dict:
-    """Executes a single step from the test plan."""
-    print(f"---EXECUTING STEP {state['step_index'] + 1}---")
-    
-    step = state["test_plan"].steps[state["step_index"]]
+    """
+    Executes every step of the test plan in a single node invocation, one step or one group of
+    independent read-only steps at a time, instead of looping back through the graph per step.
+    """
+    steps = state["test_plan"].steps
+    step_index = state["step_index"]
     driver = state.get("driver")
-    
-    try:
-        # Execute the step
-        driver = await execute_single_step(step, driver)
-        
-        # Take a screenshot after the step
-        if driver and step.tool != "close_session":
-            await take_screenshot(driver, state["screenshot_dir"], state["step_index"] + 1)
-        
-        # Update the state for the next loop
-        return {"driver": driver, "step_index": state["step_index"] + 1}
-    
-    except Exception as e:
-        # If any step fails, we capture the error and can decide to end the graph
-        error_message = f"Failed at step {state['step_index'] + 1} ({step.tool}): {e}"
-        print(error_message)
-        return {"result_message": error_message} # This signals an error has occurred
+
+    while step_index < len(steps):
+        group = next_step_group(steps, step_index)
+        last_step_number = step_index + len(group)
+        print(f"---EXECUTING STEPS {step_index + 1}-{last_step_number}---")
+        step = group[0]
+
+        try:
+            if len(group) > 1:
+                # Independent verifies share a single in-page read of all their elements
+                await asyncio.to_thread(verify_texts, group, driver)
+            else:
+                # Execute the step
+                driver = await execute_single_step(step, driver)
+
+            # Take a screenshot after the step (a read-only group leaves the page as it was, so one covers it)
+            if driver and step.tool != "close_session":
+                state["screenshot_writes"].append(await take_screenshot(driver, state["screenshot_dir"], last_step_number))
+        except Exception as e:
+            # If any step fails, we capture the error and stop executing the plan, naming the step that failed
+            failed_index = step_index + e.offset if isinstance(e, GroupStepError) else step_index
+            error_message = f"Failed at step {failed_index + 1} ({steps[failed_index].tool}): {e}"
+            print(error_message)
+            return {"driver": driver, "step_index": failed_index, "result_message": error_message}
+
+        step_index = last_step_number
+
+    return {"driver": driver, "step_index": step_index}
 
 # --- 6. LangGraph Conditional Edge ---
 def should_continue(state: GraphState) -> str:
-    """Determines whether to continue to the next step or end."""
-    if state.get("result_message"):
-        return "end" # An error occurred, so we stop
+    """Determines whether the plan has any steps to execute."""
     if state["step_index"] >= len(state["test_plan"].steps):
-        return "end" # We've completed all steps
+        return "end" # Nothing to execute
     return "continue"
 
 # --- 7. Building the Graph ---
@@ -204,17 +362,10 @@ workflow.add_node("executor", executor_node)
 
 # Define the workflow structure
 workflow.set_entry_point("planner")
-workflow.add_edge("planner", "executor")
-
-# Add the conditional loop
-workflow.add_conditional_edges(
-    "executor",
-    should_continue,
-    {
-        "continue": "executor",  # If should_continue returns "continue", loop back to executor
-        "end": END              # If it returns "end", finish the graph
-    }
-)
+# A plan can be empty once the session steps are dropped, so the planner also checks before executing
+workflow.add_conditional_edges("planner", should_continue, {"continue": "executor", "end": END})
+# The executor runs the whole plan itself, so it finishes the graph
+workflow.add_edge("executor", END)
 
 # Compile the graph into a runnable app
 app_graph = workflow.compile()
@@ -229,20 +380,24 @@ async def automate(request: AutomationRequest):
         raise HTTPException(status_code=400, detail="Query is required")
 
     test_run_id = str(uuid.uuid4())
-    screenshot_dir = os.path.join("screenshots", test_run_id)
-    os.makedirs(screenshot_dir, exist_ok=True)
+    screenshot_dir = SCREENSHOT_ROOT / test_run_id
+    screenshot_dir.mkdir(exist_ok=True)
     
     # Define the initial state for the graph
+    screenshot_writes = []
     initial_state = {
         "query": request.query,
         "step_index": 0,
         "screenshot_dir": screenshot_dir,
+        "screenshot_writes": screenshot_writes,
     }
     
-    final_state = None
     try:
-        # Invoke the graph with the initial state
-        final_state = await app_graph.ainvoke(initial_state)
+        # Invoke the graph with a browser checked out of the pool; it is reset and returned afterwards
+        async with driver_pool.acquire(render=request.render) as driver:
+            initial_state["driver"] = driver
+            final_state = await app_graph.ainvoke(initial_state)
+        await asyncio.gather(*screenshot_writes)
 
         # Check the final state for results
         if final_state.get("result_message"):
@@ -251,16 +406,10 @@ async def automate(request: AutomationRequest):
         else:
             return {
                 "message": "Automation completed successfully!",
-                "screenshot_dir": screenshot_dir,
+                "screenshot_dir": str(screenshot_dir),
                 "final_step_index": final_state["step_index"]
             }
             
     except Exception as e:
         # Catches exceptions outside the graph's handled logic (e.g., during planning)
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
-        
-    finally:
-        # CRITICAL: Ensure the browser is closed no matter what happens
-        if final_state and final_state.get("driver"):
-            print("---CLEANING UP BROWSER SESSION---")
-            final_state["driver"].quit()
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
\ No newline at end of file
@@ -1,14 +1,22 @@
 # filename: main5.py
 import os
+import base64
+import time
 import uuid
-import operator
+import asyncio
+import itertools
 import datetime
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import List, Optional, Annotated, TypedDict
+from typing import List, Optional, Annotated, TypedDict, Literal
 
 from dotenv import load_dotenv
 
+from driver_pool import DriverPool, launch_chrome
+from selenium_lookups import get_selenium_by
+
 # LangChain Imports
 from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, SystemMessage
 from langchain_openai import ChatOpenAI
@@ -16,15 +24,15 @@ from langchain.tools import tool
 
 # LangGraph Imports
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolExecutor
+from langgraph.graph.message import add_messages
 
 # Selenium Imports
-import undetected_chromedriver as uc
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import StaleElementReferenceException
 
 load_dotenv()
 
@@ -36,49 +44,117 @@ app = FastAPI(
 
 class AutomationRequest(BaseModel):
     query: str
+    # Use a fully rendering browser (images, GPU, visible window), e.g. for screenshots that are looked at
+    render: bool = False
 
 # --- 2. State Management ---
 class WebDriverManager:
-    """A dedicated class to hold session state."""
+    """
+    A dedicated class to hold session state.
+    Each /automate request creates its own and publishes it through session_var, so concurrent
+    requests (and the worker threads their tools run in) never see each other's browser.
+    """
     def __init__(self):
         self.driver = None
+        # The session's WebDriverWaits, created with the driver, instead of one per tool call.
+        # quick_wait polls faster for lookups whose element is usually already on the page.
+        self.wait = None
+        self.quick_wait = None
+        # (by, value) -> (time found, wait condition, WebElement); see _act_on_element
+        self.element_cache = {}
         self.session_screenshot_dir = None
+        # Numbers the automatic screenshots of a run; the run's timestamp is in the directory name
+        self.screenshot_counter = None
+        # Background screenshot file writes, waited for once the run's graph has finished
+        self.screenshot_writes = []
+
+    def attach(self, driver):
+        """Makes driver the session's browser and creates the waits that go with it."""
+        self.driver = driver
+        self.wait = WebDriverWait(driver, 15, poll_frequency=0.1)
+        self.quick_wait = WebDriverWait(driver, 15, poll_frequency=0.05)
+
+    def detach(self):
+        """Forgets the session's browser without quitting it."""
+        self.driver = None
+        self.wait = None
+        self.quick_wait = None
+        self.element_cache.clear()
+
+session_var: contextvars.ContextVar[WebDriverManager] = contextvars.ContextVar("session")
+driver_pool = DriverPool()
+
+@app.on_event("startup")
+async def start_driver_pool():
+    await driver_pool.start()
+
+@app.on_event("shutdown")
+async def stop_driver_pool():
+    await driver_pool.close()
+
+# --- Helper Function for Element Lookups ---
+# Successive tools often target the same element (e.g. verify then read it). A located element is
+# reused for a short while; navigating, clicking, typing or pressing a key drops the whole cache.
+ELEMENT_CACHE_TTL = 2.0
+
+def _locate(locator: tuple, condition, wait):
+    session = session_var.get()
+    cached = session.element_cache.get(locator)
+    if cached and cached[1] is condition and time.monotonic() - cached[0] < ELEMENT_CACHE_TTL:
+        return cached[2]
+    element = wait.until(condition(locator))
+    session.element_cache[locator] = (time.monotonic(), condition, element)
+    return element
+
+def _act_on_element(locator: tuple, condition, action, wait=None):
+    """Runs action(element) on the element at locator, re-locating it once if the cached one has gone stale."""
+    session = session_var.get()
+    wait = wait or session.wait
+    try:
+        return action(_locate(locator, condition, wait))
+    except StaleElementReferenceException:
+        session.element_cache.pop(locator, None)
+        return action(_locate(locator, condition, wait))
+
+# --- Helper Function for Screenshots ---
+# A tool only waits for Chrome to capture the PNG; the file itself is written on this pool
+_screenshot_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="screenshot-writer")
+
+def _write_file(filepath: str, data: bytes):
+    with open(filepath, "wb") as f:
+        f.write(data)
 
-driver_manager = WebDriverManager()
-
-# --- Helper Function for Locator Strategy ---
-def _get_selenium_by(by_strategy: str) -> str:
-    """Translates a user-friendly locator string to the Selenium By class attribute."""
-    by_strategy = by_strategy.lower()
-    if by_strategy in ['css', 'css_selector', 'css selector']:
-        return By.CSS_SELECTOR
-    elif by_strategy in ['xpath', 'fullxpath']:
-        return By.XPATH
-    elif by_strategy == 'id':
-        return By.ID
-    elif by_strategy == 'name':
-        return By.NAME
-    elif by_strategy == 'class_name':
-        return By.CLASS_NAME
-    elif by_strategy == 'tag_name':
-        return By.TAG_NAME
-    elif by_strategy == 'link_text':
-        return By.LINK_TEXT
-    elif by_strategy == 'partial_link_text':
-        return By.PARTIAL_LINK_TEXT
+# The automatic per-step screenshots are only for debugging, so they are captured over CDP as a
+# viewport-only JPEG, which Chrome encodes several times faster and an order of magnitude smaller
+AUTOMATIC_SCREENSHOT_PARAMS = {"format": "jpeg", "quality": 60, "captureBeyondViewport": False}
+
+def _save_screenshot(filepath: str, jpeg: bool = False):
+    """
+    Captures the current page and queues the image to be written to filepath in the background.
+    With jpeg=True, the capture is a CDP JPEG; otherwise it is Selenium's full PNG.
+    """
+    session = session_var.get()
+    driver = session.driver
+    if jpeg and hasattr(driver, "execute_cdp_cmd"):
+        image = base64.b64decode(driver.execute_cdp_cmd("Page.captureScreenshot", AUTOMATIC_SCREENSHOT_PARAMS)["data"])
     else:
-        raise ValueError(f"Unsupported locator strategy: {by_strategy}")
+        image = driver.get_screenshot_as_png()
+    session.screenshot_writes.append(_screenshot_writer.submit(_write_file, filepath, image))
+
+# Empties a field in one script call and tells framework-controlled inputs (React, Vue) about it,
+# instead of WebElement.clear(), which is its own round-trip and fires events of its own
+_CLEAR_VALUE_JS = "arguments[0].value = ''; arguments[0].dispatchEvent(new Event('input', {bubbles: true}));"
 
 # --- 3. Modular, Independent Tools ---
 
 @tool
 def start_browser(browser: str = "chrome") -> str:
     """Starts a web browser session. This must be the first tool called."""
-    if driver_manager.driver:
+    session = session_var.get()
+    if session.driver:
         return "Browser is already running."
     if browser.lower() == "chrome":
-        options = uc.ChromeOptions()
-        driver_manager.driver = uc.Chrome(options=options)
+        session.attach(launch_chrome())
         return f"Chrome browser started successfully."
     else:
         return "Unsupported browser. Please choose 'chrome'."
@@ -86,28 +162,30 @@ def start_browser(browser: str = "chrome") -> str:
 @tool
 def close_browser() -> str:
     """Closes the browser session. This should be the final tool called."""
-    if driver_manager.driver:
-        driver_manager.driver.quit()
-        driver_manager.driver = None
+    session = session_var.get()
+    if session.driver:
+        # The pooled browser is reset and returned to the pool when the request finishes, not quit here
         return "Browser closed successfully."
     return "Browser was not running."
 
 @tool
 def navigate_to_url(url: str) -> str:
     """Navigates the browser to a specified URL."""
-    if not driver_manager.driver: return "Error: Browser not started."
-    driver_manager.driver.get(url)
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
+    session.element_cache.clear()
+    session.driver.get(url)
     return f"Successfully navigated to {url}."
 
 @tool
 def click_element(by: str, value: str) -> str:
     """Finds and clicks on a web element. It waits for the element to be clickable."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 15)
-        element = wait.until(EC.element_to_be_clickable(locator))
-        element.click()
+        locator = (get_selenium_by(by), value)
+        _act_on_element(locator, EC.element_to_be_clickable, lambda element: element.click())
+        session.element_cache.clear()
         return f"Successfully clicked element with {by}='{value}'."
     except Exception as e:
         return f"Error clicking element: {str(e)}"
@@ -115,13 +193,16 @@ def click_element(by: str, value: str) -> str:
 @tool
 def send_keys_to_element(by: str, value: str, text: str) -> str:
     """Finds a web element, clears any existing text, and then types new text into it."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 15)
-        element = wait.until(EC.element_to_be_clickable(locator))
-        element.clear()
-        element.send_keys(text)
+        locator = (get_selenium_by(by), value)
+        def clear_and_type(element):
+            # Text is still typed with send_keys so keyboard handlers such as autocompletion fire
+            session.driver.execute_script(_CLEAR_VALUE_JS, element)
+            element.send_keys(text)
+        _act_on_element(locator, EC.element_to_be_clickable, clear_and_type)
+        session.element_cache.clear()
         return f"Successfully cleared and sent '{text}' to element with {by}='{value}'."
     except Exception as e:
         return f"Error sending keys to element: {str(e)}"
@@ -129,17 +210,16 @@ def send_keys_to_element(by: str, value: str, text: str) -> str:
 @tool
 def press_key_on_element(key: str, by: Optional[str] = None, value: Optional[str] = None) -> str:
     """Presses a special keyboard key (e.g., ENTER) globally or on a specific element."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
         key_to_press = getattr(Keys, key.upper())
-        element = None
         if by and value:
-            locator = (_get_selenium_by(by), value)
-            wait = WebDriverWait(driver_manager.driver, 15)
-            element = wait.until(EC.element_to_be_clickable(locator))
+            locator = (get_selenium_by(by), value)
+            _act_on_element(locator, EC.element_to_be_clickable, lambda element: element.send_keys(key_to_press))
         else:
-            element = driver_manager.driver.find_element(By.TAG_NAME, 'body')
-        element.send_keys(key_to_press)
+            session.driver.find_element(By.TAG_NAME, 'body').send_keys(key_to_press)
+        session.element_cache.clear()
         return f"Successfully pressed key '{key}'."
     except Exception as e:
         return f"Error pressing key: {str(e)}"
@@ -147,12 +227,11 @@ def press_key_on_element(key: str, by: Optional[str] = None, value: Optional[str
 @tool
 def verify_text_on_element(by: str, value: str, text: str) -> str:
     """Verifies that a web element contains the expected text (case-insensitive)."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 15)
-        element = wait.until(EC.visibility_of_element_located(locator))
-        actual_text = element.text
+        locator = (get_selenium_by(by), value)
+        actual_text = _act_on_element(locator, EC.visibility_of_element_located, lambda element: element.text)
         if text.lower() in actual_text.lower():
             return f"✅ Verification successful: Found text '{text}' in element."
         else:
@@ -163,24 +242,27 @@ def verify_text_on_element(by: str, value: str, text: str) -> str:
 @tool
 def get_text_from_element(by: str, value: str) -> str:
     """Extracts and returns the text content from a specific web element."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 15)
-        element = wait.until(EC.visibility_of_element_located(locator))
-        return element.text
+        locator = (get_selenium_by(by), value)
+        return _act_on_element(
+            locator, EC.visibility_of_element_located, lambda element: element.text, session.quick_wait
+        )
     except Exception as e:
         return f"Error getting text from element: {str(e)}"
 
 @tool
 def get_element_attribute(by: str, value: str, attribute_name: str) -> str:
     """Retrieves the value of a specified attribute from a web element (e.g., 'href', 'value')."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 15)
-        element = wait.until(EC.presence_of_element_located(locator))
-        attribute_value = element.get_attribute(attribute_name)
+        locator = (get_selenium_by(by), value)
+        attribute_value = _act_on_element(
+            locator, EC.presence_of_element_located,
+            lambda element: element.get_attribute(attribute_name), session.quick_wait,
+        )
         return f"Attribute '{attribute_name}' value is: {attribute_value}"
     except Exception as e:
         return f"Error getting attribute: {str(e)}"
@@ -188,12 +270,15 @@ def get_element_attribute(by: str, value: str, attribute_name: str) -> str:
 @tool
 def scroll_to_element(by: str, value: str) -> str:
     """Scrolls the page until the specified element is in the viewport."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 15)
-        element = wait.until(EC.presence_of_element_located(locator))
-        driver_manager.driver.execute_script("arguments[0].scrollIntoView(true);", element)
+        locator = (get_selenium_by(by), value)
+        _act_on_element(
+            locator, EC.presence_of_element_located,
+            lambda element: session.driver.execute_script("arguments[0].scrollIntoView(true);", element),
+            session.quick_wait,
+        )
         return f"Successfully scrolled to element with {by}='{value}'."
     except Exception as e:
         return f"Error scrolling to element: {str(e)}"
@@ -201,17 +286,44 @@ def scroll_to_element(by: str, value: str) -> str:
 @tool
 def take_screenshot(filename: str) -> str:
     """Takes a screenshot and saves it to the unique folder for this automation run."""
-    if not driver_manager.driver:
+    session = session_var.get()
+    if not session.driver:
         return "Error: Browser not started."
-    if not driver_manager.session_screenshot_dir:
+    if not session.session_screenshot_dir:
         return "Error: Screenshot directory not set for this session."
     try:
-        filepath = os.path.join(driver_manager.session_screenshot_dir, filename)
-        driver_manager.driver.save_screenshot(filepath)
+        filepath = os.path.join(session.session_screenshot_dir, filename)
+        _save_screenshot(filepath)
         return f"Screenshot saved successfully to {filepath}"
     except Exception as e:
         return f"Error taking screenshot: {str(e)}"
 
+# Collects the page's URL, title and visible buttons, inputs and links in one round-trip. The
+# filtering and limits are applied in the page, so only the summary's own fields cross the wire.
+# Visibility is a non-empty bounding box, which (unlike offsetParent) also counts position:fixed elements.
+SUMMARY_LIMITS = {"button": 50, "input": 50, "a": 20}
+_PAGE_SUMMARY_JS = """
+const limits = arguments[0];
+const visible = el => { const r = el.getBoundingClientRect(); return r.width > 0 && r.height > 0; };
+const buttons = [], inputs = [], links = [];
+for (const el of document.querySelectorAll('button, input, a')) {
+    if (!visible(el)) continue;
+    const tag = el.tagName.toLowerCase();
+    const text = (el.innerText || '').trim();
+    if (tag === 'button' && buttons.length < limits.button) {
+        buttons.push(text || el.getAttribute('aria-label') || el.value);
+    } else if (tag === 'input' && inputs.length < limits.input) {
+        const attrs = [['id', el.id], ['name', el.name], ['type', el.type],
+                       ['placeholder', el.placeholder], ['aria-label', el.getAttribute('aria-label')]]
+            .filter(([, v]) => v);
+        if (attrs.length) inputs.push(attrs);
+    } else if (tag === 'a' && links.length < limits.a && text && text.length < 100) {
+        links.push(text);
+    }
+}
+return {url: location.href, title: document.title, buttons: buttons, inputs: inputs, links: links};
+"""
+
 @tool
 def get_page_summary() -> str:
     """
@@ -219,111 +331,132 @@ def get_page_summary() -> str:
     and all visible interactive elements like buttons, inputs, and links.
     Call this tool when an element cannot be found to understand the current page state.
     """
-    if not driver_manager.driver:
+    session = session_var.get()
+    if not session.driver:
         return "Error: Browser not started."
     
     try:
-        url = driver_manager.driver.current_url
-        title = driver_manager.driver.title
-        summary = f"Page Summary:\n- URL: {url}\n- Title: {title}\n---\n"
-
-        # Find visible buttons
-        buttons = driver_manager.driver.find_elements(By.TAG_NAME, "button")
-        visible_buttons = []
-        for btn in buttons:
-            if btn.is_displayed():
-                text = btn.text.strip() or btn.get_attribute('aria-label') or btn.get_attribute('value')
-                visible_buttons.append(f"- Button: '{text}'")
-        if visible_buttons:
-            summary += "Visible Buttons:\n" + "\n".join(visible_buttons) + "\n---\n"
-        
-        # Find visible inputs
-        inputs = driver_manager.driver.find_elements(By.TAG_NAME, "input")
-        visible_inputs = []
-        for inp in inputs:
-            if inp.is_displayed():
-                attrs = {
-                    'id': inp.get_attribute('id'), 'name': inp.get_attribute('name'),
-                    'type': inp.get_attribute('type'), 'placeholder': inp.get_attribute('placeholder'),
-                    'aria-label': inp.get_attribute('aria-label')
-                }
-                attr_str = ", ".join([f"{k}='{v}'" for k, v in attrs.items() if v])
-                visible_inputs.append(f"- Input: ({attr_str})")
-        if visible_inputs:
-            summary += "Visible Inputs:\n" + "\n".join(visible_inputs) + "\n---\n"
-
-        # Find visible links
-        links = driver_manager.driver.find_elements(By.TAG_NAME, "a")
-        visible_links = []
-        for link in links:
-            if link.is_displayed():
-                text = link.text.strip()
-                if text and len(text) < 100: # Filter out very long links
-                    visible_links.append(f"- Link: '{text}'")
-        if visible_links:
-            summary += "Visible Links:\n" + "\n".join(visible_links[:20]) + "\n" # Limit to first 20 links
-
+        page = session.driver.execute_script(_PAGE_SUMMARY_JS, SUMMARY_LIMITS)
+        summary = f"Page Summary:\n- URL: {page['url']}\n- Title: {page['title']}\n---\n"
+        if page['buttons']:
+            summary += "Visible Buttons:\n" + "\n".join(f"- Button: '{text}'" for text in page['buttons']) + "\n---\n"
+        if page['inputs']:
+            summary += "Visible Inputs:\n" + "\n".join(
+                "- Input: (" + ", ".join(f"{k}='{v}'" for k, v in attrs) + ")" for attrs in page['inputs']
+            ) + "\n---\n"
+        if page['links']:
+            summary += "Visible Links:\n" + "\n".join(f"- Link: '{text}'" for text in page['links']) + "\n"
         return summary
     except Exception as e:
         return f"Error getting page summary: {str(e)}"
 
 # --- 4. Agentic Graph Definition ---
-class AgentState(TypedDict):
-    messages: Annotated[List[BaseMessage], operator.add]
+# "navigation" until the agent has opened a page, "page" afterwards
+Phase = Literal["navigation", "page"]
 
-tools = [
-    start_browser, navigate_to_url, click_element, send_keys_to_element,
-    press_key_on_element, verify_text_on_element, get_text_from_element,
-    get_element_attribute, scroll_to_element, take_screenshot, close_browser,
+class AgentState(TypedDict):
+    messages: Annotated[List[BaseMessage], add_messages]
+    # Whether the agent's latest response asked for tools, recorded by agent_node for should_continue
+    has_tool_calls: bool
+    phase: Phase
+
+NAVIGATION_TOOLS = [start_browser, navigate_to_url, close_browser]
+INTERACTION_TOOLS = [click_element, send_keys_to_element, press_key_on_element, scroll_to_element]
+INSPECTION_TOOLS = [
+    verify_text_on_element, get_text_from_element, get_element_attribute, take_screenshot,
     get_page_summary, # Added the new debugging tool
 ]
-tool_executor = ToolExecutor(tools)
+tools = NAVIGATION_TOOLS + INTERACTION_TOOLS + INSPECTION_TOOLS
+# Create a simple map of tool names to their callable functions, once rather than on every tool step
+tool_map = {t.name: t for t in tools}
 
 llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
-model_with_tools = llm.bind_tools(tools)
-
-def agent_node(state: AgentState):
-    response = model_with_tools.invoke(state["messages"])
-    return {"messages": [response]}
-
-def _take_automatic_screenshot(step_index: int, tool_name: str):
+# Every tool schema is sent with each model call. Before a page is open only the navigation tools
+# can do anything, so those turns are bound to them alone; both variants are bound once at import.
+MODELS_BY_PHASE = {
+    "navigation": llm.bind_tools(NAVIGATION_TOOLS),
+    "page": llm.bind_tools(tools),
+}
+
+@app.on_event("startup")
+async def warm_llm_client():
+    """
+    Sends a one-token request at boot so the OpenAI client's connection (DNS, TLS) is already open,
+    and its lazily imported modules loaded, when the first /automate request arrives.
+    """
+    try:
+        await llm.ainvoke([SystemMessage(content="ping")], max_tokens=1)
+    except Exception as e:
+        print(f"---INFO: LLM warm-up failed, the first request will open the connection. Reason: {e}---")
+
+# A page summary runs to several KB and every later model call pays for it again. Only the latest
+# few are sent in full; older ones describe pages the agent has since moved on from.
+SUMMARIES_KEPT = 2
+PRUNED_SUMMARY = "[Older page summary omitted. Call get_page_summary again for the current page.]"
+
+def _prune_old_summaries(messages: List[BaseMessage]) -> List[BaseMessage]:
+    """Returns the messages with all but the last SUMMARIES_KEPT page summaries replaced by a placeholder."""
+    summary_indexes = [
+        i for i, m in enumerate(messages) if isinstance(m, ToolMessage) and m.name == "get_page_summary"
+    ]
+    pruned = list(messages)
+    for i in summary_indexes[:-SUMMARIES_KEPT]:
+        pruned[i] = ToolMessage(content=PRUNED_SUMMARY, tool_call_id=messages[i].tool_call_id, name=messages[i].name)
+    return pruned
+
+async def agent_node(state: AgentState):
+    response = await MODELS_BY_PHASE[state["phase"]].ainvoke(_prune_old_summaries(state["messages"]))
+    return {"messages": [response], "has_tool_calls": bool(response.tool_calls)}
+
+def _take_automatic_screenshot(tool_name: str):
     """Internal function to take a screenshot into the session-specific directory."""
-    if not driver_manager.driver or not driver_manager.session_screenshot_dir:
+    session = session_var.get()
+    if not session.driver or not session.session_screenshot_dir:
         return
     try:
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"{timestamp}_step_{step_index}_{tool_name}.png"
-        filepath = os.path.join(driver_manager.session_screenshot_dir, filename)
-        driver_manager.driver.save_screenshot(filepath)
+        filename = f"step_{next(session.screenshot_counter):04d}_{tool_name}.jpg"
+        filepath = os.path.join(session.session_screenshot_dir, filename)
+        _save_screenshot(filepath, jpeg=True)
         print(f"---DEBUG: Screenshot saved to {filepath}---")
     except Exception as e:
         print(f"---DEBUG: Could not take automatic screenshot. Reason: {e}---")
 
-def tool_node(state: AgentState):
-    """Executes the tool and takes a screenshot after each action."""
+# Read-only tools only query the page, so a turn made up of them alone runs its calls concurrently.
+# Any other tool changes the browser, so a turn containing one runs its calls in order.
+READ_ONLY_TOOLS = {"verify_text_on_element", "get_text_from_element", "get_element_attribute", "get_page_summary"}
+
+def _run_tool(call) -> ToolMessage:
+    """Runs one tool call, takes the automatic screenshot and wraps the output in a ToolMessage."""
+    tool_name = call['name']
+    tool_to_call = tool_map.get(tool_name)
+    if tool_to_call:
+        output = tool_to_call.invoke(call['args'])
+        print(f"---TOOL: Output of {tool_name}: {output}---")
+        if tool_name != "close_browser":
+            _take_automatic_screenshot(tool_name=tool_name)
+        return ToolMessage(content=str(output), tool_call_id=call["id"], name=tool_name)
+    error_message = f"Error: Tool '{tool_name}' not found."
+    print(error_message)
+    return ToolMessage(content=error_message, tool_call_id=call["id"])
+
+async def tool_node(state: AgentState):
+    """Executes the tools and takes a screenshot after each action."""
     print("---TOOL: Executing action---")
-    tool_map = {t.name: t for t in tools}
     tool_calls = state["messages"][-1].tool_calls
-    tool_messages = []
-
-    for i, call in enumerate(tool_calls):
-        tool_name = call['name']
-        tool_args = call['args']
-        tool_to_call = tool_map.get(tool_name)
-        if tool_to_call:
-            output = tool_to_call.invoke(tool_args)
-            print(f"---TOOL: Output of {tool_name}: {output}---")
-            if tool_name != "close_browser":
-                _take_automatic_screenshot(step_index=len(state['messages']), tool_name=tool_name)
-            tool_messages.append(ToolMessage(content=str(output), tool_call_id=call["id"]))
-        else:
-            error_message = f"Error: Tool '{tool_name}' not found."
-            print(error_message)
-            tool_messages.append(ToolMessage(content=error_message, tool_call_id=call["id"]))
-    return {"messages": tool_messages}
+
+    # Selenium calls block, so every tool runs in a worker thread
+    if all(call['name'] in READ_ONLY_TOOLS for call in tool_calls):
+        tool_messages = await asyncio.gather(
+            *(asyncio.to_thread(_run_tool, call) for call in tool_calls)
+        )
+    else:
+        tool_messages = [await asyncio.to_thread(_run_tool, call) for call in tool_calls]
+    if any(call['name'] == "navigate_to_url" for call in tool_calls):
+        return {"messages": list(tool_messages), "phase": "page"}
+    return {"messages": list(tool_messages)}
 
 def should_continue(state: AgentState):
-    if not state["messages"][-1].tool_calls:
+    if not state["has_tool_calls"]:
         return "end"
     return "continue"
 
@@ -347,9 +480,13 @@ async def automate(request: AutomationRequest):
     try:
         base_screenshot_dir = "screenshots"
         run_timestamp = datetime.datetime.now().strftime("run_%Y%m%d_%H%M%S")
-        session_dir = os.path.join(base_screenshot_dir, run_timestamp)
+        # Concurrent runs can start within the same second, so each gets a unique suffix
+        session_dir = os.path.join(base_screenshot_dir, f"{run_timestamp}_{uuid.uuid4().hex[:8]}")
         os.makedirs(session_dir, exist_ok=True)
-        driver_manager.session_screenshot_dir = session_dir
+        session = WebDriverManager()
+        session.session_screenshot_dir = session_dir
+        session.screenshot_counter = itertools.count()
+        session_var.set(session)
         print(f"---INFO: Screenshots for this run will be saved in: {session_dir}---")
 
         system_prompt = """
@@ -366,12 +503,21 @@ async def automate(request: AutomationRequest):
             SystemMessage(content=system_prompt),
             HumanMessage(content=request.query)
         ]
-        await app_graph.ainvoke({"messages": initial_messages})
+        # The browser is checked out for this request only and reset back into the pool afterwards
+        async with driver_pool.acquire(render=request.render) as driver:
+            session.attach(driver)
+            try:
+                await app_graph.ainvoke({"messages": initial_messages, "phase": "navigation"})
+            finally:
+                session.detach()
+        # Make sure every screenshot of the run is on disk before reporting the folder
+        results = await asyncio.gather(
+            *(asyncio.wrap_future(write) for write in session.screenshot_writes), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"---DEBUG: Could not write screenshot. Reason: {result}---")
         return {"message": f"Automation task processed successfully. Screenshots saved in '{session_dir}'."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
-    finally:
-        if driver_manager.driver:
-            driver_manager.driver.quit()
-            driver_manager.driver = None
-        driver_manager.session_screenshot_dir = None
\ No newline at end of file
+
@@ -394,6 +394,8 @@ tools = [
     find_interactive_element, wait_for_seconds, scroll_page,select_dropdown_option,
 ]
 tool_executor = ToolExecutor(tools)
+# The tool list is fixed at import, so the name lookup is built once rather than on every tool turn
+tool_map = {t.name: t for t in tools}
 
 llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
 model_with_tools = llm.bind_tools(tools)
@@ -403,7 +405,6 @@ def agent_node(state: AgentState):
     return {"messages": [response]}
 
 def tool_node(state: AgentState):
-    tool_map = {t.name: t for t in tools}
     tool_calls = state["messages"][-1].tool_calls
     tool_messages = []
     for call in tool_calls:
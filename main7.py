@@ -1,15 +1,24 @@
 # filename: main_agentic.py
 import os
 import uuid
+import asyncio
 import operator
-import json
-import time
+import orjson
+import threading
+import weakref
+import contextvars
+from collections import OrderedDict
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional, Annotated, TypedDict
 
 from dotenv import load_dotenv
 
+from driver_pool import DriverPool, launch_chrome
+from selenium_lookups import get_selenium_by, get_selenium_key
+from cdp_waits import match_text
+from tool_scheduler import ToolScheduler, tool_turns, stream_turn, claim_turn
+
 # LangChain Imports
 from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, SystemMessage
 from langchain_openai import ChatOpenAI
@@ -20,10 +29,8 @@ from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolExecutor
 
 # Selenium Imports
-import undetected_chromedriver as uc
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import Select
@@ -48,55 +55,91 @@ app = FastAPI(
 class AutomationRequest(BaseModel):
     query: str
     context_filename: Optional[str] = None
+    # Use a fully rendering browser (images, GPU, visible window) for visual checks
+    render: bool = False
 
 # --- 2. State Management (No Globals) ---
 class WebDriverManager:
     """A dedicated class to hold the driver, eliminating global variables."""
     def __init__(self):
         self.driver = None
-
-driver_manager = WebDriverManager()
-
-# --- NEW HELPER FUNCTION ---
-def _get_selenium_by(by_strategy: str) -> str:
-    """Translates a user-friendly locator string to the Selenium By class attribute."""
-    by_strategy = by_strategy.lower()
-    if by_strategy in ['css', 'css_selector', 'css selector']:
-        return By.CSS_SELECTOR
-    elif by_strategy in ['xpath', 'fullxpath']:
-        return By.XPATH
-    elif by_strategy == 'id':
-        return By.ID
-    elif by_strategy == 'name':
-        return By.NAME
-    elif by_strategy == 'class_name':
-        return By.CLASS_NAME
-    elif by_strategy == 'tag_name':
-        return By.TAG_NAME
-    elif by_strategy == 'link_text':
-        return By.LINK_TEXT
-    elif by_strategy == 'partial_link_text':
-        return By.PARTIAL_LINK_TEXT
-    else:
-        raise ValueError(f"Unsupported locator strategy: {by_strategy}")
-
-
-# --- 3. Modular, Independent Tools ---
-
-@tool
-def find_interactive_element(element_query: str, container_xpath: Optional[str] = None) -> str:
-    """
-    Finds an element via natural language. Optionally scopes the search within a container XPath.
-    Use `container_xpath` when the user asks to find an element "inside" or "within" another.
-    Returns a ranked JSON list of matching elements with relevance scores.
-    """
-    if not driver_manager.driver:
-        return "Error: Browser not started. Call start_browser first."
-
-    javascript = """
+        # Bumped by every tool that changes the page, so cached find results from before it are never reused
+        self.dom_version = 0
+        # (url, page mutation count, dom_version, query, container_xpath) -> find_interactive_element result
+        self.find_cache = OrderedDict()
+        self.find_cache_lock = threading.Lock()
+
+    def invalidate_page(self):
+        self.dom_version += 1
+
+    def attach(self, driver):
+        """Makes driver the session's browser, preparing it on first use."""
+        _prepare_driver(driver)
+        self.driver = driver
+
+    def detach(self):
+        """Forgets the session's browser and everything cached about its pages, without quitting it."""
+        self.driver = None
+        self.find_cache.clear()
+
+# Each request gets its own WebDriverManager, published through this ContextVar, so concurrent
+# requests (and the worker threads their tools run in) never see each other's browser or caches
+session_var: contextvars.ContextVar[WebDriverManager] = contextvars.ContextVar("session")
+driver_pool = DriverPool()
+
+@app.on_event("startup")
+async def start_driver_pool():
+    await driver_pool.start()
+
+@app.on_event("shutdown")
+async def stop_driver_pool():
+    await driver_pool.close()
+
+# Pooled browsers outlive a request, so the one-time setup is done once per browser.
+# The viewport is tracked on its own: maximize_window drops the driver from _sized_drivers, and the
+# next request that attaches it gets the fixed viewport back.
+_prepared_drivers = weakref.WeakSet()
+_sized_drivers = weakref.WeakSet()
+VIEWPORT_METRICS = {"width": 1080, "height": 720, "deviceScaleFactor": 1, "mobile": False}
+
+def _prepare_driver(driver):
+    has_cdp = hasattr(driver, "execute_cdp_cmd")
+    if driver not in _sized_drivers:
+        if has_cdp:
+            # Sizes the viewport in the one DevTools call, without WebDriver's window resize round-trips
+            driver.execute_cdp_cmd("Emulation.setDeviceMetricsOverride", VIEWPORT_METRICS)
+        else:
+            driver.set_window_size(VIEWPORT_METRICS["width"], VIEWPORT_METRICS["height"])
+        _sized_drivers.add(driver)
+    if driver not in _prepared_drivers:
+        if has_cdp:
+            driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": _INSTALL_FIND_INTERACTIVE_ELEMENT_JS})
+        _prepared_drivers.add(driver)
+
+# --- Cache for find_interactive_element ---
+# Scoring every interactive element forces a layout pass over the whole page, while agents often
+# search for the same element again (retries, verify-then-click). Results are reused while the page
+# is unchanged: a MutationObserver installed once per page counts DOM changes in window.__domVersion.
+FIND_CACHE_SIZE = 128
+_PAGE_VERSION_JS = """
+if (window.__domVersion === undefined) {
+    window.__domVersion = 0;
+    new MutationObserver(() => { window.__domVersion++; })
+        .observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+}
+return [location.href, window.__domVersion];
+"""
+
+# --- Element finder script ---
+# The scoring script is large, so it is not shipped with every find_interactive_element call. _prepare_driver
+# (run by WebDriverManager.attach) registers it with CDP to be defined in every new document; a call then sends only the short
+# FIND_INTERACTIVE_ELEMENT_CALL_JS. Where it is missing (a page loaded before registration, or a driver
+# without CDP), the full script is sent once, defining the helper in that document for the calls after it.
+FIND_INTERACTIVE_ELEMENT_JS = """
         /**
     * This script finds and ranks interactive elements on a web page based on a query.
-    * It is designed to be executed by Selenium's `execute_script` method.
+    * It is installed into every page as window.__findInteractiveElement (see _prepare_driver), and can
+    * also be executed directly by Selenium's `execute_script` method.
     *
     * @param {string} arguments[0] - The natural language query for the element (e.g., "login button").
     * @param {string|null} arguments[1] - An optional XPath to a container element to scope the search within.
@@ -108,46 +151,52 @@ def find_interactive_element(element_query: str, container_xpath: Optional[str]
     // =================================================================================
     function createXPath(element, contextNode) {
         // Generates a stable, absolute XPath for a given element.
-        if (element.id !== '') {
-            return `//*[@id="${element.id}"]`;
-        }
-        if (element === document.body) {
-            return '/html/body';
-        }
-        let ix = 0;
-        const siblings = element.parentNode.childNodes;
-        for (let i = 0; i < siblings.length; i++) {
-            const sibling = siblings[i];
-            if (sibling === element) {
-                // Recursively build the path from the parent.
-                return `${createXPath(element.parentNode, contextNode)}/${element.tagName.toLowerCase()}[${ix + 1}]`;
+        // Walks up iteratively, stopping at the nearest ancestor with an id, and counts same-tag
+        // siblings through previousElementSibling instead of scanning every child of each parent.
+        const parts = [];
+        for (let node = element; node && node.nodeType === 1 && node !== document.body; node = node.parentElement) {
+            if (node.id !== '') {
+                parts.unshift(`*[@id="${node.id}"]`);
+                return '//' + parts.join('/');
             }
-            if (sibling.nodeType === 1 && sibling.tagName === element.tagName) {
-                ix++;
+            let ix = 1;
+            for (let sibling = node.previousElementSibling; sibling; sibling = sibling.previousElementSibling) {
+                if (sibling.tagName === node.tagName) {
+                    ix++;
+                }
             }
+            parts.unshift(`${node.tagName.toLowerCase()}[${ix}]`);
         }
+        return parts.length ? '/html/body/' + parts.join('/') : '/html/body';
     }
 
     // =================================================================================
     //  2. SCORING LOGIC
     // =================================================================================
+    // Rule 1: Visibility Check (Crucial for robustness)
+    // An element that cannot be seen by a user is not a valid target.
+    // This forces a layout, so it is only asked of elements whose text could make the top 5.
+    const isVisible = (el) => {
+        const rect = el.getBoundingClientRect();
+        return !!(rect.width || rect.height) && window.getComputedStyle(el).visibility !== 'hidden';
+    };
+
     const calculateScore = (el, query) => {
         let score = 0;
-        const textContent = (el.textContent || "").trim().toLowerCase();
+        // textContent walks the element's whole subtree; a large container (e.g. a [role="button"]
+        // wrapping a whole card) only contributes its own leading text node
+        let textContent = "";
+        if (el.children.length < 32) {
+            textContent = (el.textContent || "").slice(0, 200).trim().toLowerCase();
+        } else if (el.firstChild && el.firstChild.nodeType === 3) {
+            textContent = el.firstChild.nodeValue.slice(0, 200).trim().toLowerCase();
+        }
         const value = (el.value || "").trim().toLowerCase();
         const ariaLabel = (el.ariaLabel || "").trim().toLowerCase();
         const name = (el.name || "").trim().toLowerCase();
         const id = (el.id || "").trim().toLowerCase();
         const placeholder = (el.placeholder || "").trim().toLowerCase();
 
-        // Rule 1: Visibility Check (Crucial for robustness)
-        // An element that cannot be seen by a user is not a valid target.
-        const rect = el.getBoundingClientRect();
-        const isVisible = !!(rect.width || rect.height) && window.getComputedStyle(el).visibility !== 'hidden';
-        if (!isVisible) {
-            return -1; // Disqualify non-visible elements immediately.
-        }
-
         // Rule 2: Weighted Attributes
         // A match in a more specific attribute (like 'id') is more valuable.
         const sources = [
@@ -189,8 +238,20 @@ def find_interactive_element(element_query: str, container_xpath: Optional[str]
 
     // Step 2: Determine the search context (the whole page or a specific container)
     let searchContext = document;
-    if (containerXPath) {
-        const containerNode = document.evaluate(containerXPath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (containerXPath === '/html/body') {
+        // The root containers need no XPath evaluation
+        searchContext = document.body;
+    } else if (containerXPath && containerXPath !== '/html') {
+        // The agent retries searches in the same container, so the resolved node is kept per page
+        // until the DOM changes (window.__domVersion is maintained by the page version observer)
+        const containerCache = window.__containerCache || (window.__containerCache = new Map());
+        let cached = containerCache.get(containerXPath);
+        if (!cached || cached.version !== window.__domVersion || !cached.node || !cached.node.isConnected) {
+            const node = document.evaluate(containerXPath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            cached = { node, version: window.__domVersion };
+            containerCache.set(containerXPath, cached);
+        }
+        const containerNode = cached.node;
         if (containerNode) {
             // If the container is found, all subsequent searches happen only within it.
             searchContext = containerNode;
@@ -200,47 +261,89 @@ def find_interactive_element(element_query: str, container_xpath: Optional[str]
         }
     }
 
-    // Step 3: Find all candidate elements within the determined context
-    const interactiveElements = Array.from(searchContext.querySelectorAll(
+    // Step 3: Score every candidate element within the determined context in a single pass,
+    // keeping only the top 5 matches (best first; ties keep document order) to keep the output concise
+    const top = [];
+    const candidates = searchContext.querySelectorAll(
         'a, button, input, textarea, select, [role="button"], [role="link"], [aria-label], [data-testid]'
-    ));
+    );
+    for (const el of candidates) {
+        const score = calculateScore(el, query);
+        if (score <= 0) continue; // Not a match
+        if (top.length === 5 && score <= top[4].score) continue; // Cannot make the top 5
+        if (!isVisible(el)) continue; // Disqualify non-visible elements
+        let i = top.length;
+        while (i > 0 && top[i - 1].score < score) i--;
+        top.splice(i, 0, { el, score });
+        if (top.length > 5) top.pop();
+    }
 
-    // Step 4: Score each candidate element based on the query
-    const scoredElements = interactiveElements.map(el => ({
+    // Step 4: Format the final results; XPaths are only built for the survivors
+    const finalResults = top.map(({ el, score }) => ({
         tag: el.tagName.toLowerCase(),
         name: (el.textContent || el.value || el.ariaLabel || el.name || "").trim().substring(0, 100),
         selector: createXPath(el, searchContext),
-        score: calculateScore(el, query)
+        score: score
     }));
 
-    // Step 5: Filter, sort, and format the final results
-    const finalResults = scoredElements
-        .filter(el => el.score > 0) // Remove disqualified (invisible or non-matching) elements
-        .sort((a, b) => b.score - a.score) // Sort by score in descending order (best matches first)
-        .slice(0, 5) // Return only the top 5 matches to keep the output concise
-        .map(({ tag, name, selector, score }) => ({ tag, name, selector, score })); // Map to the final JSON format
-
-    // Step 6: Return the results as a JSON string
+    // Step 5: Return the results as a JSON string
     return JSON.stringify(finalResults, null, 2);
     """
+_INSTALL_FIND_INTERACTIVE_ELEMENT_JS = f"window.__findInteractiveElement = function() {{ {FIND_INTERACTIVE_ELEMENT_JS} }};"
+FIND_INTERACTIVE_ELEMENT_CALL_JS = """
+return window.__findInteractiveElement ? window.__findInteractiveElement(arguments[0], arguments[1]) : null;
+"""
+_INSTALL_AND_FIND_INTERACTIVE_ELEMENT_JS = (
+    _INSTALL_FIND_INTERACTIVE_ELEMENT_JS + "\nreturn window.__findInteractiveElement(arguments[0], arguments[1]);"
+)
+
+# --- 3. Modular, Independent Tools ---
+
+@tool
+def find_interactive_element(element_query: str, container_xpath: Optional[str] = None) -> str:
+    """
+    Finds an element via natural language. Optionally scopes the search within a container XPath.
+    Use `container_xpath` when the user asks to find an element "inside" or "within" another.
+    Returns a ranked JSON list of matching elements with relevance scores.
+    """
+    session = session_var.get()
+    if not session.driver:
+        return "Error: Browser not started. Call start_browser first."
+
     try:
         # Pass both arguments to the script
         print(f"------------Element query {element_query} ----- container_xpath : {container_xpath}")
-        result = driver_manager.driver.execute_script(javascript, element_query, container_xpath)
-        if not json.loads(result):
+        url, page_version = session.driver.execute_script(_PAGE_VERSION_JS)
+        key = (url, page_version, session.dom_version, element_query.lower(), container_xpath)
+        with session.find_cache_lock:
+            result = session.find_cache.get(key)
+            if result is not None:
+                session.find_cache.move_to_end(key)
+        if result is None:
+            result = session.driver.execute_script(FIND_INTERACTIVE_ELEMENT_CALL_JS, element_query, container_xpath)
+            if result is None:
+                result = session.driver.execute_script(
+                    _INSTALL_AND_FIND_INTERACTIVE_ELEMENT_JS, element_query, container_xpath
+                )
+            with session.find_cache_lock:
+                session.find_cache[key] = result
+                if len(session.find_cache) > FIND_CACHE_SIZE:
+                    session.find_cache.popitem(last=False)
+        if not orjson.loads(result):
              return f"No visible element found matching query: '{element_query}'. Try a different query or context."
         return result
     except Exception as e:
         return f"Error executing script to find element: {e}"
 
 @tool
-def wait_for_seconds(seconds: int) -> str:
+async def wait_for_seconds(seconds: int) -> str:
     """
     Waits for a specified number of seconds.
     Use this when you need to wait for an animation, a page transition, or a background process to complete.
     """
     try:
-        time.sleep(seconds)
+        # Sleeping on the event loop lets other requests make progress during the wait
+        await asyncio.sleep(seconds)
         return f"Successfully waited for {seconds} seconds."
     except Exception as e:
         return f"Error during wait: {e}"
@@ -252,17 +355,19 @@ def scroll_page(direction: str) -> str:
     `direction` can be 'up', 'down', 'top', or 'bottom'.
     Use 'down' to load more content on infinite-scroll pages or to find elements below the fold.
     """
-    if not driver_manager.driver:
+    session = session_var.get()
+    if not session.driver:
         return "Error: Browser not started."
+    session.invalidate_page()
     try:
         if direction == "down":
-            driver_manager.driver.execute_script("window.scrollBy(0, window.innerHeight);")
+            session.driver.execute_script("window.scrollBy(0, window.innerHeight);")
         elif direction == "up":
-            driver_manager.driver.execute_script("window.scrollBy(0, -window.innerHeight);")
+            session.driver.execute_script("window.scrollBy(0, -window.innerHeight);")
         elif direction == "top":
-            driver_manager.driver.execute_script("window.scrollTo(0, 0);")
+            session.driver.execute_script("window.scrollTo(0, 0);")
         elif direction == "bottom":
-            driver_manager.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            session.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
         else:
             return "Error: Invalid scroll direction. Use 'up', 'down', 'top', or 'bottom'."
         return f"Successfully scrolled {direction}."
@@ -272,12 +377,11 @@ def scroll_page(direction: str) -> str:
 @tool
 def start_browser(browser: str = "chrome") -> str:
     """Starts a web browser session. Call this first."""
-    if driver_manager.driver:
+    session = session_var.get()
+    if session.driver:
         return "Browser is already running."
     if browser.lower() == "chrome":
-        options = uc.ChromeOptions()
-        driver_manager.driver = uc.Chrome(options=options)
-        driver_manager.driver.set_window_size(1080, 720)
+        session.attach(launch_chrome())
         return f"Chrome browser started successfully."
     else:
         return "Unsupported browser. Please choose 'chrome'."
@@ -285,21 +389,25 @@ def start_browser(browser: str = "chrome") -> str:
 @tool
 def navigate_to_url(url: str) -> str:
     """Navigates the browser to a specified URL."""
-    if not driver_manager.driver:
+    session = session_var.get()
+    if not session.driver:
         return "Error: Browser not started. Call start_browser first."
-    driver_manager.driver.get(url)
+    session.invalidate_page()
+    session.driver.get(url)
     return f"Successfully navigated to {url}."
 
 @tool
 def click_element(by: str, value: str) -> str:
     """Clicks on an element found by a locator."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
         # --- UPDATED TOOL LOGIC ---
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 10)
+        locator = (get_selenium_by(by), value)
+        wait = WebDriverWait(session.driver, 10)
         element = wait.until(EC.element_to_be_clickable(locator))
         element.click()
+        session.invalidate_page()
         return f"Successfully clicked element with {by}='{value}'."
     except Exception as e:
         return f"Error clicking element with {by}='{value}': {e}"
@@ -307,13 +415,15 @@ def click_element(by: str, value: str) -> str:
 @tool
 def send_keys_to_element(by: str, value: str, text: str) -> str:
     """Sends text to an element found by a locator."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
         # --- UPDATED TOOL LOGIC ---
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 10)
+        locator = (get_selenium_by(by), value)
+        wait = WebDriverWait(session.driver, 10)
         element = wait.until(EC.element_to_be_clickable(locator))
         element.send_keys(text)
+        session.invalidate_page()
         return f"Successfully sent '{text}' to element with {by}='{value}'."
     except Exception as e:
         return f"Error sending keys to element: {e}"
@@ -321,18 +431,20 @@ def send_keys_to_element(by: str, value: str, text: str) -> str:
 @tool
 def press_key_on_element(key: str, by: Optional[str] = None, value: Optional[str] = None) -> str:
     """Presses a special key (e.g., 'ENTER', 'TAB') globally or on a specific element."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        key_to_press = getattr(Keys, key.upper())
+        key_to_press = get_selenium_key(key)
         element = None
         if by and value:
             # --- UPDATED TOOL LOGIC ---
-            locator = (_get_selenium_by(by), value)
-            wait = WebDriverWait(driver_manager.driver, 10)
+            locator = (get_selenium_by(by), value)
+            wait = WebDriverWait(session.driver, 10)
             element = wait.until(EC.element_to_be_clickable(locator))
         else:
-            element = driver_manager.driver.find_element(By.TAG_NAME, 'body')
+            element = session.driver.find_element(By.TAG_NAME, 'body')
         element.send_keys(key_to_press)
+        session.invalidate_page()
         return f"Successfully pressed key '{key}'."
     except Exception as e:
         return f"Error pressing key: {e}"
@@ -343,7 +455,8 @@ def verify_text_on_element(by: str, value: str, text: str) -> str:
     Verifies that an element contains the expected text.
     Returns a JSON object with the verification status and the locator used.
     """
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     
     result = {
         "success": False,
@@ -352,18 +465,23 @@ def verify_text_on_element(by: str, value: str, text: str) -> str:
     }
     
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 10)
-        element = wait.until(EC.visibility_of_element_located(locator))
-        actual_text = element.text
+        locator = (get_selenium_by(by), value)
+        # One script call compares the text in the page; only a missing or hidden element (or a strategy
+        # the script cannot evaluate) falls back to waiting for it and reading its text
+        matched = match_text(session.driver, locator, text)
+        if matched is None:
+            wait = WebDriverWait(session.driver, 10)
+            actual_text = wait.until(EC.visibility_of_element_located(locator)).text
+            matched = (text.lower() in actual_text.lower(), actual_text)
+        found, actual_text = matched
         
-        if text.lower() in actual_text.lower():
+        if found:
             result["success"] = True
             result["message"] = f"✅ Verification successful: Found text '{text}' in element."
         else:
             result["message"] = f"❌ Verification failed! Expected '{text}', but found '{actual_text}'."
             
-        return json.dumps(result)
+        return orjson.dumps(result).decode()
         
     except Exception as e:
         return f"Error verifying text: Element not found or other exception: {e}"
@@ -376,11 +494,12 @@ def select_dropdown_option(by: str, value: str, option_by: str, option_value: st
     `option_by` specifies how to find the option: 'text', 'value', or 'index'.
     `option_value` is the corresponding text, value, or index of the option to select.
     """
-    if not driver_manager.driver:
+    session = session_var.get()
+    if not session.driver:
         return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 10)
+        locator = (get_selenium_by(by), value)
+        wait = WebDriverWait(session.driver, 10)
         select_element = wait.until(EC.element_to_be_clickable(locator))
         
         select = Select(select_element)
@@ -394,6 +513,7 @@ def select_dropdown_option(by: str, value: str, option_by: str, option_value: st
             select.select_by_index(int(option_value))
         else:
             return f"Error: Invalid 'option_by' strategy. Must be 'text', 'value', or 'index'."
+        session.invalidate_page()
             
         return f"Successfully selected option '{option_value}' by {option_by} from dropdown."
     except Exception as e:
@@ -402,10 +522,17 @@ def select_dropdown_option(by: str, value: str, option_by: str, option_value: st
 @tool
 def maximize_window() -> str:
     """Maximizes the browser window to fill the entire screen."""
-    if not driver_manager.driver:
+    session = session_var.get()
+    if not session.driver:
         return "Error: Browser not started."
     try:
-        driver_manager.driver.maximize_window()
+        if hasattr(session.driver, "execute_cdp_cmd"):
+            # The emulated viewport would otherwise keep the page at its fixed size
+            session.driver.execute_cdp_cmd("Emulation.clearDeviceMetricsOverride", {})
+        session.driver.maximize_window()
+        _sized_drivers.discard(session.driver)
+        # A resize re-lays out the page, which changes visibility and ranking of the found elements
+        session.invalidate_page()
         return "Browser window maximized successfully."
     except Exception as e:
         return f"Error maximizing window: {e}"
@@ -413,9 +540,9 @@ def maximize_window() -> str:
 @tool
 def close_browser() -> str:
     """Closes the browser session. Call this when the task is complete."""
-    if driver_manager.driver:
-        driver_manager.driver.quit()
-        driver_manager.driver = None
+    session = session_var.get()
+    if session.driver:
+        # The pooled browser is reset and returned to the pool when the request finishes, not quit here
         return "Browser closed successfully."
     return "Browser was not running."
 
@@ -423,6 +550,8 @@ def close_browser() -> str:
 class AgentState(TypedDict):
     messages: Annotated[List[BaseMessage], operator.add]
     context_events: Optional[List[dict]]
+    # XPaths recorded in context_events, derived once per context file rather than on every agent turn
+    context_xpaths: frozenset
 
 tools = [
     start_browser, navigate_to_url, click_element, send_keys_to_element,
@@ -435,15 +564,63 @@ tools = [
 llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
 model_with_tools = llm.bind_tools(tools)
 
-def agent_node(state: AgentState):
-    """Invokes the LLM and logs the decision-making process based on its response."""
-    response = model_with_tools.invoke(state["messages"])
+# Sent with the first turn only, so the model plans everything it can up front instead of spending one
+# LLM round-trip per step. tool_node runs the calls in order; later turns only handle what depended on
+# earlier results, or recover from errors.
+BATCH_PLAN_PROMPT = SystemMessage(content="""
+Plan the whole request now. In this response, emit every tool call whose arguments you already know
+(e.g. start_browser, maximize_window, navigate_to_url, and actions on selectors given by the user or found
+in the context), in the order they must run; they will be executed in that order.
+Leave out calls that depend on the result of an earlier call, such as acting on a selector returned by
+`find_interactive_element`; you will plan those after seeing the results.
+""")
+
+# Read-only tools only inspect the page, so consecutive calls to them run concurrently.
+# Every other tool changes the browser (or waits on it) and runs alone, in the order the agent issued it.
+READ_ONLY_TOOLS = {"find_interactive_element", "verify_text_on_element"}
+tool_map = {t.name: t for t in tools}
+
+async def _run_tool(call) -> ToolMessage:
+    tool_name = call['name']
+    tool_args = call['args']
+    
+    # --- MODIFIED: Use logger instead of print ---
+    logger.info(f"EXECUTING tool '{tool_name}' with args: {tool_args}")
+    
+    tool_to_call = tool_map.get(tool_name)
+    if tool_to_call:
+        if tool_to_call.coroutine:
+            output = await tool_to_call.ainvoke(tool_args)
+        else:
+            # Selenium calls block, so synchronous tools run in a worker thread and the event loop stays free
+            output = await asyncio.to_thread(tool_to_call.invoke, tool_args)
+        log_output = (str(output)[:1000] + '...') if len(str(output)) > 1000 else str(output)
+        
+        # --- MODIFIED: Use logger instead of print ---
+        logger.info(f"COMPLETED tool '{tool_name}'. Output: {log_output}")
+        return ToolMessage(content=str(output), tool_call_id=call["id"])
+    error_message = f"Error: Tool '{tool_name}' not found."
+    logger.error(error_message)
+    return ToolMessage(content=error_message, tool_call_id=call["id"])
+
+
+def _new_scheduler() -> ToolScheduler:
+    # Repeated searches are answered by find_interactive_element's own cache, which tracks page changes
+    return ToolScheduler(_run_tool, READ_ONLY_TOOLS.__contains__)
+
+async def agent_node(state: AgentState):
+    """Streams the LLM response, starting its tool calls early, and logs the strategy behind each call."""
+    messages = state["messages"]
+    if not any(isinstance(message, ToolMessage) for message in messages):
+        messages = messages + [BATCH_PLAN_PROMPT]
+    # Stream the response and start each tool call as soon as it is complete, so tool execution
+    # overlaps with the model still generating the rest of the turn
+    response = await stream_turn(model_with_tools, messages, _new_scheduler())
     
     # --- NEW: Logging logic to inspect the LLM's decision ---
     if tool_calls := response.tool_calls:
         # Get the context from the state to check against
-        context_events = state.get("context_events", [])
-        context_xpaths = {event['target']['xpath'] for event in context_events if 'target' in event and 'xpath' in event['target']}
+        context_xpaths = state.get("context_xpaths", frozenset())
 
         for call in tool_calls:
             tool_name = call['name']
@@ -470,31 +647,18 @@ def agent_node(state: AgentState):
             
     return {"messages": [response]}
 
-def tool_node(state: AgentState):
-    tool_map = {t.name: t for t in tools}
+async def tool_node(state: AgentState):
+    """Collects the results of the tool calls agent_node started while the response streamed."""
     tool_calls = state["messages"][-1].tool_calls
-    tool_messages = []
-    for call in tool_calls:
-        tool_name = call['name']
-        tool_args = call['args']
-        
-        # --- MODIFIED: Use logger instead of print ---
-        logger.info(f"EXECUTING tool '{tool_name}' with args: {tool_args}")
-        
-        tool_to_call = tool_map.get(tool_name)
-        if tool_to_call:
-            output = tool_to_call.invoke(tool_args)
-            log_output = (str(output)[:1000] + '...') if len(str(output)) > 1000 else str(output)
-            
-            # --- MODIFIED: Use logger instead of print ---
-            logger.info(f"COMPLETED tool '{tool_name}'. Output: {log_output}")
-            tool_messages.append(ToolMessage(content=str(output), tool_call_id=call["id"]))
-        else:
-            error_message = f"Error: Tool '{tool_name}' not found."
-            logger.error(error_message)
-            tool_messages.append(ToolMessage(content=error_message, tool_call_id=call["id"]))
-            
-    return {"messages": tool_messages}
+    scheduler = claim_turn(tool_calls)
+    if scheduler is None:
+        scheduler = _new_scheduler()
+        for call in tool_calls:
+            scheduler.dispatch(call)
+    # Results come back in call order
+    tool_messages = await scheduler.results()
+    return {"messages": list(tool_messages)}
+
 def should_continue(state: AgentState):
     if not state["messages"][-1].tool_calls:
         return "end"
@@ -509,6 +673,79 @@ workflow.add_edge("tools", "agent")
 app_graph = workflow.compile()
 
 # --- 5. FastAPI Endpoint ---
+SYSTEM_PROMPT_TEMPLATE = """
+You are an expert web automation assistant. Your goal is to perform tasks in a web browser.
+
+**Your Workflow and Rules:**
+1.  **Initial Setup:**
+    - Your first step is ALWAYS `start_browser`.
+    - Your second step is ALWAYS `maximize_window`.
+
+2.  **Find Elements with Precision (Strict Priority Order):**
+    - **Rule A (Direct Selector):** If the user provides a full, direct XPath/CSS selector, use it immediately.
+    - **Rule B (Contextual Search):** If the user asks for an element by description and a "Context from Chrome Extension" is provided, first try to find a matching elements in that total JSON context by checking whole object and `action_description`. If a match is found, use its corresponding `xpath`.
+    - **Rule C (Scoped Search):** If the user asks to find an element *inside* another, use the `find_interactive_element` tool with both `element_query` and `container_xpath`.
+    - **Rule D (General Search):** If the above methods don't apply or fail, use `find_interactive_element` with only the `element_query` to find the element on the page.
+
+3.  **NEW - Chaining Actions (Verify then Act):**
+    - The `verify_text_on_element` tool now returns a JSON object like `{"success": true, "locator": {"by": "xpath", "value": "..."}}`.
+    - If the user asks you to perform an action on an element immediately after verifying it (e.g., "verify text 'Sign In' and then click it"), you MUST use the `locator` from the successful JSON response for the next action (e.g., `click_element(by='xpath', value='...')`).
+
+4.  **Prioritize and Act:** When using `find_interactive_element`, you MUST use the `selector` of the element with the highest `score` for your next action.
+
+5.  **Error Recovery:** If a tool call returns an error (e.g., "Error clicking element"), DO NOT retry the exact same call. Immediately switch to **Rule D (General Search)** to find a better selector.
+
+6.  **Completion:** Once all tasks are done, you MUST call `close_browser` to finish.
+"""
+CONTEXT_PROMPT_TEMPLATE = (
+    "\n\n--- Context from Chrome Extension ---\n"
+    "Here is a list of recorded events. Use the 'xpath' or 'css' from these events if they match the user's query.\n"
+    "{context_json}\n"
+    "-------------------------------------\n"
+)
+
+# The system prompt with no context file is the same for every request, so it is built once. Sending the
+# exact same prompt prefix each time lets the provider's prompt cache serve it.
+BASE_SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT_TEMPLATE)
+
+# filename -> (mtime, parsed events, their XPaths, system message with the events embedded);
+# a context file is only re-read and its prompt only rebuilt after it changes
+_CONTEXT_CACHE = {}
+# Larger context files are rejected instead of being read into memory and into every prompt
+MAX_CONTEXT_FILE_BYTES = 10 * 1024 * 1024
+
+def _read_context_file(filename: str):
+    """
+    Reads and parses a context file and builds the system message embedding its events. The events go
+    into the prompt as compact JSON with sorted keys: the model does not need pretty-printing, and a
+    byte-identical prompt keeps hitting the provider's prompt cache.
+    """
+    with open(filename, 'rb') as f:
+        events = orjson.loads(f.read())
+    xpaths = frozenset(
+        event['target']['xpath'] for event in events
+        if isinstance(event, dict) and 'target' in event and 'xpath' in event['target']
+    ) if isinstance(events, list) else frozenset()
+    compact_json = orjson.dumps(events, option=orjson.OPT_SORT_KEYS).decode()
+    system_message = SystemMessage(
+        content=SYSTEM_PROMPT_TEMPLATE + CONTEXT_PROMPT_TEMPLATE.format(context_json=compact_json)
+    ) if events else BASE_SYSTEM_MESSAGE
+    return events, xpaths, system_message
+
+async def _load_context_file(filename: str):
+    """
+    Returns the parsed events of a context file, the set of XPaths they record and the system message
+    embedding them. Only a cache miss reads the file, in a worker thread so the read and the parse do
+    not block the event loop for other requests.
+    """
+    stat = os.stat(filename)
+    if stat.st_size > MAX_CONTEXT_FILE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Context file is larger than {MAX_CONTEXT_FILE_BYTES} bytes.")
+    cached = _CONTEXT_CACHE.get(filename)
+    if cached is None or cached[0] != stat.st_mtime:
+        cached = _CONTEXT_CACHE[filename] = (stat.st_mtime, *await asyncio.to_thread(_read_context_file, filename))
+    return cached[1:]
+
 @app.post("/automate")
 async def automate(request: AutomationRequest):
     if not request.query:
@@ -516,63 +753,28 @@ async def automate(request: AutomationRequest):
 
     # --- NEW: Load context from the specified filename ---
     context_events_data = ""
+    context_xpaths = frozenset()
+    system_message = BASE_SYSTEM_MESSAGE
     if request.context_filename:
         try:
             # Check for directory traversal attempts for security
             if ".." in request.context_filename or request.context_filename.startswith("/"):
                 raise HTTPException(status_code=400, detail="Invalid filename.")
             
-            with open(request.context_filename, 'r') as f:
-                context_events_data = json.load(f)
+            context_events_data, context_xpaths, system_message = await _load_context_file(request.context_filename)
+        except HTTPException:
+            raise
         except FileNotFoundError:
             raise HTTPException(status_code=404, detail=f"Context file not found: {request.context_filename}")
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             raise HTTPException(status_code=400, detail=f"Error decoding JSON from file: {request.context_filename}")
         except Exception as e:
             # Catch other potential file-reading errors
             raise HTTPException(status_code=500, detail=f"An error occurred while reading the context file: {str(e)}")
 
 
-    # --- DYNAMIC SYSTEM PROMPT (Now uses data read from file) ---
-    system_prompt_template = """
-    You are an expert web automation assistant. Your goal is to perform tasks in a web browser.
-
-    **Your Workflow and Rules:**
-    1.  **Initial Setup:**
-        - Your first step is ALWAYS `start_browser`.
-        - Your second step is ALWAYS `maximize_window`.
-
-    2.  **Find Elements with Precision (Strict Priority Order):**
-        - **Rule A (Direct Selector):** If the user provides a full, direct XPath/CSS selector, use it immediately.
-        - **Rule B (Contextual Search):** If the user asks for an element by description and a "Context from Chrome Extension" is provided, first try to find a matching elements in that total JSON context by checking whole object and `action_description`. If a match is found, use its corresponding `xpath`.
-        - **Rule C (Scoped Search):** If the user asks to find an element *inside* another, use the `find_interactive_element` tool with both `element_query` and `container_xpath`.
-        - **Rule D (General Search):** If the above methods don't apply or fail, use `find_interactive_element` with only the `element_query` to find the element on the page.
-
-    3.  **NEW - Chaining Actions (Verify then Act):**
-        - The `verify_text_on_element` tool now returns a JSON object like `{"success": true, "locator": {"by": "xpath", "value": "..."}}`.
-        - If the user asks you to perform an action on an element immediately after verifying it (e.g., "verify text 'Sign In' and then click it"), you MUST use the `locator` from the successful JSON response for the next action (e.g., `click_element(by='xpath', value='...')`).
-
-    4.  **Prioritize and Act:** When using `find_interactive_element`, you MUST use the `selector` of the element with the highest `score` for your next action.
-
-    5.  **Error Recovery:** If a tool call returns an error (e.g., "Error clicking element"), DO NOT retry the exact same call. Immediately switch to **Rule D (General Search)** to find a better selector.
-
-    6.  **Completion:** Once all tasks are done, you MUST call `close_browser` to finish.
-    """
-
-    context_str = ""
-    if context_events_data:
-        # Format the JSON context so the LLM can easily read it.
-        context_str = (
-            "\n\n--- Context from Chrome Extension ---\n"
-            "Here is a list of recorded events. Use the 'xpath' or 'css' from these events if they match the user's query.\n"
-            f"{json.dumps(context_events_data, indent=2)}\n"
-            "-------------------------------------\n"
-        )
-
-    final_system_prompt = system_prompt_template + context_str
-    
     initial_messages = [
-        SystemMessage(content=final_system_prompt),
+        system_message,
         HumanMessage(content=request.query)
     ]
 
@@ -580,14 +782,22 @@ async def automate(request: AutomationRequest):
         config = {"recursion_limit": 100}
         initial_state = {
             "messages": initial_messages,
-            "context_events": context_events_data
+            "context_events": context_events_data,
+            "context_xpaths": context_xpaths,
         }
-        await app_graph.ainvoke(initial_state, config=config)
+        session = WebDriverManager()
+        session_var.set(session)
+        # The browser is checked out for this request only and reset back into the pool afterwards
+        async with driver_pool.acquire(render=request.render) as driver:
+            # Preparing a browser makes blocking DevTools calls, so it runs in a worker thread
+            await asyncio.to_thread(session.attach, driver)
+            try:
+                # Tool calls still running when the graph stops are finished before the browser is detached
+                async with tool_turns():
+                    await app_graph.ainvoke(initial_state, config=config)
+            finally:
+                session.detach()
         return {"message": "Automation task processed successfully."}
     except Exception as e:
         print(f"ERROR in automation graph: {e}")
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
-    finally:
-        if driver_manager.driver:
-            driver_manager.driver.quit()
-            driver_manager.driver = None
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
\ No newline at end of file
@@ -1,15 +1,23 @@
 # filename: main_agentic.py
 import os
 import uuid
+import asyncio
+import itertools
 import operator
 import json
+import orjson
 import time
+import contextvars
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import List, Optional, Annotated, TypedDict
+from typing import Callable, Dict, List, Optional, Annotated, TypedDict
 
 from dotenv import load_dotenv
 
+from driver_pool import widen_connection_pool
+from selenium_lookups import get_selenium_by
+from cdp_waits import cdp_wait_for_load, match_text, wait_for_dom_quiet
+
 # LangChain Imports
 from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, SystemMessage
 from langchain_openai import ChatOpenAI
@@ -55,45 +63,13 @@ class WebDriverManager:
     def __init__(self):
         self.driver = None
 
-driver_manager = WebDriverManager()
-
-# --- NEW HELPER FUNCTION ---
-def _get_selenium_by(by_strategy: str) -> str:
-    """Translates a user-friendly locator string to the Selenium By class attribute."""
-    by_strategy = by_strategy.lower()
-    if by_strategy in ['css', 'css_selector', 'css selector']:
-        return By.CSS_SELECTOR
-    elif by_strategy in ['xpath', 'fullxpath']:
-        return By.XPATH
-    elif by_strategy == 'id':
-        return By.ID
-    elif by_strategy == 'name':
-        return By.NAME
-    elif by_strategy == 'class_name':
-        return By.CLASS_NAME
-    elif by_strategy == 'tag_name':
-        return By.TAG_NAME
-    elif by_strategy == 'link_text':
-        return By.LINK_TEXT
-    elif by_strategy == 'partial_link_text':
-        return By.PARTIAL_LINK_TEXT
-    else:
-        raise ValueError(f"Unsupported locator strategy: {by_strategy}")
-
-
-# --- 3. Modular, Independent Tools ---
-
-@tool
-def find_interactive_element(element_query: str, container_xpath: Optional[str] = None) -> str:
-    """
-    Finds an element via natural language. Optionally scopes the search within a container XPath.
-    Use `container_xpath` when the user asks to find an element "inside" or "within" another.
-    Returns a ranked JSON list of matching elements with relevance scores.
-    """
-    if not driver_manager.driver:
-        return "Error: Browser not started. Call start_browser first."
+# Each request gets its own WebDriverManager, published through this ContextVar, so concurrent
+# requests (and the worker threads their tools run in) never see each other's browser
+session_var: contextvars.ContextVar[WebDriverManager] = contextvars.ContextVar("session")
 
-    javascript = """
+# --- Element finder script ---
+# Ranks the page's elements against arguments[0], optionally within the container at XPath arguments[1].
+FIND_INTERACTIVE_ELEMENT_JS = """
     /**
     * This script finds and ranks elements on a web page based on a query.
     * v3 - Now with Score Normalization to prioritize specificity.
@@ -102,30 +78,56 @@ def find_interactive_element(element_query: str, container_xpath: Optional[str]
     // =================================================================================
     //  1. UTILITIES
     // =================================================================================
+    // XPath of every element already resolved during this call; results often share ancestors
+    const xpathCache = new Map();
+
     const createXPath = (element) => {
-        if (element.id !== '') return `//*[@id="${element.id}"]`;
-        if (element === document.body) return '/html/body';
-        let ix = 0;
-        const siblings = element.parentNode.childNodes;
-        for (let i = 0; i < siblings.length; i++) {
-            const sibling = siblings[i];
-            if (sibling === element) {
-                return `${createXPath(element.parentNode)}/${element.tagName.toLowerCase()}[${ix + 1}]`;
-            }
-            if (sibling.nodeType === 1 && sibling.tagName === element.tagName) {
-                ix++;
+        // Walk up until an ancestor whose XPath is known: a cached one, one with an id, or the body
+        const chain = [];
+        let xpath = '';
+        for (let node = element; node && node.nodeType === 1; node = node.parentNode) {
+            if (xpathCache.has(node)) { xpath = xpathCache.get(node); break; }
+            if (node.id !== '') { xpath = `//*[@id="${node.id}"]`; break; }
+            if (node === document.body) { xpath = '/html/body'; break; }
+            chain.push(node);
+        }
+        // Then append a step per element on the way back down, counting same-tag preceding siblings
+        for (let i = chain.length - 1; i >= 0; i--) {
+            const node = chain[i];
+            let ix = 1;
+            for (let sibling = node.previousElementSibling; sibling; sibling = sibling.previousElementSibling) {
+                if (sibling.tagName === node.tagName) ix++;
             }
+            xpath = `${xpath}/${node.tagName.toLowerCase()}[${ix}]`;
+            xpathCache.set(node, xpath);
         }
+        return xpath;
     };
 
-    const getElementText = (el) => {
+    // Raw text of every candidate, filled bottom-up by the main logic, and the normalized text per element
+    const rawTexts = new WeakMap();
+    const elementTexts = new WeakMap();
+
+    const getRawText = (el) => {
+        if (rawTexts.has(el)) return rawTexts.get(el);
         const text = [];
         const walk = document.createTreeWalker(el, NodeFilter.SHOW_TEXT, null, false);
         let node;
         while (node = walk.nextNode()) {
             text.push(node.nodeValue);
         }
-        return text.join(' ').trim().replace(/\\s+/g, ' ');
+        const rawText = text.join(' ');
+        rawTexts.set(el, rawText);
+        return rawText;
+    };
+
+    const getElementText = (el) => {
+        let text = elementTexts.get(el);
+        if (text === undefined) {
+            text = getRawText(el).trim().replace(/\\s+/g, ' ');
+            elementTexts.set(el, text);
+        }
+        return text;
     };
 
     const getConciseName = (el, textContent) => {
@@ -133,76 +135,116 @@ def find_interactive_element(element_query: str, container_xpath: Optional[str]
         return name.trim().substring(0, 100);
     }
 
-    const levenshtein = (s1, s2) => {
+    // Myers' bit-parallel edit distance: one pass over the longer string, with the DP column of the
+    // shorter one (a query token) packed into the bits of a 32-bit integer. Distances above
+    // maxDistance are only known to be larger, which is all the caller needs.
+    const peq = new Uint32Array(0x10000);
+    const levenshtein = (s1, s2, maxDistance) => {
         if (s1.length > s2.length) { [s1, s2] = [s2, s1]; }
-        const distances = Array.from({ length: s1.length + 1 }, (_, i) => i);
-        for (let j = 0; j < s2.length; j++) {
-            let prev = distances[0];
-            distances[0]++;
-            for (let i = 0; i < s1.length; i++) {
-                const temp = distances[i + 1];
-                distances[i + 1] = Math.min(distances[i] + 1, distances[i + 1] + 1, prev + (s1[i] === s2[j] ? 0 : 1));
-                prev = temp;
+        const n = s1.length;
+        const m = s2.length;
+        if (m - n > maxDistance) return maxDistance + 1;
+        if (n === 0) return m;
+        if (n > 32) return levenshteinBanded(s1, s2, maxDistance);
+        const last = 1 << (n - 1);
+        let pv = -1, mv = 0, score = n;
+        for (let i = 0; i < n; i++) peq[s1.charCodeAt(i)] |= 1 << i;
+        for (let j = 0; j < m; j++) {
+            let eq = peq[s2.charCodeAt(j)];
+            const xv = eq | mv;
+            eq |= ((eq & pv) + pv) ^ pv;
+            mv |= ~(eq | pv);
+            pv &= eq;
+            if (mv & last) score++;
+            if (pv & last) score--;
+            mv = (mv << 1) | 1;
+            pv = (pv << 1) | ~(xv | mv);
+            mv &= xv;
+            // Each remaining character can lower the distance by at most one
+            if (score - (m - j - 1) > maxDistance) break;
+        }
+        for (let i = 0; i < n; i++) peq[s1.charCodeAt(i)] = 0;
+        return score;
+    };
+
+    // For the rare pair in which even the shorter string exceeds 32 characters: dynamic programming
+    // restricted to the cells within maxDistance of the diagonal, since any path leaving that band
+    // already costs more. Rows are abandoned as soon as every cell in the band exceeds maxDistance.
+    const levenshteinBanded = (s1, s2, maxDistance) => {
+        const n = s1.length, m = s2.length, limit = maxDistance + 1;
+        let prev = new Array(m + 1), cur = new Array(m + 1);
+        for (let j = 0; j <= m; j++) prev[j] = Math.min(j, limit);
+        for (let i = 1; i <= n; i++) {
+            const lo = Math.max(1, i - maxDistance), hi = Math.min(m, i + maxDistance);
+            cur[lo - 1] = lo === 1 ? Math.min(i, limit) : limit;
+            let rowMin = cur[lo - 1];
+            for (let j = lo; j <= hi; j++) {
+                const v = Math.min(prev[j - 1] + (s1[i - 1] === s2[j - 1] ? 0 : 1), prev[j] + 1, cur[j - 1] + 1, limit);
+                cur[j] = v;
+                if (v < rowMin) rowMin = v;
             }
+            if (hi < m) cur[hi + 1] = limit;
+            if (rowMin >= limit) return limit;
+            [prev, cur] = [cur, prev];
         }
-        return distances[s1.length];
+        return prev[m];
     };
 
     // =================================================================================
     //  2. ADVANCED SCORING LOGIC v3
     // =================================================================================
-    const calculateScore = (el, query) => {
+    // The scored sources, as parallel columns reused for every element instead of an array of
+    // objects allocated per element: visible text first (the only 'content' source), then attributes
+    const sourceWeights = [1.0, 1.5, 1.5, 2.0, 2.0, 2.5, 3.0];
+    const sourceTexts = new Array(sourceWeights.length);
+    const tagMultipliers = {
+        'a': 1.5, 'button': 1.5, 'input': 1.4, 'select': 1.3,
+        'textarea': 1.3, 'div': 0.9, 'span': 0.95,
+        'body': 0.1, 'html': 0.1
+    };
+
+    const calculateScore = (el, queryLower, queryTokens) => {
         const rect = el.getBoundingClientRect();
         if (!rect.width || !rect.height || window.getComputedStyle(el).visibility === 'hidden') {
             return -1;
         }
 
         let score = 0;
-        const queryLower = query.toLowerCase();
-        const queryTokens = queryLower.split(/\\s+/).filter(Boolean);
-        const textContent = getElementText(el).toLowerCase();
-
-        const sources = [
-            { text: textContent, weight: 1.0, type: 'content' },
-            { text: (el.value || "").toLowerCase(), weight: 1.5, type: 'attribute' },
-            { text: (el.placeholder || "").toLowerCase(), weight: 1.5, type: 'attribute' },
-            { text: (el.ariaLabel || "").toLowerCase(), weight: 2.0, type: 'attribute' },
-            { text: (el.name || "").toLowerCase(), weight: 2.0, type: 'attribute' },
-            { text: (el.id || "").toLowerCase(), weight: 2.5, type: 'attribute' },
-            { text: (el.dataset.testid || "").toLowerCase(), weight: 3.0, type: 'attribute' }
-        ];
-
-        for (const source of sources) {
-            if (!source.text) continue;
-            const text = source.text;
-            const specificityBonus = (source.type === 'content')
+        sourceTexts[0] = getElementText(el).toLowerCase();
+        sourceTexts[1] = (el.value || "").toLowerCase();
+        sourceTexts[2] = (el.placeholder || "").toLowerCase();
+        sourceTexts[3] = (el.ariaLabel || "").toLowerCase();
+        sourceTexts[4] = (el.name || "").toLowerCase();
+        sourceTexts[5] = (el.id || "").toLowerCase();
+        sourceTexts[6] = (el.dataset.testid || "").toLowerCase();
+
+        for (let s = 0; s < sourceTexts.length; s++) {
+            const text = sourceTexts[s];
+            if (!text) continue;
+            const weight = sourceWeights[s];
+            const specificityBonus = (s === 0)
                 ? 1 / (1 + Math.log10(Math.max(1, text.length)))
                 : 1;
 
             if (text === queryLower) {
-                score += 100 * source.weight * specificityBonus;
+                score += 100 * weight * specificityBonus;
             }
 
-            queryTokens.forEach(qToken => {
+            for (let t = 0; t < queryTokens.length; t++) {
+                const qToken = queryTokens[t];
                 if (text.includes(qToken)) {
                      const proximityBonus = qToken.length / text.length;
-                     score += 20 * source.weight * proximityBonus * specificityBonus;
+                     score += 20 * weight * proximityBonus * specificityBonus;
                 } else {
-                    const distance = levenshtein(qToken, text);
+                    const distance = levenshtein(qToken, text, 2);
                     if (distance <= 2) {
-                       score += (10 / (distance + 1)) * source.weight * specificityBonus;
+                       score += (10 / (distance + 1)) * weight * specificityBonus;
                     }
                 }
-            });
+            }
         }
         
         const tag = el.tagName.toLowerCase();
-        const tagMultipliers = {
-            'a': 1.5, 'button': 1.5, 'input': 1.4, 'select': 1.3,
-            'textarea': 1.3, 'div': 0.9, 'span': 0.95,
-            'body': 0.1, 'html': 0.1
-        };
-
         const multiplier = tagMultipliers[tag] || 1.0;
         return score * multiplier;
     };
@@ -212,6 +254,9 @@ def find_interactive_element(element_query: str, container_xpath: Optional[str]
     // =================================================================================
     const query = arguments[0];
     const containerXPath = arguments[1];
+    // The query is normalized once, not for every scored element
+    const queryLower = query.toLowerCase();
+    const queryTokens = queryLower.split(/\\s+/).filter(Boolean);
     let searchContext = document;
 
     if (containerXPath) {
@@ -222,13 +267,22 @@ def find_interactive_element(element_query: str, container_xpath: Optional[str]
         searchContext = containerNode;
     }
 
-    const allElements = Array.from(searchContext.querySelectorAll('*'));
-    const forbiddenTags = new Set(['SCRIPT', 'STYLE', 'HEAD', 'META', 'LINK']);
-
-    const scoredElements = allElements
-        .filter(el => !forbiddenTags.has(el.tagName.toUpperCase()))
-        .map(el => {
-            const score = calculateScore(el, query);
+    // Scores the given elements, building their texts first. An element's text is its text nodes and its
+    // child elements' text, in order. Children come after their parent in document order, so walking the
+    // list backwards builds each element's text from its children's, reading each text node once instead
+    // of re-walking every ancestor's subtree; children outside the list are walked (and cached) on demand.
+    const scoreElements = (elements) => {
+        for (let i = elements.length - 1; i >= 0; i--) {
+            if (rawTexts.has(elements[i])) continue;
+            const parts = [];
+            for (const child of elements[i].childNodes) {
+                const part = child.nodeType === 3 ? child.nodeValue : (child.nodeType === 1 ? getRawText(child) : '');
+                if (part) parts.push(part);
+            }
+            rawTexts.set(elements[i], parts.join(' '));
+        }
+        return elements.map(el => {
+            const score = calculateScore(el, queryLower, queryTokens);
             const textContent = getElementText(el);
             return {
                 element: el,
@@ -236,6 +290,18 @@ def find_interactive_element(element_query: str, container_xpath: Optional[str]
                 name: getConciseName(el, textContent)
             };
         });
+    };
+
+    // Interactive elements almost always win the ranking, so only they are scored at first. Every element
+    // is scored only when they yield fewer than 5 matches. (None of the forbidden tags match the selector.)
+    const interactiveSelector = 'a, button, input, select, textarea, [role=button], [role=link], [onclick], ' +
+        '[tabindex], label, [contenteditable], [data-testid], [aria-label]';
+    let scoredElements = scoreElements(Array.from(searchContext.querySelectorAll(interactiveSelector)));
+    if (scoredElements.filter(item => item.score > 0).length < 5) {
+        const allElements = Array.from(searchContext.querySelectorAll('*'));
+        const forbiddenTags = new Set(['SCRIPT', 'STYLE', 'HEAD', 'META', 'LINK']);
+        scoredElements = scoreElements(allElements.filter(el => !forbiddenTags.has(el.tagName.toUpperCase())));
+    }
 
     const finalResults = scoredElements
         .filter(item => item.score > 0)
@@ -248,16 +314,78 @@ def find_interactive_element(element_query: str, container_xpath: Optional[str]
             score: Math.round(item.score)
         }));
 
-    return JSON.stringify(finalResults, null, 2);
+    // An empty string tells Python there was no match without it having to parse the result;
+    // the model does not need the JSON pretty-printed
+    return finalResults.length ? JSON.stringify(finalResults) : "";
+"""
+
+# The finder is large, so it is not shipped with every call. start_browser registers it with CDP to be
+# defined in every new document as window.__findInteractiveElement; a call then sends only a short stub
+# that returns null where the helper is missing (a driver without CDP). The full script is then sent
+# once, defining the helper in that document for the calls after it.
+_INSTALL_FIND_INTERACTIVE_ELEMENT_JS = f"window.__findInteractiveElement = function() {{ {FIND_INTERACTIVE_ELEMENT_JS} }};"
+FIND_INTERACTIVE_ELEMENT_CALL_JS = """
+return window.__findInteractiveElement ? window.__findInteractiveElement(arguments[0], arguments[1]) : null;
+"""
+# Runs the finder once per {element_query, container_xpath} in arguments[0]
+FIND_INTERACTIVE_ELEMENTS_BATCH_CALL_JS = """
+if (!window.__findInteractiveElement) return null;
+return arguments[0].map(q => window.__findInteractiveElement(q.element_query || "", q.container_xpath || null));
+"""
+
+def _run_finder(driver, call_js: str, *args):
+    """Runs call_js against the page's finder helper, installing the helper first if the page lacks it."""
+    result = driver.execute_script(call_js, *args)
+    if result is None:
+        result = driver.execute_script(_INSTALL_FIND_INTERACTIVE_ELEMENT_JS + call_js, *args)
+    return result
+
+
+# --- 3. Modular, Independent Tools ---
+
+@tool
+def find_interactive_element(element_query: str, container_xpath: Optional[str] = None) -> str:
+    """
+    Finds an element via natural language. Optionally scopes the search within a container XPath.
+    Use `container_xpath` when the user asks to find an element "inside" or "within" another.
+    Returns a ranked JSON list of matching elements with relevance scores.
     """
+    session = session_var.get()
+    if not session.driver:
+        return "Error: Browser not started. Call start_browser first."
+
     try:
-        result = driver_manager.driver.execute_script(javascript, element_query, container_xpath)
-        if not json.loads(result):
+        result = _run_finder(session.driver, FIND_INTERACTIVE_ELEMENT_CALL_JS, element_query, container_xpath)
+        if not result:
              return f"No visible element found matching query: '{element_query}'. Try a different query or context."
         return result
     except Exception as e:
         return f"Error executing script to find element: {e}"
 
+@tool
+def find_interactive_elements_batch(queries: List[Dict[str, Optional[str]]]) -> str:
+    """
+    Finds several elements in one call. Each entry of `queries` has an `element_query` and an optional
+    `container_xpath`, exactly like the arguments of `find_interactive_element`.
+    Use this instead of several `find_interactive_element` calls when you need more than one element
+    from the same page. Returns a JSON list with the ranked matches for each query, in the same order.
+    """
+    session = session_var.get()
+    if not session.driver:
+        return "Error: Browser not started. Call start_browser first."
+    try:
+        results = _run_finder(session.driver, FIND_INTERACTIVE_ELEMENTS_BATCH_CALL_JS, queries)
+        return orjson.dumps([
+            {
+                "element_query": query.get("element_query"),
+                "container_xpath": query.get("container_xpath"),
+                "matches": orjson.loads(result) if result else [],
+            }
+            for query, result in zip(queries, results)
+        ]).decode()
+    except Exception as e:
+        return f"Error executing script to find elements: {e}"
+
 @tool
 def wait_for_seconds(seconds: int) -> str:
     """
@@ -277,17 +405,18 @@ def scroll_page(direction: str) -> str:
     `direction` can be 'up', 'down', 'top', or 'bottom'.
     Use 'down' to load more content on infinite-scroll pages or to find elements below the fold.
     """
-    if not driver_manager.driver:
+    session = session_var.get()
+    if not session.driver:
         return "Error: Browser not started."
     try:
         if direction == "down":
-            driver_manager.driver.execute_script("window.scrollBy(0, window.innerHeight);")
+            session.driver.execute_script("window.scrollBy(0, window.innerHeight);")
         elif direction == "up":
-            driver_manager.driver.execute_script("window.scrollBy(0, -window.innerHeight);")
+            session.driver.execute_script("window.scrollBy(0, -window.innerHeight);")
         elif direction == "top":
-            driver_manager.driver.execute_script("window.scrollTo(0, 0);")
+            session.driver.execute_script("window.scrollTo(0, 0);")
         elif direction == "bottom":
-            driver_manager.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            session.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
         else:
             return "Error: Invalid scroll direction. Use 'up', 'down', 'top', or 'bottom'."
         return f"Successfully scrolled {direction}."
@@ -297,12 +426,17 @@ def scroll_page(direction: str) -> str:
 @tool
 def start_browser(browser: str = "chrome") -> str:
     """Starts a web browser session. Call this first."""
-    if driver_manager.driver:
+    session = session_var.get()
+    if session.driver:
         return "Browser is already running."
     if browser.lower() == "chrome":
         options = uc.ChromeOptions()
-        driver_manager.driver = uc.Chrome(options=options)
-        driver_manager.driver.set_window_size(1080, 720)
+        session.driver = widen_connection_pool(uc.Chrome(options=options))
+        session.driver.set_window_size(1080, 720)
+        if hasattr(session.driver, "execute_cdp_cmd"):
+            session.driver.execute_cdp_cmd(
+                "Page.addScriptToEvaluateOnNewDocument", {"source": _INSTALL_FIND_INTERACTIVE_ELEMENT_JS}
+            )
         return f"Chrome browser started successfully."
     else:
         return "Unsupported browser. Please choose 'chrome'."
@@ -310,18 +444,20 @@ def start_browser(browser: str = "chrome") -> str:
 @tool
 def navigate_to_url(url: str) -> str:
     """Navigates the browser to a specified URL."""
-    if not driver_manager.driver:
+    session = session_var.get()
+    if not session.driver:
         return "Error: Browser not started. Call start_browser first."
-    driver_manager.driver.get(url)
+    session.driver.get(url)
     return f"Successfully navigated to {url}."
 
 @tool
 def click_element(by: str, value: str) -> str:
     """Clicks on an element found by a locator."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 10)
+        locator = (get_selenium_by(by), value)
+        wait = WebDriverWait(session.driver, 10)
         element = wait.until(EC.element_to_be_clickable(locator))
         element.click()
         return f"Successfully clicked element with {by}='{value}'."
@@ -331,10 +467,11 @@ def click_element(by: str, value: str) -> str:
 @tool
 def send_keys_to_element(by: str, value: str, text: str) -> str:
     """Sends text to an element found by a locator."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 10)
+        locator = (get_selenium_by(by), value)
+        wait = WebDriverWait(session.driver, 10)
         element = wait.until(EC.element_to_be_clickable(locator))
         element.send_keys(text)
         return f"Successfully sent '{text}' to element with {by}='{value}'."
@@ -344,16 +481,17 @@ def send_keys_to_element(by: str, value: str, text: str) -> str:
 @tool
 def press_key_on_element(key: str, by: Optional[str] = None, value: Optional[str] = None) -> str:
     """Presses a special key (e.g., 'ENTER', 'TAB') globally or on a specific element."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
         key_to_press = getattr(Keys, key.upper())
         element = None
         if by and value:
-            locator = (_get_selenium_by(by), value)
-            wait = WebDriverWait(driver_manager.driver, 10)
+            locator = (get_selenium_by(by), value)
+            wait = WebDriverWait(session.driver, 10)
             element = wait.until(EC.element_to_be_clickable(locator))
         else:
-            element = driver_manager.driver.find_element(By.TAG_NAME, 'body')
+            element = session.driver.find_element(By.TAG_NAME, 'body')
         element.send_keys(key_to_press)
         return f"Successfully pressed key '{key}'."
     except Exception as e:
@@ -365,17 +503,23 @@ def verify_text_on_element(by: str, value: str, text: str) -> str:
     Verifies that an element contains the expected text.
     Returns a JSON object with the verification status and the locator used.
     """
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     
     result = {"success": False, "message": "", "locator": {"by": by, "value": value}}
     
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 10)
-        element = wait.until(EC.visibility_of_element_located(locator))
-        actual_text = element.text
+        locator = (get_selenium_by(by), value)
+        # One script call compares the text in the page; only a missing or hidden element (or a strategy
+        # the script cannot evaluate) falls back to waiting for it and reading its text
+        matched = match_text(session.driver, locator, text)
+        if matched is None:
+            wait = WebDriverWait(session.driver, 10)
+            actual_text = wait.until(EC.visibility_of_element_located(locator)).text
+            matched = (text.lower() in actual_text.lower(), actual_text)
+        found, actual_text = matched
         
-        if text.lower() in actual_text.lower():
+        if found:
             result["success"] = True
             result["message"] = f"✅ Verification successful: Found text '{text}' in element."
         else:
@@ -392,10 +536,11 @@ def select_dropdown_option(by: str, value: str, option_by: str, option_value: st
     `option_by` specifies how to find the option: 'text', 'value', or 'index'.
     `option_value` is the corresponding text, value, or index of the option to select.
     """
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 10)
+        locator = (get_selenium_by(by), value)
+        wait = WebDriverWait(session.driver, 10)
         select_element = wait.until(EC.element_to_be_clickable(locator))
         select = Select(select_element)
         
@@ -415,9 +560,10 @@ def select_dropdown_option(by: str, value: str, option_by: str, option_value: st
 @tool
 def maximize_window() -> str:
     """Maximizes the browser window to fill the entire screen."""
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        driver_manager.driver.maximize_window()
+        session.driver.maximize_window()
         return "Browser window maximized successfully."
     except Exception as e:
         return f"Error maximizing window: {e}"
@@ -429,11 +575,11 @@ def wait_for_page_load(timeout: int = 30) -> str:
     Waits for the page to be in a 'complete' ready state.
     Use this after navigating to a new URL or after a click that is expected to load a new page.
     """
-    if not driver_manager.driver:
+    session = session_var.get()
+    if not session.driver:
         return "Error: Browser not started."
     try:
-        wait = WebDriverWait(driver_manager.driver, timeout)
-        wait.until(lambda driver: driver.execute_script('return document.readyState') == 'complete')
+        cdp_wait_for_load(session.driver, timeout * 1000)
         return f"Page successfully loaded and is in a ready state."
     except Exception as e:
         return f"Error waiting for page to load: {e}"
@@ -444,10 +590,11 @@ def get_element_attribute(by: str, value: str, attribute: str) -> str:
     """
     Gets a specific attribute from an element (e.g., 'href' for a link, 'src' for an image).
     """
-    if not driver_manager.driver: return "Error: Browser not started."
+    session = session_var.get()
+    if not session.driver: return "Error: Browser not started."
     try:
-        locator = (_get_selenium_by(by), value)
-        wait = WebDriverWait(driver_manager.driver, 10)
+        locator = (get_selenium_by(by), value)
+        wait = WebDriverWait(session.driver, 10)
         element = wait.until(EC.presence_of_element_located(locator))
         attr_value = element.get_attribute(attribute)
         if attr_value is not None:
@@ -460,9 +607,10 @@ def get_element_attribute(by: str, value: str, attribute: str) -> str:
 @tool
 def close_browser() -> str:
     """Closes the browser session. Call this when the task is complete."""
-    if driver_manager.driver:
-        driver_manager.driver.quit()
-        driver_manager.driver = None
+    session = session_var.get()
+    if session.driver:
+        session.driver.quit()
+        session.driver = None
         return "Browser closed successfully."
     return "Browser was not running."
 
@@ -470,12 +618,14 @@ def close_browser() -> str:
 class AgentState(TypedDict):
     messages: Annotated[List[BaseMessage], operator.add]
     context_events: Optional[List[dict]]
+    # XPaths recorded in context_events, derived once per context file rather than on every agent turn
+    context_xpaths: frozenset
 
 # --- UPDATED: Added new tools to the list ---
 tools = [
     start_browser, navigate_to_url, click_element, send_keys_to_element,
     press_key_on_element, verify_text_on_element, close_browser,
-    find_interactive_element, wait_for_seconds, scroll_page, select_dropdown_option,
+    find_interactive_element, find_interactive_elements_batch, wait_for_seconds, scroll_page, select_dropdown_option,
     maximize_window, wait_for_page_load, get_element_attribute
 ]
 
@@ -483,102 +633,127 @@ llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
 model_with_tools = llm.bind_tools(tools)
 
 # --- NEW: Helper function to determine and log the agent's strategy ---
-def _get_tool_call_strategy(tool_call: dict, context_xpaths: set) -> str:
-    """Determines the operational strategy based on the tool call and context."""
-    tool_name = tool_call.get('name')
-    tool_args = tool_call.get('args', {})
-
+def _search_strategy(tool_args: dict, context_xpaths: set) -> str:
     # Element discovery strategies
-    if tool_name == 'find_interactive_element':
-        return "Element Discovery (Scoped Search - Rule C)" if tool_args.get('container_xpath') else "Element Discovery (General Search - Rule D)"
+    return "Element Discovery (Scoped Search - Rule C)" if tool_args.get('container_xpath') else "Element Discovery (General Search - Rule D)"
 
+def _action_strategy(tool_args: dict, context_xpaths: set) -> str:
     # Direct action strategies based on selector source
-    action_tools = [
+    if tool_args.get('by') == 'xpath' and tool_args.get('value') in context_xpaths:
+        return "Direct Action (from Context - Rule B)"
+    # Any other direct action is assumed to be Rule A or a follow-up from a previous search
+    return "Direct Action (from Selector - Rule A/D)"
+
+def _fixed_strategy(strategy: str) -> Callable[[dict, set], str]:
+    return lambda tool_args, context_xpaths: strategy
+
+# tool name -> the function naming its strategy, built once at import instead of matched per call
+_STRATEGY_DISPATCH: Dict[str, Callable[[dict, set], str]] = {
+    'find_interactive_element': _search_strategy,
+    'find_interactive_elements_batch': _fixed_strategy("Element Discovery (Batch Search - Rule C/D)"),
+    **dict.fromkeys([
         'click_element', 'send_keys_to_element', 'verify_text_on_element',
         'get_element_attribute', 'select_dropdown_option', 'press_key_on_element'
-    ]
-    if tool_name in action_tools:
-        if tool_args.get('by') == 'xpath' and tool_args.get('value') in context_xpaths:
-            return "Direct Action (from Context - Rule B)"
-        # Any other direct action is assumed to be Rule A or a follow-up from a previous search
-        return "Direct Action (from Selector - Rule A/D)"
-
+    ], _action_strategy),
     # Browser control strategies
-    browser_control_tools = ['start_browser', 'maximize_window', 'close_browser', 'navigate_to_url']
-    if tool_name in browser_control_tools:
-        return f"Browser Control ({tool_name.replace('_', ' ').title()})"
-
+    **{
+        name: _fixed_strategy(f"Browser Control ({name.replace('_', ' ').title()})")
+        for name in ['start_browser', 'maximize_window', 'close_browser', 'navigate_to_url']
+    },
     # Synchronization strategies
-    sync_tools = ['wait_for_seconds', 'wait_for_page_load']
-    if tool_name in sync_tools:
-        return "Synchronization (Wait)"
-
+    **dict.fromkeys(['wait_for_seconds', 'wait_for_page_load'], _fixed_strategy("Synchronization (Wait)")),
     # Page interaction strategies
-    if tool_name == 'scroll_page':
-        return "Page Interaction (Scroll)"
+    'scroll_page': _fixed_strategy("Page Interaction (Scroll)"),
+}
 
-    return "Unknown/General Action"
+def _get_tool_call_strategy(tool_call: dict, context_xpaths: set) -> str:
+    """Determines the operational strategy based on the tool call and context."""
+    strategy = _STRATEGY_DISPATCH.get(tool_call.get('name'))
+    if strategy is None:
+        return "Unknown/General Action"
+    return strategy(tool_call.get('args', {}), context_xpaths)
 
 # --- REWRITTEN: agent_node with improved logging ---
-def agent_node(state: AgentState):
+LOG_SEPARATOR = "=" * 80
+
+async def agent_node(state: AgentState):
     """Invokes the LLM, determines the strategy for any tool calls, and logs the decision."""
-    response = model_with_tools.invoke(state["messages"])
+    response = await model_with_tools.ainvoke(state["messages"])
 
-    if tool_calls := response.tool_calls:
-        context_events = state.get("context_events", []) or []
-        # Robustly extract XPaths from context
-        context_xpaths = {
-            event['target']['xpath']
-            for event in context_events
-            if isinstance(event, dict) and 'target' in event and isinstance(event.get('target'), dict) and 'xpath' in event['target']
-        }
+    # Nothing is formatted (or even classified) unless INFO logging is on
+    if (tool_calls := response.tool_calls) and logger.isEnabledFor(logging.INFO):
+        context_xpaths = state.get("context_xpaths", frozenset())
 
-        logger.info("="*80)
+        logger.info(LOG_SEPARATOR)
         logger.info("LLM has decided on the next action(s):")
 
         for call in tool_calls:
             strategy = _get_tool_call_strategy(call, context_xpaths)
-            tool_name = call.get('name', 'N/A')
-            tool_args = call.get('args', {})
-
-            # Log with a more structured and readable format
-            logger.info(f"  - Tool Call: {tool_name}")
-            logger.info(f"    - Strategy: {strategy}")
-            # Pretty-print parameters for readability
-            logger.info(f"    - Parameters: {json.dumps(tool_args, indent=4)}")
-        logger.info("="*80)
+            logger.info("  - Tool Call: %s | Strategy: %s | Parameters: %s",
+                        call.get('name', 'N/A'), strategy, call.get('args', {}))
+        logger.info(LOG_SEPARATOR)
 
     return {"messages": [response]}
 
 
-# --- UPDATED: Added a 2-second delay after each tool call ---
-def tool_node(state: AgentState):
-    """Executes tools and adds a delay."""
-    tool_map = {t.name: t for t in tools}
+# Read-only tools only inspect the page, so consecutive calls to them run concurrently.
+# Every other tool changes the browser (or waits on it) and runs alone, in the order the agent issued it.
+READ_ONLY_TOOLS = {
+    "find_interactive_element", "find_interactive_elements_batch", "get_element_attribute", "verify_text_on_element",
+}
+tool_map = {t.name: t for t in tools}
+
+# Tools whose effects can keep changing the page after they return
+DOM_MUTATING_TOOLS = {
+    "navigate_to_url", "click_element", "send_keys_to_element", "press_key_on_element",
+    "select_dropdown_option", "scroll_page",
+}
+
+async def _run_tool(call) -> ToolMessage:
+    """Executes a single tool call in a worker thread, then lets the page settle if the call changed it."""
+    tool_name = call['name']
+    tool_args = call['args']
+    
+    logger.info("EXECUTING tool '%s' with args: %s", tool_name, tool_args)
+    
+    tool_to_call = tool_map.get(tool_name)
+    if not tool_to_call:
+        error_message = f"Error: Tool '{tool_name}' not found."
+        logger.error(error_message)
+        return ToolMessage(content=error_message, tool_call_id=call["id"])
+
+    # Selenium calls block, so tools run in a worker thread and the event loop stays free
+    output = str(await asyncio.to_thread(tool_to_call.invoke, tool_args))
+    log_output = (output[:1500] + '...') if len(output) > 1500 else output
+    
+    logger.info("COMPLETED tool '%s'. Output: %s", tool_name, log_output)
+
+    # Instead of a fixed pause, wait only as long as the page keeps mutating (at most 2 seconds)
+    if tool_name in DOM_MUTATING_TOOLS and "error" not in output.lower():
+        await asyncio.to_thread(wait_for_dom_quiet, session_var.get().driver)
+    return ToolMessage(content=output, tool_call_id=call["id"])
+
+async def tool_node(state: AgentState):
+    """Executes tools, running consecutive read-only calls concurrently."""
     tool_calls = state["messages"][-1].tool_calls
     tool_messages = []
-    for call in tool_calls:
-        tool_name = call['name']
-        tool_args = call['args']
-        
-        logger.info(f"EXECUTING tool '{tool_name}' with args: {tool_args}")
-        
-        tool_to_call = tool_map.get(tool_name)
-        if tool_to_call:
-            output = tool_to_call.invoke(tool_args)
-            log_output = (str(output)[:1500] + '...') if len(str(output)) > 1500 else str(output)
-            
-            logger.info(f"COMPLETED tool '{tool_name}'. Output: {log_output}")
-            tool_messages.append(ToolMessage(content=str(output), tool_call_id=call["id"]))
-
-            # Add a 2-second pause after each successful tool execution
-            if "error" not in str(output).lower():
-                logger.info("PAUSING for 2 seconds after tool execution.")
-                time.sleep(2)
+    for read_only, calls in itertools.groupby(tool_calls, key=lambda call: call['name'] in READ_ONLY_TOOLS):
+        calls = list(calls)
+        if read_only:
+            # gather keeps the call order
+            outputs = await asyncio.gather(*(_run_tool(call) for call in calls), return_exceptions=True)
         else:
-            error_message = f"Error: Tool '{tool_name}' not found."
-            logger.error(error_message)
-            tool_messages.append(ToolMessage(content=error_message, tool_call_id=call["id"]))
+            outputs = []
+            for call in calls:
+                try:
+                    outputs.append(await _run_tool(call))
+                except Exception as e:
+                    outputs.append(e)
+        for call, output in zip(calls, outputs):
+            if isinstance(output, BaseException):
+                logger.error("FAILED tool '%s': %s", call['name'], output)
+                output = ToolMessage(content=f"Error running tool '{call['name']}': {output}", tool_call_id=call["id"])
+            tool_messages.append(output)
             
     return {"messages": tool_messages}
 
@@ -596,77 +771,110 @@ workflow.add_edge("tools", "agent")
 app_graph = workflow.compile()
 
 # --- 5. FastAPI Endpoint ---
+# --- UPDATED: Enhanced system prompt with instructions for new tools ---
+SYSTEM_PROMPT_TEMPLATE = """
+You are an expert web automation assistant. Your goal is to perform tasks in a web browser with precision and reliability.
+
+**Your Workflow and Rules:**
+1.  **Initial Setup & Navigation:**
+    - Your first step is ALWAYS `start_browser`.
+    - Your second step is ALWAYS `maximize_window`.
+    - After calling `navigate_to_url` or any `click_element` that causes a new page to load, you SHOULD immediately call `wait_for_page_load` to ensure the page is fully ready for the next action.
+
+2.  **Find Elements with Precision (Strict Priority Order):**
+    - **Rule A (Direct Selector):** If the user provides a full, direct XPath/CSS selector, use it immediately with tools like `click_element`.
+    - **Rule B (Contextual Search from Description):** If a "Context from Chrome Extension" is provided, your primary strategy is to find the most relevant past event. Read through the list of JSON objects. For each object, compare your current task to its `element_description`. Find the object with the description that semantically matches your goal the best. Once you find the closest match, you MUST take the `xpath` from its `target` and use that for your next action (e.g., `click_element(by='xpath', value='...')`).
+    - **Rule C (Scoped Search):** If the user asks to find an element *inside* another, use the `find_interactive_element` tool with both `element_query` and `container_xpath`.
+    - **Rule D (General Search):** If the above methods don't apply, use `find_interactive_element` with only the `element_query` to find the element on the page.
+    - **Several Elements:** When you need to find more than one element on the same page, use a single `find_interactive_elements_batch` call with one entry per element instead of several `find_interactive_element` calls.
+
+3.  **Action & Verification Logic:**
+    - When using `find_interactive_element`, you MUST use the `selector` of the element with the highest `score` for your next action.
+    - **Chaining Actions:** If you use `verify_text_on_element` and it succeeds, you MUST use the `locator` from its JSON response for the immediately following action (e.g., `click_element`).
+
+4.  **Data Extraction:**
+    - If you need to get data that is not visible text (e.g., a link URL), use the `get_element_attribute` tool. For example, to get a link, pass `attribute='href'` to the tool.
+
+5.  **Error Recovery:**
+    - If a tool call returns an error (e.g., "Error clicking element"), DO NOT retry the exact same call. Immediately switch to **Rule D (General Search)** to find a better selector for the element.
+
+6.  **Completion:**
+    - Once all tasks are done, you MUST call `close_browser` to finish.
+"""
+CONTEXT_PROMPT_TEMPLATE = (
+    "\n\n--- Context from Chrome Extension ---\n"
+    "Here is a list of recorded events. Use the 'xpath' or 'css' from these events if they match the user's query.\n"
+    "{context_json}\n"
+    "-------------------------------------\n"
+)
+
+# The system prompt with no context file is the same for every request, so it is built once
+BASE_SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT_TEMPLATE)
+
+# filename -> (mtime, parsed events, their XPaths, system message with the events embedded);
+# a context file is only re-read and its prompt only rebuilt after it changes
+_CONTEXT_CACHE = {}
+
+def _load_context_file(filename: str):
+    """
+    Returns the parsed events of a context file, the set of XPaths they record (used by agent_node to
+    tell Rule B actions apart) and the system message embedding the events.
+    """
+    mtime = os.stat(filename).st_mtime
+    cached = _CONTEXT_CACHE.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(filename, 'rb') as f:
+            events = orjson.loads(f.read())
+        # Robustly extract XPaths from context
+        xpaths = frozenset(
+            event['target']['xpath']
+            for event in events
+            if isinstance(event, dict) and 'target' in event and isinstance(event.get('target'), dict) and 'xpath' in event['target']
+        ) if isinstance(events, list) else frozenset()
+        events_json = orjson.dumps(events, option=orjson.OPT_INDENT_2).decode()
+        system_message = SystemMessage(
+            content=SYSTEM_PROMPT_TEMPLATE + CONTEXT_PROMPT_TEMPLATE.format(context_json=events_json)
+        ) if events else BASE_SYSTEM_MESSAGE
+        cached = _CONTEXT_CACHE[filename] = (mtime, events, xpaths, system_message)
+    return cached[1:]
+
 @app.post("/automate")
 async def automate(request: AutomationRequest):
     if not request.query:
         raise HTTPException(status_code=400, detail="Query is required")
 
     context_events_data = ""
+    context_xpaths = frozenset()
+    system_message = BASE_SYSTEM_MESSAGE
     if request.context_filename:
         try:
             if ".." in request.context_filename or request.context_filename.startswith("/"):
                 raise HTTPException(status_code=400, detail="Invalid filename.")
             
-            with open(request.context_filename, 'r') as f:
-                context_events_data = json.load(f)
+            context_events_data, context_xpaths, system_message = await asyncio.to_thread(
+                _load_context_file, request.context_filename
+            )
         except FileNotFoundError:
             raise HTTPException(status_code=404, detail=f"Context file not found: {request.context_filename}")
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             raise HTTPException(status_code=400, detail=f"Error decoding JSON from file: {request.context_filename}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"An error occurred while reading the context file: {str(e)}")
 
-    # --- UPDATED: Enhanced system prompt with instructions for new tools ---
-    system_prompt_template = """
-    You are an expert web automation assistant. Your goal is to perform tasks in a web browser with precision and reliability.
-
-    **Your Workflow and Rules:**
-    1.  **Initial Setup & Navigation:**
-        - Your first step is ALWAYS `start_browser`.
-        - Your second step is ALWAYS `maximize_window`.
-        - After calling `navigate_to_url` or any `click_element` that causes a new page to load, you SHOULD immediately call `wait_for_page_load` to ensure the page is fully ready for the next action.
-
-    2.  **Find Elements with Precision (Strict Priority Order):**
-        - **Rule A (Direct Selector):** If the user provides a full, direct XPath/CSS selector, use it immediately with tools like `click_element`.
-        - **Rule B (Contextual Search from Description):** If a "Context from Chrome Extension" is provided, your primary strategy is to find the most relevant past event. Read through the list of JSON objects. For each object, compare your current task to its `element_description`. Find the object with the description that semantically matches your goal the best. Once you find the closest match, you MUST take the `xpath` from its `target` and use that for your next action (e.g., `click_element(by='xpath', value='...')`).
-        - **Rule C (Scoped Search):** If the user asks to find an element *inside* another, use the `find_interactive_element` tool with both `element_query` and `container_xpath`.
-        - **Rule D (General Search):** If the above methods don't apply, use `find_interactive_element` with only the `element_query` to find the element on the page.
-
-    3.  **Action & Verification Logic:**
-        - When using `find_interactive_element`, you MUST use the `selector` of the element with the highest `score` for your next action.
-        - **Chaining Actions:** If you use `verify_text_on_element` and it succeeds, you MUST use the `locator` from its JSON response for the immediately following action (e.g., `click_element`).
-
-    4.  **Data Extraction:**
-        - If you need to get data that is not visible text (e.g., a link URL), use the `get_element_attribute` tool. For example, to get a link, pass `attribute='href'` to the tool.
-
-    5.  **Error Recovery:**
-        - If a tool call returns an error (e.g., "Error clicking element"), DO NOT retry the exact same call. Immediately switch to **Rule D (General Search)** to find a better selector for the element.
-
-    6.  **Completion:**
-        - Once all tasks are done, you MUST call `close_browser` to finish.
-    """
-
-    context_str = ""
-    if context_events_data:
-        context_str = (
-            "\n\n--- Context from Chrome Extension ---\n"
-            "Here is a list of recorded events. Use the 'xpath' or 'css' from these events if they match the user's query.\n"
-            f"{json.dumps(context_events_data, indent=2)}\n"
-            "-------------------------------------\n"
-        )
-
-    final_system_prompt = system_prompt_template + context_str
-    
     initial_messages = [
-        SystemMessage(content=final_system_prompt),
+        system_message,
         HumanMessage(content=request.query)
     ]
 
+    # This request's browser; tools reach it through session_var, and only it is quit below
+    session = WebDriverManager()
+    session_var.set(session)
     try:
         config = {"recursion_limit": 100}
         initial_state = {
             "messages": initial_messages,
-            "context_events": context_events_data
+            "context_events": context_events_data,
+            "context_xpaths": context_xpaths,
         }
         await app_graph.ainvoke(initial_state, config=config)
         return {"message": "Automation task processed successfully."}
@@ -674,6 +882,7 @@ async def automate(request: AutomationRequest):
         logger.error(f"ERROR in automation graph: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
     finally:
-        if driver_manager.driver:
-            driver_manager.driver.quit()
-            driver_manager.driver = None
+        if session.driver:
+            # Quitting Chrome takes a while; other requests keep being served meanwhile
+            await asyncio.to_thread(session.driver.quit)
+            session.driver = None
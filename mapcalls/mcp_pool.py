@@ -0,0 +1,163 @@
+import copy
+import json
+import time
+import asyncio
+import functools
+import contextlib
+
+from mcp_use import MCPClient
+
+# --- Shared MCP client pool ---
+# Clients with their server sessions already open are reused across agent runs instead of
+# spawning the MCP servers (and launching their browser) for every run.
+MIN_POOL_SIZE = 1
+MAX_POOL_SIZE = 4
+IDLE_TIMEOUT = 300
+
+# Tool calls made on every session of a client when it is returned, in order, so the next run starts
+# without the previous run's cookies, web storage or page. They reset the page instead of calling
+# browser_close, which would make the server relaunch its browser on the next run. A step is skipped on
+# servers that do not offer its tool.
+# Page script can only reach the origin still loaded, and not its HttpOnly cookies, so this is a best
+# effort for the site a run ended on rather than a fresh browser context.
+CLEAR_STATE_JS = """() => {
+    try { localStorage.clear(); sessionStorage.clear(); } catch (e) {}
+    for (const cookie of document.cookie.split(";")) {
+        const name = cookie.split("=")[0].trim();
+        if (name) document.cookie = `${name}=; expires=Thu, 01 Jan 1970 00:00:00 GMT; path=/`;
+    }
+}"""
+RESET_STEPS = [
+    ("browser_evaluate", {"function": CLEAR_STATE_JS}),
+    ("browser_navigate", {"url": "about:blank"}),
+]
+
+@functools.lru_cache(maxsize=None)
+def load_config(config_path: str) -> dict:
+    """Reads an MCP config file once per process; call load_config.cache_clear() after editing it."""
+    with open(config_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class MCPClientPool:
+    """
+    A pool of initialized MCPClients for one config; each agent run checks one out for its whole run.
+    Grows on demand up to max_size, and on checkout closes clients idle for longer than idle_timeout
+    seconds down to min_size, keeping at least one to serve the checkout. Use it as
+    `async with MCPClientPool(...) as pool:` so every server it started is shut down however the block exits.
+    """
+    def __init__(self, config_path: str, min_size: int = MIN_POOL_SIZE, max_size: int = MAX_POOL_SIZE,
+                 idle_timeout: float = IDLE_TIMEOUT):
+        self.config_path = config_path
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # (client, time it was returned) for every idle client
+        self._idle: asyncio.Queue = asyncio.Queue()
+        # Every open client, idle or checked out
+        self._clients = set()
+        self._size = 0
+        self._active = 0
+        self._created = 0
+        self._replaced = 0
+
+    async def _create(self) -> MCPClient:
+        self._size += 1
+        try:
+            # Each client gets its own copy, since MCPClient keeps (and may change) the dict it is given
+            client = MCPClient.from_dict(copy.deepcopy(load_config(self.config_path)))
+            await client.create_all_sessions()
+        except BaseException:
+            self._size -= 1
+            raise
+        self._created += 1
+        self._clients.add(client)
+        return client
+
+    async def _discard(self, client: MCPClient):
+        self._size -= 1
+        self._clients.discard(client)
+        try:
+            await client.close_all_sessions()
+        except Exception as e:
+            print(f"Failed to close pooled MCP client: {e}")
+
+    @staticmethod
+    def _healthy(client: MCPClient) -> bool:
+        sessions = client.get_all_active_sessions()
+        return bool(sessions) and all(getattr(session, "is_connected", True) for session in sessions.values())
+
+    async def start(self):
+        """Opens min_size clients up front, so the first run does not pay the server start-up."""
+        clients = await asyncio.gather(*(self._create() for _ in range(self.min_size)))
+        for client in clients:
+            self._idle.put_nowait((client, time.monotonic()))
+        print(f"✅ MCP client pool ready with {self.min_size} clients.")
+
+    async def close(self):
+        """Closes every client and the servers it started, including clients a crashed run never returned."""
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        for client in list(self._clients):
+            await self._discard(client)
+
+    async def __aenter__(self) -> "MCPClientPool":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _checkout(self) -> MCPClient:
+        while True:
+            if self._idle.empty() and self._size < self.max_size:
+                return await self._create()
+            client, released_at = await self._idle.get()
+            if not self._healthy(client):
+                # The server died while the client was idle; replace it with a fresh one
+                self._replaced += 1
+                await self._discard(client)
+                continue
+            # An expired client is only closed while another idle one can take the run, so shrinking
+            # the pool never makes this checkout wait for a cold server start
+            if (time.monotonic() - released_at > self.idle_timeout and self._size > self.min_size
+                    and not self._idle.empty()):
+                await self._discard(client)
+                continue
+            return client
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """Checks a client out of the pool, waiting while max_size of them are busy, and returns it afterwards."""
+        client = await self._checkout()
+        self._active += 1
+        try:
+            yield client
+        finally:
+            self._active -= 1
+            await self._release(client)
+
+    async def _release(self, client: MCPClient):
+        # A client that fails to reset (e.g. its server crashed mid-run) is closed instead of returned
+        try:
+            for session in client.get_all_active_sessions().values():
+                tool_names = {tool.name for tool in getattr(session.connector, "tools", None) or []}
+                for tool_name, arguments in RESET_STEPS:
+                    if tool_name in tool_names:
+                        await session.call_tool(tool_name, arguments)
+        except Exception as e:
+            print(f"Failed to reset pooled MCP client, closing it: {e}")
+            self._replaced += 1
+            await self._discard(client)
+            return
+        await self._idle.put((client, time.monotonic()))
+
+    def stats(self) -> dict:
+        """Pool metrics: open clients, how many are checked out or idle, and how many were created or replaced."""
+        return {
+            "size": self._size,
+            "active": self._active,
+            "idle": self._idle.qsize(),
+            "created": self._created,
+            "replaced": self._replaced,
+        }
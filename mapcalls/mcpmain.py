@@ -1,45 +1,392 @@
 import asyncio
+import hashlib
+import inspect
+import itertools
+import json
 import os
+import sys
+import openai
 from dotenv import load_dotenv
+from langchain_community.cache import SQLiteCache
+from langchain_core.globals import set_llm_cache
+from langchain_core.tools import BaseTool
 from langchain_openai import ChatOpenAI
-from mcp_use import MCPAgent, MCPClient
-
-async def main():
-    load_dotenv()
-    
-    # Initialize the client and the language model
-    client = MCPClient.from_config_file("E:/projects/playwright2/browser_mcp.json")
-    llm = ChatOpenAI(model="gpt-4o-mini")
-    
-    # Construct the agent
-    agent = MCPAgent(llm=llm, client=client, max_steps=30)
+from mcp_use import MCPAgent
+
+from mcp_pool import MCPClientPool
+
+# Loaded once at import, before any of the settings below are read from the environment
+load_dotenv()
+
+CONFIG_PATH = os.getenv("MCP_CONFIG", "E:/projects/playwright2/browser_mcp.json")
+
+# Latency-optimized processing for every completion; endpoints that reject the parameter get the default tier.
+# Set OPENAI_SERVICE_TIER to an empty string to never send it.
+SERVICE_TIER = os.getenv("OPENAI_SERVICE_TIER", "priority")
+MODEL_KWARGS = {"service_tier": SERVICE_TIER} if SERVICE_TIER else {}
+
+# Tool schemas from the last run, per MCP config, so planning can start before the MCP servers are up
+TOOL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mcpmain")
+
+# Screen query run when none is given on the command line
+SCREEN_QUERY = "Market Capitalization /  Average Earnings 10Year < 15 AND Average dividend payout 3years > 20 AND Debt to equity < .2 AND Average return on capital employed 7Years > 30"
+
+# The task as (action, target, value) operations, planned into tool calls with a single model call.
+# Targets are short CSS selectors anchored on ids, tags and link URLs rather than absolute XPaths: the browser
+# resolves them through its selector engine, and they survive unrelated changes higher up in the page.
+BROWSER_STEPS = [
+    ("navigate", "https://www.screener.in/explore/", None),
+    ("verify_text", "main h1", "Stock screens"),
+    ("click", "main a[href*='low-on-10-year-average-earnings']", None),
+    ("verify_text", "#screen-info > h1", "Low on 10 year average earnings"),
+    ("input", "#query-builder", SCREEN_QUERY),
+    ("click", "form:has(#query-builder) button", None),
+]
+
+def screen_steps(query: str) -> list:
+    """BROWSER_STEPS with `query` typed into the query builder instead of SCREEN_QUERY."""
+    return [(action, target, query if action == "input" else value) for action, target, value in BROWSER_STEPS]
+
+# Operations that only read the page; consecutive runs of them are executed concurrently
+READ_ONLY_ACTIONS = {"verify_text"}
+
+# The agent loop's turns are mostly picking the next tool, which a smaller, faster model does well.
+# The reasoning model plans the task in one call, and takes over the loop when the router model does not finish.
+ROUTER_MODEL = os.getenv("ROUTER_MODEL", "gpt-4.1-nano")
+REASONING_MODEL = os.getenv("REASONING_MODEL", "gpt-4o-mini")
+
+# The agent loop gets enough steps for a tool call plus one page lookup per operation, not a fixed 30
+MAX_STEPS = 2 * len(BROWSER_STEPS) + 2
+
+# The agent is told to end with this once the last operation succeeded, so it stops instead of confirming
+DONE_MARKER = "<<DONE>>"
+AGENT_INSTRUCTIONS = (
+    "Execute each step of the JSON plan in the user message with the browser tools, in order. "
+    f"As soon as the tool call for the last step has succeeded, reply with {DONE_MARKER} and a one-line summary. "
+    "Do not call further tools to re-check steps that already succeeded."
+)
+
+# The same task for the agent loop when the planned run fails, as compact JSON rather than English prose:
+# every agent step resends the prompt, so its size is paid once per step
+# action -> (op, key of the target, key of the value); a None target key means a selector
+COMPACT_OPS = {
+    "navigate": ("goto", "url", None),
+    "verify_text": ("assert_text", None, "expected"),
+    "click": ("click", None, None),
+    "input": ("fill", None, "text"),
+}
+
+def compact_task(steps: list) -> str:
+    """Encodes the operations as minified JSON."""
+    ops = []
+    for action, target, value in steps:
+        op, target_key, value_key = COMPACT_OPS[action]
+        if target_key is None:
+            target_key = "xpath" if target.startswith(("/", "(")) else "css"
+        entry = {"op": op, target_key: target}
+        if value_key:
+            entry[value_key] = value
+        ops.append(entry)
+    return json.dumps({"steps": ops}, separators=(",", ":"))
+
+PLAN_PROMPT_TEMPLATE = """Given these {count} browser operations and the available tools, output the tool-call plan as JSON.
+Reply with a JSON object {{"plan": [...]}} holding one {{"step": <operation index>, "tool": <tool name>, "args": {{...}}}} entry per tool call, in order.
+The targets are CSS selectors (or XPaths when they start with /), so locate them with a page script rather than from a page snapshot.
+For a verify_text operation, also set "expect" to the text the tool output must contain.
+
+Tools:
+{tools}
+
+Operations (index: action, target, value):
+{steps}"""
+
+class TieredChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI that requests the `service_tier` set in model_kwargs, and drops it for the rest of the
+    process the first time the endpoint rejects it (e.g. an OpenAI-compatible server that does not know it).
+    """
+    def _drop_rejected_tier(self, error: openai.BadRequestError) -> bool:
+        if "service_tier" not in str(error):
+            return False
+        # A concurrent call may have dropped the tier already; this call was still sent with it, so it retries too
+        tier = self.model_kwargs.pop("service_tier", None)
+        if tier is not None:
+            print(f"Endpoint rejected service_tier={tier!r}, using the default tier.")
+        return True
+
+    async def _agenerate(self, *args, **kwargs):
+        try:
+            return await super()._agenerate(*args, **kwargs)
+        except openai.BadRequestError as e:
+            if not self._drop_rejected_tier(e):
+                raise
+        return await super()._agenerate(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        started = False
+        try:
+            async for chunk in super()._astream(*args, **kwargs):
+                started = True
+                yield chunk
+            return
+        except openai.BadRequestError as e:
+            # The request is rejected before the first chunk; a failure mid-stream is not retried
+            if started or not self._drop_rejected_tier(e):
+                raise
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+
+def tool_spec(tool: BaseTool) -> dict:
+    """The parts of a tool the planner needs, in a JSON-serializable form."""
+    return json.loads(json.dumps({"name": tool.name, "description": tool.description, "args": tool.args}))
+
+def _tool_cache_file(config_path: str) -> str:
+    return os.path.join(TOOL_CACHE_DIR, hashlib.sha256(os.path.abspath(config_path).encode()).hexdigest() + ".json")
+
+def _config_digest(config_path: str) -> str:
+    with open(config_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def load_tool_specs(config_path: str):
+    """Returns the tool specs saved for this config, or None if there are none or the config has changed since."""
+    try:
+        with open(_tool_cache_file(config_path), encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["config"] == _config_digest(config_path):
+            return cached["tools"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def save_tool_specs(config_path: str, specs: list):
+    try:
+        os.makedirs(TOOL_CACHE_DIR, exist_ok=True)
+        with open(_tool_cache_file(config_path), "w", encoding="utf-8") as f:
+            json.dump({"config": _config_digest(config_path), "tools": specs}, f)
+    except OSError:
+        pass  # Without a writable cache the next run simply plans after the servers are up
+
+async def plan_tool_calls(llm: ChatOpenAI, tool_specs: list, steps: list) -> list:
+    """Asks the model once for the tool calls that carry out every step, instead of one model call per step."""
+    prompt = PLAN_PROMPT_TEMPLATE.format(
+        count=len(steps),
+        tools="\n".join(f"- {t['name']}: {t['description']} Args: {json.dumps(t['args'])}" for t in tool_specs),
+        steps="\n".join(f"{index}: {json.dumps(step)}" for index, step in enumerate(steps)),
+    )
+    response = await llm.bind(response_format={"type": "json_object"}).ainvoke(prompt)
+    return json.loads(response.content)["plan"]
+
+def _is_async_tool(tool: BaseTool) -> bool:
+    """Tells whether the tool has a native coroutine, rather than only a blocking implementation."""
+    if hasattr(tool, "coroutine"):
+        # Function-backed tools (StructuredTool, Tool) may carry either kind of callable
+        return tool.coroutine is not None or inspect.iscoroutinefunction(tool.func)
+    return type(tool)._arun is not BaseTool._arun
+
+async def _run_call(tools_by_name: dict, call: dict) -> str:
+    """Runs one planned tool call and checks its output for the expected text."""
+    tool = tools_by_name.get(call["tool"])
+    if tool is None:
+        raise RuntimeError(f"Plan calls unknown tool '{call['tool']}'")
+    args = call.get("args", {})
+    if _is_async_tool(tool):
+        output = str(await tool.ainvoke(args))
+    else:
+        # A blocking tool runs in a worker thread so concurrent read-only calls are not serialized on the loop
+        output = str(await asyncio.to_thread(tool.invoke, args))
+    print(f"---TOOL: Output of {call['tool']}: {output}---")
+    expected = call.get("expect")
+    if expected and expected.lower() not in output.lower():
+        raise RuntimeError(f"Expected '{expected}' in the output of {call['tool']}")
+    return output
+
+async def run_plan(tools_by_name: dict, plan: list, steps: list) -> list:
+    """
+    Runs the planned tool calls straight through the MCP tools without going back to the model.
+    Calls that change the page run one at a time in plan order; consecutive read-only calls run concurrently.
+
+    Raises:
+        RuntimeError: If a call names an unknown tool or its output lacks the expected text.
+    """
+    def is_read_only(call: dict) -> bool:
+        step = call.get("step")
+        return isinstance(step, int) and 0 <= step < len(steps) and steps[step][0] in READ_ONLY_ACTIONS
+
+    outputs = []
+    for read_only, group in itertools.groupby(plan, key=is_read_only):
+        if read_only:
+            outputs.extend(await asyncio.gather(*(_run_call(tools_by_name, call) for call in group)))
+        else:
+            for call in group:
+                outputs.append(await _run_call(tools_by_name, call))
+    return outputs
+
+async def stream_agent(agent: MCPAgent, prompt: str, max_steps: int) -> str:
+    """
+    Runs the agent on `prompt`, writing the model's tokens to stdout as they are generated,
+    and returns the text of its final response. Stops as soon as the model reports DONE_MARKER,
+    even if it was about to call another tool to double-check.
+    """
+    result = ""
+    streamed = False
+    events = agent.stream_events(prompt, max_steps=max_steps)
+    try:
+        async for event in events:
+            if event["event"] == "on_chat_model_start":
+                streamed = False
+            elif event["event"] == "on_chat_model_stream":
+                token = event["data"]["chunk"].content
+                if token:
+                    sys.stdout.write(token)
+                    sys.stdout.flush()
+                    streamed = True
+            elif event["event"] == "on_chat_model_end":
+                result = event["data"]["output"].content
+                if streamed:
+                    sys.stdout.write("\n")
+                if DONE_MARKER in result:
+                    break
+    finally:
+        # Closing the stream cancels whatever model or tool call the agent had started next
+        await events.aclose()
+    # A response replayed from the LLM cache arrives whole, without token events
+    if result and not streamed:
+        print(result)
+    return result
+
+async def run_agent(agent: MCPAgent, prompt: str):
+    """
+    Runs the agent's tool-calling loop on `prompt`, streaming its output when mcp_use supports it.
+    Returns the final response and whether the agent reported the task done.
+    """
+    if hasattr(agent, "stream_events"):
+        result = await stream_agent(agent, prompt, max_steps=agent.max_steps)
+    else:
+        # mcp_use releases without stream_events only offer the blocking run()
+        result = await agent.run(prompt, max_steps=agent.max_steps)
+    return result.replace(DONE_MARKER, "").strip(), DONE_MARKER in result
+
+# Tool set -> the agent system prompt rendered for it. mcp_use renders the prompt, with every tool
+# description, in initialize(); later agents on the same tools are handed the finished string instead.
+_SYSTEM_PROMPTS = {}
+
+def _tool_set_key(tool_specs) -> tuple:
+    # The system prompt lists only tool names and descriptions
+    return tuple((spec["name"], spec["description"]) for spec in tool_specs or ())
+
+async def start_agent(llm: ChatOpenAI, client, tool_specs=None):
+    """
+    Builds and initializes an agent on the pooled client, reusing the system prompt already rendered for
+    `tool_specs` when there is one. Returns the agent, its tools by name and their specs.
+    """
+    key = _tool_set_key(tool_specs)
+    agent = MCPAgent(llm=llm, client=client, max_steps=MAX_STEPS, additional_instructions=AGENT_INSTRUCTIONS,
+                     system_prompt=_SYSTEM_PROMPTS.get(key))
 
     # You must initialize the agent first to load the tools
     await agent.initialize()
+    # Access the internal '_tools' attribute instead of 'tools', once; everything below looks tools up by name
+    tools_by_name = {tool.name: tool for tool in agent._tools}
+    live_specs = [tool_spec(tool) for tool in tools_by_name.values()]
+    live_key = _tool_set_key(live_specs)
+    if key in _SYSTEM_PROMPTS and live_key != key:
+        # The reused prompt describes other tools than the servers offer; let mcp_use render the right one
+        return await start_agent(llm, client)
+    system_message = agent.get_system_message()
+    if system_message is not None:
+        _SYSTEM_PROMPTS.setdefault(live_key, system_message.content)
+    return agent, tools_by_name, live_specs
 
-    # --- Code to Print Available Tools (Corrected) ---
-    print("--- Available Tools ---")
-    # Access the internal '_tools' attribute instead of 'tools'
-    if agent._tools:
-        for tool in agent._tools:
-            print(f"Tool Name: {tool.name}")
-            print(f"Description: {tool.description}")
-            # You can also print the arguments the tool accepts
-            # print(f"Arguments: {tool.args}") 
-            print("-" * 25)
-    else:
-        print("No tools were found for the connected client.")
-    print("-----------------------\n")
-    # --- End of Corrected Code ---
+async def run_one(steps: list, llm: ChatOpenAI, router_llm: ChatOpenAI, pool: MCPClientPool,
+                  planning, cached_specs, show_tools: bool = False) -> str:
+    """
+    Runs one task on a client checked out of the pool. `planning` is the task's plan, already being made from
+    `cached_specs`, or None. Each task gets its own agent: agents keep per-run state, the models do not.
+    """
+    async with pool.acquire() as client:
+        # Construct the agent on the pooled client; its sessions are already open
+        agent, tools_by_name, tool_specs = await start_agent(router_llm, client, cached_specs)
+        if tool_specs != cached_specs:
+            # The servers now offer different tools, so a plan made from the cached ones cannot be trusted
+            if planning:
+                planning.cancel()
+                planning = None
+            save_tool_specs(CONFIG_PATH, tool_specs)
+
+        if show_tools:
+            # --- Code to Print Available Tools (Corrected) ---
+            # You can also list the arguments each tool accepts with {tool.args}
+            separator = "-" * 25
+            listing = "\n".join(
+                f"Tool Name: {tool.name}\nDescription: {tool.description}\n{separator}" for tool in tools_by_name.values()
+            ) or "No tools were found for the connected client."
+            # One write for the whole listing instead of several prints per tool
+            sys.stdout.write(f"--- Available Tools ---\n{listing}\n-----------------------\n\n")
+            # --- End of Corrected Code ---
+
+        # Plan every step in one model call and run the plan directly
+        print(">>> Running the planned browser steps...")
+        try:
+            plan = await (planning or plan_tool_calls(llm, tool_specs, steps))
+            outputs = await run_plan(tools_by_name, plan, steps)
+            return f"Completed {len(steps)} browser steps with {len(outputs)} tool calls from one planning call."
+        except Exception as e:
+            print(f"Planned run failed ({e}), falling back to the agent loop.")
+
+        # Run the agent on the compact task, streaming its output as it is generated
+        prompt = compact_task(steps)
+        print(f">>> Running agent ({ROUTER_MODEL}) with the compact task...")
+        try:
+            result, done = await run_agent(agent, prompt)
+        except Exception as e:
+            print(f"Agent run failed ({e}).")
+            done = False
+        if not done:
+            print(f">>> {ROUTER_MODEL} did not finish the task, rerunning it with {REASONING_MODEL}...")
+            agent, _, _ = await start_agent(llm, client, tool_specs)
+            result, done = await run_agent(agent, prompt)
+        return result
+
+async def main(queries: list):
+    # Cache model responses on disk so rerunning the same prompt replays them instead of calling OpenAI again
+    set_llm_cache(SQLiteCache(database_path=os.getenv("LLM_CACHE_PATH", ".langchain.db")))
+
+    # The language models, shared by every task
+    llm = TieredChatOpenAI(model=REASONING_MODEL, streaming=True, model_kwargs=dict(MODEL_KWARGS))
+    router_llm = TieredChatOpenAI(model=ROUTER_MODEL, streaming=True, model_kwargs=dict(MODEL_KWARGS))
+    tasks = [screen_steps(query) for query in queries]
+
+    # With the tool schemas of the last run, the planning calls overlap starting the MCP servers
+    cached_specs = load_tool_specs(CONFIG_PATH)
+    plannings = [
+        asyncio.create_task(plan_tool_calls(llm, cached_specs, steps)) if cached_specs else None for steps in tasks
+    ]
+
+    try:
+        # MCP clients whose servers stay up between agent runs; at most max_size tasks run at once, the rest
+        # wait for a free client. Leaving the block closes the clients and the MCP servers (and their browser)
+        # they started, also when a task crashes or the run is interrupted
+        async with MCPClientPool(CONFIG_PATH, min_size=1, max_size=4, idle_timeout=300) as pool:
+            # The tasks spend most of their time waiting on OpenAI and the browser, so they run concurrently
+            results = await asyncio.gather(
+                *(run_one(steps, llm, router_llm, pool, planning, cached_specs, show_tools=index == 0)
+                  for index, (steps, planning) in enumerate(zip(tasks, plannings))),
+                return_exceptions=True,
+            )
+    finally:
+        # Planning calls of tasks that never got to use them
+        for planning in plannings:
+            if planning:
+                planning.cancel()
 
-    # Now, run the agent with your prompt as before
-    print(">>> Running agent with the original prompt...")
-    result = await agent.run("Open chrome and navigate to 'https://www.screener.in/explore/'. verify text on 'Stock screens' at xpath '/html/body/div/div[2]/main/div[1]/h1'. Then click on xpath '/html/body/div/div[2]/main/div[2]/div/a[1]/div'. verift text 'Low on 10 year average earnings' at xpath '#screen-info > h1'. then input 'Market Capitalization /  Average Earnings 10Year < 15 AND Average dividend payout 3years > 20 AND Debt to equity < .2 AND Average return on capital employed 7Years > 30' into this element xpath is '//*[@id='query-builder']h1'. then click on button xpath is '/html/body/main/div[2]/form/div[3]/button[1]'.", max_steps=30)
-    
-    print("\n--- Agent Result ---")
-    print(result)
-    print("--------------------")
+    for query, result in zip(queries, results):
+        print("\n--- Agent Result ---")
+        print(f"Screen: {query}")
+        print(f"Error: {result}" if isinstance(result, BaseException) else result)
+        print("--------------------")
+    print(f"MCP client pool: {pool.stats()}")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # Each command-line argument is a screen query; all of them run concurrently
+    asyncio.run(main(sys.argv[1:] or [SCREEN_QUERY]))
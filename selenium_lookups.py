@@ -0,0 +1,36 @@
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+
+# --- Locator and key lookups ---
+# Every accepted alias maps straight to its By constant, built once at import instead of per call.
+# Shared by the automators, so a strategy or key name accepted by one is accepted by all of them.
+BY_MAP = {
+    'id': By.ID,
+    'name': By.NAME,
+    'css': By.CSS_SELECTOR,
+    'css_selector': By.CSS_SELECTOR,
+    'css selector': By.CSS_SELECTOR,
+    'xpath': By.XPATH,
+    'fullxpath': By.XPATH,
+    'tag': By.TAG_NAME,
+    'tag_name': By.TAG_NAME,
+    'class': By.CLASS_NAME,
+    'class_name': By.CLASS_NAME,
+    'link_text': By.LINK_TEXT,
+    'partial_link_text': By.PARTIAL_LINK_TEXT,
+}
+KEY_MAP = {name: getattr(Keys, name) for name in dir(Keys) if name.isupper()}
+
+def get_selenium_by(by_strategy: str) -> str:
+    """Translates a user-friendly locator string to the Selenium By class attribute."""
+    try:
+        return BY_MAP[by_strategy.lower()]
+    except KeyError:
+        raise ValueError(f"Unsupported locator strategy: {by_strategy}")
+
+def get_selenium_key(key: str) -> str:
+    """Translates a key name such as 'ENTER' to the Selenium Keys value."""
+    try:
+        return KEY_MAP[key.upper()]
+    except KeyError:
+        raise ValueError(f"Unsupported key: {key}")
@@ -0,0 +1,110 @@
+import asyncio
+import contextlib
+import contextvars
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# --- Streaming tool scheduler ---
+# agent_node starts each tool call as soon as the model has finished streaming it, so tool execution
+# overlaps with the model still generating the rest of the turn; tool_node then only collects results.
+
+class ToolScheduler:
+    """
+    Runs the tool calls of one agent turn as they are dispatched. A call that changes the browser waits
+    for every earlier call of the turn; read-only calls only wait for the last such call, so consecutive
+    read-only calls still run concurrently.
+    """
+    def __init__(self, run_tool: Callable[[dict], Awaitable], is_read_only: Callable[[str], bool]):
+        self._run_tool = run_tool
+        self._is_read_only = is_read_only
+        self.tasks: List[asyncio.Task] = []
+        self._last_mutating: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def dispatch(self, call) -> asyncio.Task:
+        read_only = self._is_read_only(call['name'])
+        if read_only:
+            dependencies = [self._last_mutating] if self._last_mutating else []
+        else:
+            dependencies = list(self.tasks)
+        task = asyncio.create_task(self._run_after(dependencies, call))
+        if not read_only:
+            self._last_mutating = task
+        self.tasks.append(task)
+        return task
+
+    async def _run_after(self, dependencies: List[asyncio.Task], call):
+        await asyncio.gather(*dependencies, return_exceptions=True)
+        if self._closed:
+            raise asyncio.CancelledError(f"Tool '{call['name']}' skipped: the agent run ended before it started")
+        return await self._run_tool(call)
+
+    async def results(self, return_exceptions: bool = False) -> list:
+        """Waits for every dispatched call and returns the results in dispatch order."""
+        try:
+            return await asyncio.gather(*self.tasks, return_exceptions=return_exceptions)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def close(self):
+        """
+        Skips the calls that have not started yet and waits for the running ones. Calls blocked in a
+        worker thread cannot be interrupted, so waiting is what keeps them off a browser being released.
+        """
+        self._closed = True
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+# The schedulers agent_node started, keyed by the id of their turn's first tool call, until tool_node
+# collects them. Scoped to one graph run by tool_turns(), never shared between requests.
+_pending_turns: contextvars.ContextVar[Optional[Dict[str, ToolScheduler]]] = contextvars.ContextVar(
+    "pending_tool_turns", default=None
+)
+
+@contextlib.asynccontextmanager
+async def tool_turns():
+    """
+    Wraps one graph run. Turns whose tool_node never ran (the recursion limit was hit, or the run
+    raised) are closed on exit, so none of their calls keeps acting on the browser afterwards.
+    """
+    pending: Dict[str, ToolScheduler] = {}
+    token = _pending_turns.set(pending)
+    try:
+        yield
+    finally:
+        _pending_turns.reset(token)
+        for scheduler in pending.values():
+            await scheduler.close()
+
+async def stream_turn(model, messages, scheduler: ToolScheduler):
+    """
+    Streams the model's response to `messages`, dispatching each tool call on `scheduler` as soon as
+    it is complete, and parks the scheduler for claim_turn(). Returns the full response.
+    """
+    pending = _pending_turns.get()
+    if pending is None:
+        raise RuntimeError("stream_turn must run inside tool_turns()")
+    response = None
+    try:
+        async for chunk in model.astream(messages):
+            response = chunk if response is None else response + chunk
+            # A call is complete once the model has moved on to the next one
+            streamed_indexes = {c["index"] for c in response.tool_call_chunks}
+            for call in response.tool_calls[len(scheduler.tasks):len(streamed_indexes) - 1]:
+                scheduler.dispatch(call)
+        # The stream has ended, so every remaining call is complete too
+        for call in response.tool_calls[len(scheduler.tasks):]:
+            scheduler.dispatch(call)
+    except BaseException:
+        await scheduler.close()
+        raise
+    if response.tool_calls:
+        pending[response.tool_calls[0]["id"]] = scheduler
+    return response
+
+def claim_turn(tool_calls) -> Optional[ToolScheduler]:
+    """Returns the scheduler stream_turn started these tool calls on, if any, and stops tracking it."""
+    pending = _pending_turns.get()
+    if pending is None or not tool_calls:
+        return None
+    return pending.pop(tool_calls[0]["id"], None)